@@ -9,8 +9,9 @@ class AlertRule(Document):
     scope = StringField(required=True, choices=["city", "zone", "segment", "asset_type"])
     city_id = StringField()
     zone_id = StringField()
+    segment_id = StringField()  # segment scope: one segment; unset = every segment in the city/zone
     asset_type = StringField()
-    meta = {"collection": "alert_rules"}
+    meta = {"collection": "alert_rules", "indexes": ["city_id"]}
 
 class AlertEvent(Document):
     rule_id = StringField(required=True)
@@ -0,0 +1,114 @@
+"""
+Alert rules compiled for one in-memory pass over the latest segment KPIs.
+
+RuleSet indexes rules by the narrowest target they name: a segment, an asset
+type (any type when the rule names none), a zone, or else every segment. Within
+a target rules are grouped by metric and operator with their thresholds sorted,
+so a KPI is matched with a few dict lookups and one bisect per group instead of
+a comparison per rule. A zone on a segment or asset_type rule is checked on its
+matches only. City restrictions are applied when the rules are loaded.
+"""
+import operator
+from bisect import bisect_left, bisect_right
+from apps.kpi.documents import FIELDS as KPI_FIELDS
+
+OPS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le, "==": operator.eq}
+
+ALL = ("all", None)
+ANY_TYPE = ("asset_type", None)
+
+def kpi_value(kpi, metric):
+    if metric in KPI_FIELDS:
+        return kpi.get(metric)
+    # try temps map for temp metrics
+    if metric.startswith("temp_"):
+        return (kpi.get("temps") or {}).get(metric.replace("temp_", ""))
+    return None
+
+def _bounds(op, thresholds, value):
+    # slice of the sorted thresholds t for which `value op t` holds
+    if op == ">":
+        return 0, bisect_left(thresholds, value)
+    if op == ">=":
+        return 0, bisect_right(thresholds, value)
+    if op == "<":
+        return bisect_right(thresholds, value), len(thresholds)
+    if op == "<=":
+        return bisect_left(thresholds, value), len(thresholds)
+    return bisect_left(thresholds, value), bisect_right(thresholds, value)
+
+class Rule:
+    __slots__ = ("id", "metric", "operator", "threshold", "severity", "zone_id")
+
+    def __init__(self, doc):
+        self.id = str(doc["_id"])
+        self.metric = doc["metric"]
+        self.operator = doc["operator"]
+        self.threshold = float(doc["threshold"])
+        self.severity = doc["severity"]
+        self.zone_id = doc.get("zone_id") or None
+
+def target(doc):
+    scope = doc.get("scope")
+    if scope == "segment" and doc.get("segment_id"):
+        return ("segment", doc["segment_id"])
+    if scope == "asset_type":
+        return ("asset_type", doc.get("asset_type")) if doc.get("asset_type") else ANY_TYPE
+    if doc.get("zone_id"):
+        return ("zone", doc["zone_id"])
+    return ALL
+
+class RuleSet:
+
+    def __init__(self, docs):
+        groups = {}
+        self.size = 0
+        for doc in docs:
+            if doc.get("operator") not in OPS:
+                continue
+            rule = Rule(doc)
+            tgt = target(doc)
+            if tgt[0] == "zone":
+                rule.zone_id = None  # the index already checks it
+            groups.setdefault(tgt, {}).setdefault((rule.metric, rule.operator), []).append(rule)
+            self.size += 1
+        # target -> [(metric, op, thresholds, rules)], rules sorted by threshold
+        self.index = {}
+        for tgt, by_key in groups.items():
+            compiled = []
+            for (metric, op), rules in by_key.items():
+                rules.sort(key=lambda r: r.threshold)
+                compiled.append((metric, op, [r.threshold for r in rules], rules))
+            self.index[tgt] = compiled
+
+    def __len__(self):
+        return self.size
+
+    def targets(self, segment_id, zone_id, asset_types):
+        yield ALL
+        yield ("segment", segment_id)
+        if zone_id:
+            yield ("zone", zone_id)
+        if asset_types:
+            yield ANY_TYPE
+            for t in asset_types:
+                yield ("asset_type", t)
+
+    def match(self, kpi, zone_id=None, asset_types=()):
+        """(rule, value) for every rule the segment KPI breaches."""
+        values = {}
+        for tgt in self.targets(kpi["segment_id"], zone_id, asset_types):
+            for metric, op, thresholds, rules in self.index.get(tgt, ()):
+                if metric not in values:
+                    try:
+                        v = float(kpi_value(kpi, metric))
+                    except (TypeError, ValueError):
+                        v = None
+                    values[metric] = v if v == v else None  # NaN never matches
+                value = values[metric]
+                if value is None:
+                    continue
+                lo, hi = _bounds(op, thresholds, value)
+                for rule in rules[lo:hi]:
+                    if rule.zone_id is None or rule.zone_id == zone_id:
+                        yield rule, value
@@ -0,0 +1,132 @@
+import random
+import time
+from bson import ObjectId
+from datetime import datetime, timezone
+from django.core.management.base import BaseCommand
+from apps.alerts.documents import AlertRule, AlertEvent
+from apps.alerts.engine import OPS, RuleSet, kpi_value
+from apps.alerts.tasks import evaluate_alerts_shard
+from apps.assets.cache import AssetSnapshot
+from apps.kpi import latest as kpi_latest
+
+CITY = "BENCH"
+BEAT_SECONDS = 60
+METRICS = ("kw_net", "heat_captured_kw", "pcm_soc", "parasitic_kw", "temp_surface", "temp_outlet")
+RANGES = {"kw_net": (0, 10), "heat_captured_kw": (0, 30), "pcm_soc": (0, 1), "parasitic_kw": (0, 2),
+          "temp_surface": (20, 70), "temp_outlet": (20, 50)}
+ASSET_TYPES = ("pcm", "conversion", "collector")
+
+def synthetic(segments, rules, zones, now):
+    seg_ids = [f"BENCH-S{i}" for i in range(segments)]
+    zone_ids = [f"BENCH-Z{i}" for i in range(zones)]
+    assets = AssetSnapshot({
+        "segments": [{"id": s, "city_id": CITY, "zone_id": zone_ids[i % zones]} for i, s in enumerate(seg_ids)],
+        "pcm": [{"id": f"P{i}", "segment_id": s} for i, s in enumerate(seg_ids) if i % 2 == 0],
+        "conversion": [{"id": f"C{i}", "segment_id": s} for i, s in enumerate(seg_ids) if i % 5 == 0],
+        "collectors": [],
+    })
+    kpis = [{
+        "scope": "segment", "city_id": CITY, "segment_id": s, "ts": now,
+        "kw_net": random.uniform(0, 10), "heat_captured_kw": random.uniform(0, 30), "pcm_soc": random.random(),
+        "parasitic_kw": random.uniform(0, 2), "temps": {"surface": random.uniform(20, 70), "outlet": random.uniform(20, 50)},
+    } for s in seg_ids]
+    docs = []
+    for _ in range(rules):
+        metric = random.choice(METRICS)
+        lo, hi = RANGES[metric]
+        op = random.choice(list(OPS))
+        # upper limits near the top of the range, lower limits near the bottom: few segments breach
+        edge = lo + (hi - lo) * random.uniform(0.0, 0.05) if op.startswith("<") else hi - (hi - lo) * random.uniform(0.0, 0.05)
+        doc = {
+            "_id": ObjectId(), "metric": metric, "operator": op, "threshold": round(edge, 2),
+            "severity": random.choice(("low", "medium", "high", "critical")),
+            "scope": random.choice(("city", "city", "zone", "segment", "asset_type")), "city_id": CITY,
+        }
+        if doc["scope"] == "zone" or random.random() < 0.1:
+            doc["zone_id"] = random.choice(zone_ids)
+        if doc["scope"] == "segment" and random.random() < 0.8:
+            doc["segment_id"] = random.choice(seg_ids)
+        if doc["scope"] == "asset_type" and random.random() < 0.7:
+            doc["asset_type"] = random.choice(ASSET_TYPES)
+        docs.append(doc)
+    return kpis, docs, assets
+
+def naive_matches(kpis, docs, assets):
+    # every rule against every segment, as the task did before RuleSet
+    out = set()
+    for r in docs:
+        for k in kpis:
+            seg_id = k["segment_id"]
+            if r.get("zone_id") and assets.zone_id(seg_id) != r["zone_id"]:
+                continue
+            if r["scope"] == "segment" and r.get("segment_id") and r["segment_id"] != seg_id:
+                continue
+            if r["scope"] == "asset_type":
+                types = assets.asset_types(seg_id)
+                if not (r["asset_type"] in types if r.get("asset_type") else types):
+                    continue
+            val = kpi_value(k, r["metric"])
+            if val is not None and OPS[r["operator"]](float(val), r["threshold"]):
+                out.add((str(r["_id"]), seg_id))
+    return out
+
+class Command(BaseCommand):
+    help = "Benchmark alert evaluation: compiled RuleSet vs rules x segments, in memory and optionally end to end."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rules", type=int, default=1000)
+        parser.add_argument("--segments", type=int, default=10000)
+        parser.add_argument("--zones", type=int, default=50)
+        parser.add_argument("--naive", action="store_true", help="Also time the rules x segments loop and compare matches.")
+        parser.add_argument("--db", action="store_true",
+                            help="Also seed BENCH rules and kpi_latest and time evaluate_alerts_shard, then remove them.")
+
+    def handle(self, *args, **options):
+        random.seed(7)
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        kpis, docs, assets = synthetic(options["segments"], options["rules"], options["zones"], now)
+
+        t0 = time.perf_counter()
+        rules = RuleSet(docs)
+        t1 = time.perf_counter()
+        matched = set()
+        for k in kpis:
+            seg_id = k["segment_id"]
+            for rule, _ in rules.match(k, assets.zone_id(seg_id), assets.asset_types(seg_id)):
+                matched.add((rule.id, seg_id))
+        t2 = time.perf_counter()
+        self.stdout.write(
+            f"compiled: {len(rules)} rules x {len(kpis)} segments in {t2 - t0:.3f}s "
+            f"({(t2 - t0) / BEAT_SECONDS:.2%} of the beat) | compile {(t1 - t0) * 1000:.1f}ms, "
+            f"match {t2 - t1:.3f}s, {len(matched)} matches"
+        )
+
+        if options["naive"]:
+            t0 = time.perf_counter()
+            expected = naive_matches(kpis, docs, assets)
+            dt = time.perf_counter() - t0
+            self.stdout.write(
+                f"   naive: {len(docs) * len(kpis)} checks in {dt:.2f}s ({dt / BEAT_SECONDS:.1%} of the beat), "
+                f"{len(expected)} matches, {'identical' if expected == matched else 'MISMATCH'}"
+            )
+
+        if options["db"]:
+            self._db_run(kpis, docs)
+
+    def _db_run(self, kpis, docs):
+        # asset metadata comes from the real asset cache here, so zone and asset_type rules
+        # only match BENCH segments that exist as assets; city and segment rules are exercised fully
+        try:
+            t0 = time.perf_counter()
+            AlertRule._get_collection().insert_many(docs)
+            kpi_latest.update(kpis)
+            self.stdout.write(f"Seeded {len(docs)} rules and {len(kpis)} latest KPIs in {time.perf_counter() - t0:.1f}s")
+            for run in ("first", "rerun"):
+                t0 = time.perf_counter()
+                result = evaluate_alerts_shard.run(CITY)
+                dt = time.perf_counter() - t0
+                self.stdout.write(f"{run:>8}: evaluate_alerts_shard in {dt:.2f}s ({dt / BEAT_SECONDS:.1%} of the beat) {result}")
+        finally:
+            AlertRule._get_collection().delete_many({"city_id": CITY})
+            AlertEvent._get_collection().delete_many({"city_id": CITY})
+            kpi_latest.collection().delete_many({"city_id": CITY})
@@ -8,6 +8,7 @@ class AlertRuleIn(serializers.Serializer):
     scope = serializers.ChoiceField(choices=["city", "zone", "segment", "asset_type"])
     city_id = serializers.CharField(required=False, allow_blank=True)
     zone_id = serializers.CharField(required=False, allow_blank=True)
+    segment_id = serializers.CharField(required=False, allow_blank=True)
     asset_type = serializers.CharField(required=False, allow_blank=True)
 
 class AlertEventActionIn(serializers.Serializer):
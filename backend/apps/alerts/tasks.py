@@ -1,62 +1,62 @@
 from celery import shared_task
+from datetime import timedelta
 from apps.alerts.documents import AlertRule, AlertEvent, now_utc
-from apps.kpi.documents import KPI
-from apps.telemetry.documents import Telemetry
+from apps.alerts.engine import RuleSet
+from apps.assets import cache as asset_cache
+from apps.common.sharding import dispatch, shard_of
+from apps.kpi import latest as kpi_latest
 
-def op_eval(op, a, b):
-    if op == ">": return a > b
-    if op == ">=": return a >= b
-    if op == "<": return a < b
-    if op == "<=": return a <= b
-    if op == "==": return a == b
-    return False
+# segments whose newest KPI is older than this are not evaluated
+KPI_MAX_AGE = timedelta(minutes=10)
+
+def load_rules(city_id):
+    # rules without a city apply everywhere
+    return RuleSet(AlertRule._get_collection().find({"city_id": {"$in": [None, "", city_id]}}))
 
 @shared_task
-def evaluate_alerts():
-    rules = list(AlertRule.objects.limit(500))
-    for r in rules:
-        # Evaluate using latest KPI per segment (MVP)
-        if r.scope in ["segment", "city", "zone"]:
-            qs = KPI.objects.filter(scope="segment").order_by("-ts")
-            if r.city_id:
-                qs = qs.filter(city_id=r.city_id)
+def evaluate_alerts_shard(city_id, part=0, parts=1):
+    rules = load_rules(city_id)
+    latest = kpi_latest.for_area("segment", city_id, since=now_utc() - KPI_MAX_AGE)
+    kpis = [k for seg_id, k in latest.items() if shard_of(seg_id, parts) == part]
+    if not rules or not kpis:
+        return {"segments": len(kpis), "rules": len(rules), "matches": 0, "opened": 0}
 
-            # evaluate up to N latest segments
-            seg_ids = qs.distinct("segment_id")[:50]
-            for seg_id in seg_ids:
-                latest = KPI.objects.filter(scope="segment", segment_id=seg_id).order_by("-ts").first()
-                if not latest:
-                    continue
-                val = None
-                if hasattr(latest, r.metric):
-                    val = getattr(latest, r.metric)
-                else:
-                    # try temps map for temp metrics
-                    if r.metric.startswith("temp_"):
-                        key = r.metric.replace("temp_", "")
-                        val = (latest.temps or {}).get(key)
-                if val is None:
-                    continue
-                try:
-                    val = float(val)
-                except Exception:
-                    continue
+    # if there's already an open event for this rule+segment, skip
+    open_events = {
+        (e["rule_id"], e["segment_id"])
+        for e in AlertEvent._get_collection().find(
+            {"status": {"$in": ["open", "acknowledged"]}, "city_id": city_id},
+            {"rule_id": 1, "segment_id": 1},
+        )
+    }
+    assets = asset_cache.snapshot()
+    matches = 0
+    events = []
+    for kpi in kpis:
+        seg_id = kpi["segment_id"]
+        zone_id = assets.zone_id(seg_id)
+        for rule, val in rules.match(kpi, zone_id, assets.asset_types(seg_id)):
+            matches += 1
+            if (rule.id, seg_id) in open_events:
+                continue
+            open_events.add((rule.id, seg_id))
+            events.append(AlertEvent(
+                rule_id=rule.id,
+                metric=rule.metric,
+                severity=rule.severity,
+                scope="segment",
+                city_id=city_id,
+                zone_id=zone_id,
+                segment_id=seg_id,
+                status="open",
+                opened_at=now_utc(),
+                value=val,
+            ))
+    if events:
+        AlertEvent.objects.insert(events, load_bulk=False)
+    return {"segments": len(kpis), "rules": len(rules), "matches": matches, "opened": len(events)}
 
-                if op_eval(r.operator, val, float(r.threshold)):
-                    # if there's already an open event for this rule+segment, skip
-                    exists = AlertEvent.objects.filter(rule_id=str(r.id), segment_id=seg_id, status__in=["open", "acknowledged"]).first()
-                    if exists:
-                        continue
-                    AlertEvent(
-                        rule_id=str(r.id),
-                        metric=r.metric,
-                        severity=r.severity,
-                        scope="segment",
-                        city_id=latest.city_id,
-                        zone_id=None,
-                        segment_id=seg_id,
-                        status="open",
-                        opened_at=now_utc(),
-                        value=val,
-                    ).save()
-    return {"rules": len(rules)}
+@shared_task
+def evaluate_alerts():
+    cities = kpi_latest.collection().distinct("city_id", {"scope": "segment", "ts": {"$gte": now_utc() - KPI_MAX_AGE}})
+    return dispatch("evaluate_alerts", evaluate_alerts_shard, sorted(c for c in cities if c))
@@ -5,6 +5,7 @@ from mongoengine.errors import DoesNotExist
 from .documents import AlertRule, AlertEvent
 from .serializers import AlertRuleIn, AlertEventActionIn
 from apps.authx.permissions import IsEngineerOrAbove, IsOpsOrAbove
+from apps.common.pagination import page_params, queryset_page
 
 def to_dict(doc):
     d = doc.to_mongo().to_dict()
@@ -57,6 +58,14 @@ class AlertEventList(APIView):
         qs = AlertEvent.objects
         if status_q:
             qs = qs.filter(status=status_q)
+        try:
+            page = page_params(request)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+        if page:
+            rows = queryset_page(qs, page, "opened_at")
+            results = [to_dict(x) for x in rows]
+            return Response({"results": results, "next_cursor": rows.next_cursor})
         qs = qs.order_by("-opened_at").limit(500)
         return Response([to_dict(x) for x in qs])
 
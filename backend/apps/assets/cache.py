@@ -0,0 +1,106 @@
+"""
+Process-local cache of asset metadata, reloaded lazily.
+
+The asset CRUD views call bump() after every write, which increments
+assets:version in Redis. snapshot() compares the cached version with Redis at
+most every ASSET_CACHE_CHECK_SECONDS and, when it changed, reloads every kind in
+MODEL_MAP from Mongo; other processes therefore see a write within that delay.
+With Redis unreachable it reloads every ASSET_CACHE_MAX_AGE seconds instead.
+"""
+import logging
+import threading
+import time
+import redis
+from django.conf import settings
+from .serializers import MODEL_MAP
+
+log = logging.getLogger(__name__)
+
+VERSION_KEY = "assets:version"
+# kinds attached to a segment, as used by asset_type alert rules
+SEGMENT_ASSET_KINDS = {"pcm": "pcm", "conversion": "conversion", "collectors": "collector"}
+
+class AssetSnapshot:
+    """All assets of one version; rows are dicts shaped like the API's (id as a string), sorted by id."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.by_id = {kind: {r["id"]: r for r in kind_rows} for kind, kind_rows in rows.items()}
+        self.pcm_by_segment = {}
+        self.asset_types_by_segment = {}
+        for kind, asset_type in SEGMENT_ASSET_KINDS.items():
+            for r in rows.get(kind, ()):
+                types = self.asset_types_by_segment.setdefault(r.get("segment_id"), set())
+                types.add(asset_type)
+                if r.get("type"):
+                    types.add(r["type"])
+        for r in rows.get("pcm", ()):
+            self.pcm_by_segment.setdefault(r.get("segment_id"), r)
+
+    def get(self, kind, id):
+        return self.by_id.get(kind, {}).get(id)
+
+    def segment(self, segment_id):
+        return self.by_id["segments"].get(segment_id)
+
+    def zone_id(self, segment_id):
+        seg = self.segment(segment_id)
+        return seg.get("zone_id") if seg else None
+
+    def asset_types(self, segment_id):
+        return self.asset_types_by_segment.get(segment_id, set())
+
+_lock = threading.Lock()
+_client = None
+_snapshot = None
+_version = None
+_loaded_at = 0.0
+_checked_at = 0.0
+
+def client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL, socket_connect_timeout=1, socket_timeout=2)
+    return _client
+
+def _load():
+    rows = {}
+    for kind, (Model, _In) in MODEL_MAP.items():
+        rows[kind] = []
+        for d in Model._get_collection().find().sort("_id", 1):
+            d["id"] = str(d.pop("_id"))
+            rows[kind].append(d)
+    return AssetSnapshot(rows)
+
+def snapshot():
+    global _snapshot, _version, _loaded_at, _checked_at
+    now = time.monotonic()
+    if _snapshot is not None and now - _checked_at < settings.ASSET_CACHE_CHECK_SECONDS:
+        return _snapshot
+    with _lock:
+        if _snapshot is not None and now - _checked_at < settings.ASSET_CACHE_CHECK_SECONDS:
+            return _snapshot
+        try:
+            version = client().get(VERSION_KEY)
+            stale = _snapshot is None or version != _version
+        except redis.RedisError as e:
+            log.warning("asset cache version not checked: %s", e)
+            version = None
+            stale = _snapshot is None or now - _loaded_at >= settings.ASSET_CACHE_MAX_AGE
+        if stale:
+            _snapshot = _load()
+            _version = version
+            _loaded_at = now
+        _checked_at = now
+        return _snapshot
+
+def bump():
+    """Call after any asset write: this process reloads on its next read, the others within the check interval."""
+    global _checked_at, _version
+    with _lock:
+        _checked_at = 0.0
+        _version = None
+    try:
+        client().incr(VERSION_KEY)
+    except redis.RedisError as e:
+        log.warning("asset cache version not bumped: %s", e)
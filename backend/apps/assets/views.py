@@ -1,9 +1,12 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from bson import ObjectId
 from mongoengine.errors import DoesNotExist, ValidationError
+from . import cache
 from .serializers import MODEL_MAP, MongoDocSerializer
 from apps.authx.permissions import IsEngineerOrAbove, IsOpsOrAbove
+from apps.common.pagination import Page, page_params
 
 def _get_model(kind: str):
     if kind not in MODEL_MAP:
@@ -14,14 +17,26 @@ class MongoCrudListCreate(APIView):
     permission_classes = [IsOpsOrAbove]
 
     def get(self, request, kind: str):
-        Model, _In = _get_model(kind)
-        qs = Model.objects
+        _get_model(kind)
+        # served from the asset cache, rows in id order
+        rows = cache.snapshot().rows[kind]
         # common filters
         for key in ["city_id", "zone_id", "road_id", "segment_id", "linked_asset_id"]:
             v = request.query_params.get(key)
             if v:
-                qs = qs.filter(**{key: v})
-        return Response([MongoDocSerializer().to_representation(x) for x in qs.limit(500)])
+                rows = [r for r in rows if r.get(key) == v]
+        try:
+            page = page_params(request)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+        if page:
+            size, after = page
+            if after:
+                rows = [r for r in rows if ObjectId(r["id"]) > after[1]]
+            rows = Page(rows[:size + 1], size, lambda r: (None, r["id"]))
+            results = list(rows)
+            return Response({"results": results, "next_cursor": rows.next_cursor})
+        return Response(rows[:500])
 
     def post(self, request, kind: str):
         Model, InSer = _get_model(kind)
@@ -31,6 +46,7 @@ class MongoCrudListCreate(APIView):
             doc = Model(**ser.validated_data).save()
         except ValidationError as e:
             return Response({"detail": str(e)}, status=400)
+        cache.bump()
         return Response(MongoDocSerializer().to_representation(doc), status=201)
 
 class MongoCrudDetail(APIView):
@@ -38,6 +54,7 @@ class MongoCrudDetail(APIView):
 
     def get(self, request, kind: str, id: str):
         Model, _In = _get_model(kind)
+        # from Mongo, not the asset cache: a single _id lookup, and it must reflect a PUT/DELETE just made
         try:
             doc = Model.objects.get(id=id)
         except DoesNotExist:
@@ -55,6 +72,7 @@ class MongoCrudDetail(APIView):
         for k, v in ser.validated_data.items():
             setattr(doc, k, v)
         doc.save()
+        cache.bump()
         return Response(MongoDocSerializer().to_representation(doc))
 
     def delete(self, request, kind: str, id: str):
@@ -64,4 +82,5 @@ class MongoCrudDetail(APIView):
         except DoesNotExist:
             return Response({"detail": "Not found"}, status=404)
         doc.delete()
+        cache.bump()
         return Response(status=204)
@@ -0,0 +1,45 @@
+"""
+Prometheus /metrics for the API processes.
+
+Under gunicorn every worker has its own registry; set PROMETHEUS_MULTIPROC_DIR
+(cleared before start, see config/gunicorn.py) so a scrape of any worker returns
+the sum over all of them.
+"""
+import os
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+from django.http import HttpResponse
+
+REQUESTS = Counter("http_requests_total", "API requests.", ["method", "route", "status"])
+LATENCY = Histogram(
+    "http_request_duration_seconds", "API request latency.", ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+def registry():
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+    from prometheus_client import multiprocess
+    reg = CollectorRegistry()
+    multiprocess.MultiProcessCollector(reg)
+    return reg
+
+def metrics_view(request):
+    return HttpResponse(generate_latest(registry()), content_type=CONTENT_TYPE_LATEST)
+
+class MetricsMiddleware:
+    """Request count and latency per URL pattern (not per path, to keep label cardinality bounded)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        t0 = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        route = match.route if match else "unmatched"
+        if route != "metrics":
+            # streamed bodies are timed to the first byte, which is what the view controls
+            LATENCY.labels(request.method, route).observe(time.perf_counter() - t0)
+            REQUESTS.labels(request.method, route, response.status_code).inc()
+        return response
@@ -0,0 +1,97 @@
+"""
+Keyset (continuation-token) pagination over (sort field, _id).
+
+A token carries the sort value and _id of the last row of a page; the next page is
+everything strictly after that pair in sort order, so every page is the same index
+range scan no matter how deep it is. Tokens are urlsafe base64 JSON and opaque to
+clients: they pass back `next_cursor` as ?cursor= until it comes back null.
+
+Listings only switch to the {"results": [...], "next_cursor": ...} envelope when
+page_size or cursor is given; without them they keep their capped plain lists.
+"""
+import base64
+import json
+from datetime import datetime, timezone
+from bson import ObjectId
+from bson.errors import InvalidId
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+def encode_cursor(value, oid):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        v = {"d": value.isoformat()}
+    else:
+        v = {"v": value}
+    raw = json.dumps([v, str(oid)], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+def decode_cursor(token):
+    try:
+        v, oid = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        value = datetime.fromisoformat(v["d"]) if "d" in v else v["v"]
+        return value, ObjectId(oid)
+    except (ValueError, TypeError, KeyError, InvalidId) as e:
+        raise ValueError("Invalid cursor") from e
+
+def page_params(request, default_size=DEFAULT_PAGE_SIZE):
+    """(page_size, after) when the request asks for a page, None for a legacy listing; raises ValueError."""
+    size = request.query_params.get("page_size")
+    token = request.query_params.get("cursor")
+    if not size and not token:
+        return None
+    try:
+        size = int(size) if size else default_size
+    except ValueError:
+        raise ValueError("page_size must be an integer")
+    size = max(1, min(size, MAX_PAGE_SIZE))
+    return size, decode_cursor(token) if token else None
+
+def after_filter(field, after, descending=False):
+    value, oid = after
+    op = "$lt" if descending else "$gt"
+    if field == "_id":
+        return {"_id": {op: oid}}
+    return {"$or": [{field: {op: value}}, {field: value, "_id": {op: oid}}]}
+
+class Page:
+    """
+    Yields at most `size` rows from a cursor limited to size + 1; once exhausted,
+    next_cursor holds the token for the following page (None on the last one).
+    """
+
+    def __init__(self, rows, size, key):
+        self.rows = rows
+        self.size = size
+        self.key = key
+        self.next_cursor = None
+
+    def __iter__(self):
+        last = None
+        for i, row in enumerate(self.rows):
+            if i == self.size:
+                self.next_cursor = encode_cursor(*last)
+                return
+            # taken before yielding, callers may reshape the row
+            last = self.key(row)
+            yield row
+
+def pymongo_page(collection, q, projection, page, field="ts", descending=False):
+    size, after = page
+    if after:
+        q = {**q, **after_filter(field, after, descending)}
+    direction = -1 if descending else 1
+    cur = collection.find(q, projection).sort([(field, direction), ("_id", direction)]).limit(size + 1)
+    return Page(cur, size, lambda m: (m[field], m["_id"]))
+
+def queryset_page(qs, page, field, descending=True, db_field=None):
+    """Same for a MongoEngine queryset ordered by `field` (db_field when it is stored under another name)."""
+    size, after = page
+    by_id = field == "id"
+    if after:
+        qs = qs.filter(__raw__=after_filter("_id" if by_id else db_field or field, after, descending))
+    sign = "-" if descending else ""
+    qs = qs.order_by(f"{sign}id") if by_id else qs.order_by(f"{sign}{field}", f"{sign}id")
+    return Page(qs.limit(size + 1), size, lambda d: (None if by_id else getattr(d, field), d.id))
@@ -0,0 +1,84 @@
+"""
+Fan-out of periodic jobs across Celery workers.
+
+A beat task calls dispatch(): it takes a Redis lock named after the job, then runs
+one shard task per (city, part) as a chord whose callback sums the shard results
+and releases the lock. While a run is in flight the next beat is skipped; if a
+shard dies and the callback never runs, the lock simply expires after
+TASK_RUN_LOCK_SECONDS. Within a city, segments go to part zlib.crc32(id) % parts,
+the same stable hash the MQTT consumer routes topics with. Unsharded jobs take
+the same kind of lock through run_locked().
+"""
+import logging
+import uuid
+import zlib
+import redis
+from celery import chord, group, shared_task
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+LOCK_KEY = "lock:{}"
+# delete the key only if it still holds our token
+RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_client = None
+
+def client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL, socket_connect_timeout=1, socket_timeout=2)
+    return _client
+
+def shard_of(segment_id, parts):
+    return zlib.crc32(segment_id.encode()) % parts if parts > 1 else 0
+
+def acquire(name, ttl):
+    """Token if the lock was free, else None."""
+    token = uuid.uuid4().hex
+    return token if client().set(LOCK_KEY.format(name), token, nx=True, ex=ttl) else None
+
+@shared_task
+def release_lock(name, token):
+    return bool(client().eval(RELEASE, 1, LOCK_KEY.format(name), token))
+
+@shared_task
+def merge_shard_results(results, name, token):
+    summary = {"shards": len(results)}
+    for r in results:
+        for k, v in r.items():
+            summary[k] = summary.get(k, 0) + v
+    release_lock(name, token)
+    log.info("%s: %s", name, summary)
+    return summary
+
+def run_locked(name, fn, *args, **kwargs):
+    """fn(*args, **kwargs) under the job's lock, in this worker; {"skipped": True} while another run holds it."""
+    token = acquire(name, settings.TASK_RUN_LOCK_SECONDS)
+    if token is None:
+        log.warning("%s: previous run still in flight, skipping", name)
+        return {"skipped": True}
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        release_lock(name, token)
+
+def dispatch(name, shard_task, cities, *args, parts=None):
+    """Run shard_task(*args, city_id, part, parts) for every city and part as one chord under the job's lock."""
+    parts = parts or settings.TASK_SHARDS_PER_CITY
+    token = acquire(name, settings.TASK_RUN_LOCK_SECONDS)
+    if token is None:
+        log.warning("%s: previous run still in flight, skipping", name)
+        return {"skipped": True}
+    shards = [shard_task.s(*args, city_id, part, parts) for city_id in cities for part in range(parts)]
+    if not shards:
+        release_lock(name, token)
+        return {"shards": 0}
+    callback = merge_shard_results.s(name, token).on_error(release_lock.si(name, token))
+    chord(group(shards), callback).apply_async()
+    return {"shards": len(shards)}
@@ -0,0 +1,118 @@
+"""
+Streaming JSON responses straight from pymongo cursors.
+
+Rows are plain dicts as pymongo returns them (no MongoEngine documents); they are
+encoded in small batches while the cursor is iterated, so a response costs memory
+proportional to one batch instead of the whole result.
+
+format=columnar responses are built by `columns`: one epoch-millisecond timestamp
+array plus one value array per field, filled straight from the cursor rows.
+"""
+import json
+from datetime import datetime, timezone
+from bson import ObjectId
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+BATCH = 500
+FORMATS = ("rows", "columnar")
+
+def _default(o):
+    if isinstance(o, datetime):
+        return o.isoformat()
+    if isinstance(o, ObjectId):
+        return str(o)
+    raise TypeError(f"{type(o).__name__} is not JSON serializable")
+
+_encoder = json.JSONEncoder(default=_default, separators=(",", ":"))
+
+def encode(obj):
+    return _encoder.encode(obj)
+
+def iter_json_array(rows, batch=BATCH):
+    yield "["
+    buf, sep = [], ""
+    for row in rows:
+        buf.append(_encoder.encode(row))
+        if len(buf) >= batch:
+            yield sep + ",".join(buf)
+            buf, sep = [], ","
+    if buf:
+        yield sep + ",".join(buf)
+    yield "]"
+
+def iter_json_page(rows, page):
+    # rows is drawn from the Page, so next_cursor is known once the array is written
+    yield '{"results":'
+    yield from iter_json_array(rows)
+    yield f',"next_cursor":{_encoder.encode(page.next_cursor)}}}'
+
+def json_stream_response(rows, status=200, headers=None, page=None):
+    body = iter_json_array(rows) if page is None else iter_json_page(rows, page)
+    return StreamingHttpResponse(body, content_type="application/json", status=status, headers=headers)
+
+def newest_ascending(collection, q, projection=None, limit=2000, sort_field="ts"):
+    """
+    Cursor over the newest `limit` matching documents in ascending order, without
+    materialising them: find the oldest timestamp inside the window first, then
+    stream forward from it.
+    """
+    edge = list(collection.find(q, {sort_field: 1}).sort(sort_field, -1).skip(limit - 1).limit(1))
+    if edge:
+        q = {**q, sort_field: {**(q.get(sort_field) or {}), "$gte": edge[0][sort_field]}}
+    return collection.find(q, projection).sort(sort_field, 1)
+
+class ColumnarJSONRenderer(JSONRenderer):
+    # lets ?format=columnar through DRF's URL format override; the body is still JSON
+    format = "columnar"
+
+def _epoch_ms(ts):
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() * 1000)
+
+def columns(rows, fields, ts_field="ts", expand=("temps",)):
+    """
+    {"ts": [...], "columns": {field: [...]}} from an iterable of rows. Fields listed in
+    `expand` are maps (temps) and become one "<field>.<key>" column per key seen;
+    "<field>.<key>" can also be asked for directly. Missing values are null.
+    """
+    maps = [f for f in fields if f in expand]
+    plain = [f for f in fields if f not in expand and "." not in f]
+    nested = [(f, *f.split(".", 1)) for f in fields if "." in f and f.split(".", 1)[0] not in maps]
+    ts, cols = [], {f: [] for f in (*plain, *(f for f, _, _ in nested))}
+    seen = {m: [] for m in maps}
+    n = 0
+    for row in rows:
+        ts.append(_epoch_ms(row[ts_field]))
+        for f in plain:
+            cols[f].append(row.get(f))
+        for f, outer, inner in nested:
+            cols[f].append((row.get(outer) or {}).get(inner))
+        for m in maps:
+            values = row.get(m) or {}
+            for k in values:
+                if f"{m}.{k}" not in cols:
+                    cols[f"{m}.{k}"] = [None] * n
+                    seen[m].append(k)
+            for k in seen[m]:
+                cols[f"{m}.{k}"].append(values.get(k))
+        n += 1
+    return {"ts": ts, "columns": cols}
+
+def requested_fields(request, allowed):
+    """fields=a,b,temps.surface -> list of field names, [] when not given; raises ValueError on unknown names."""
+    raw = request.query_params.get("fields")
+    if not raw:
+        return []
+    fields = [f.strip() for f in raw.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in allowed and not (f.startswith("temps.") and "temps" in allowed)]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def requested_format(request):
+    fmt = request.query_params.get("format") or "rows"
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    return fmt
@@ -0,0 +1,103 @@
+"""
+Zone and city KPIs materialised from the latest segment KPIs.
+
+One pipeline takes the newest KPI of every segment that reported in the last
+LATEST_WINDOW, joins the segment's zone (road_segments) and PCM capacity
+(pcm_modules), and $groups by (city, zone); city figures are folded from the zone
+groups. Power fields are summed, pcm_soc is weighted by PCM capacity (plain mean
+where a group has no PCM capacity), temps_min / temps_max hold per-key extremes.
+Results are upserted as scope="zone" / scope="city" KPI documents stamped with the
+cycle's minute, so overview pages read a handful of documents.
+"""
+from datetime import datetime, timezone, timedelta
+from apps.telemetry.documents import TEMP_KEYS
+from .documents import KPI
+
+LATEST_WINDOW = timedelta(minutes=10)
+SUM_FIELDS = ("heat_captured_kw", "kw_net", "kw_gross", "parasitic_kw")
+
+def latest_segment_stages(since, city_id=None):
+    """Pipeline stages yielding the newest segment KPI since `since` per segment; the sort walks the (segment_id, ts) index backwards."""
+    match = {"scope": "segment", "ts": {"$gte": since}}
+    if city_id:
+        match["city_id"] = city_id
+    return [
+        {"$match": match},
+        {"$sort": {"segment_id": -1, "ts": -1}},
+        {"$group": {"_id": "$segment_id", "doc": {"$first": "$$ROOT"}}},
+        {"$replaceRoot": {"newRoot": "$doc"}},
+    ]
+
+def _pipeline(since):
+    group = {
+        "_id": {"city_id": "$city_id", "zone_id": "$zone_id"},
+        "segments": {"$sum": 1},
+        "ts": {"$max": "$ts"},
+        "soc_weighted": {"$sum": {"$multiply": [{"$ifNull": ["$pcm_soc", 0]}, "$capacity"]}},
+        "soc_capacity": {"$sum": {"$cond": [{"$ne": ["$pcm_soc", None]}, "$capacity", 0]}},
+        "soc_sum": {"$sum": "$pcm_soc"},
+        "soc_count": {"$sum": {"$cond": [{"$ne": ["$pcm_soc", None]}, 1, 0]}},
+    }
+    for f in SUM_FIELDS:
+        group[f] = {"$sum": f"${f}"}
+    for k in TEMP_KEYS:
+        group[f"min_{k}"] = {"$min": f"$temps.{k}"}
+        group[f"max_{k}"] = {"$max": f"$temps.{k}"}
+    return latest_segment_stages(since) + [
+        {"$addFields": {"segment_oid": {"$convert": {"input": "$segment_id", "to": "objectId", "onError": None, "onNull": None}}}},
+        {"$lookup": {"from": "road_segments", "localField": "segment_oid", "foreignField": "_id", "as": "road_segment"}},
+        {"$lookup": {"from": "pcm_modules", "localField": "segment_id", "foreignField": "segment_id", "as": "pcm"}},
+        {"$addFields": {
+            "zone_id": {"$first": "$road_segment.zone_id"},
+            "capacity": {"$sum": "$pcm.capacity_kwh_th"},
+        }},
+        {"$group": group},
+    ]
+
+def _kpi(scope, g, ts):
+    cap = g["soc_capacity"]
+    if cap:
+        soc = g["soc_weighted"] / cap
+    else:
+        soc = g["soc_sum"] / g["soc_count"] if g["soc_count"] else None
+    doc = {
+        "scope": scope,
+        "city_id": g["_id"]["city_id"],
+        "ts": ts,
+        "segments": g["segments"],
+        "pcm_soc": soc,
+        "temps_min": {k: g[f"min_{k}"] for k in TEMP_KEYS if g.get(f"min_{k}") is not None},
+        "temps_max": {k: g[f"max_{k}"] for k in TEMP_KEYS if g.get(f"max_{k}") is not None},
+        **{f: g[f] for f in SUM_FIELDS},
+    }
+    if scope == "zone":
+        doc["zone_id"] = g["_id"]["zone_id"]
+    return doc
+
+def _fold_city(groups):
+    cities = {}
+    for g in groups:
+        city_id = g["_id"]["city_id"]
+        c = cities.get(city_id)
+        if c is None:
+            cities[city_id] = {**g, "_id": {"city_id": city_id, "zone_id": None}}
+            continue
+        for f in ("segments", "soc_weighted", "soc_capacity", "soc_sum", "soc_count", *SUM_FIELDS):
+            c[f] += g[f]
+        for k in TEMP_KEYS:
+            for agg, pick in (("min", min), ("max", max)):
+                a, b = c.get(f"{agg}_{k}"), g.get(f"{agg}_{k}")
+                c[f"{agg}_{k}"] = b if a is None else a if b is None else pick(a, b)
+    return cities.values()
+
+def aggregate_kpis(now=None):
+    """Write this minute's zone and city KPIs; returns how many of each."""
+    from .tasks import upsert_kpis
+    now = now or datetime.now(timezone.utc)
+    ts = now.replace(second=0, microsecond=0)
+    groups = [g for g in KPI._get_collection().aggregate(_pipeline(now - LATEST_WINDOW), allowDiskUse=True)
+              if g["_id"].get("city_id")]
+    zones = [_kpi("zone", g, ts) for g in groups if g["_id"].get("zone_id")]
+    cities = [_kpi("city", g, ts) for g in _fold_city(groups)]
+    upsert_kpis(zones + cities)
+    return {"zones": len(zones), "cities": len(cities)}
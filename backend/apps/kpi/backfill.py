@@ -0,0 +1,110 @@
+"""
+Historical segment KPI recomputation (manage.py backfill_kpis).
+
+Same maths as tasks.segment_kpi, vectorised with NumPy: one segment's telemetry
+is read in ts order in chunks, turned into columns, and every `every` seconds the
+last sample of the interval becomes a KPI (what the minute beat would have picked;
+every=0 keeps every sample). Results go out with tasks.upsert_kpis, so rerunning
+overwrites the KPIs it wrote before.
+"""
+from datetime import timezone
+import numpy as np
+from apps.telemetry import storage
+from .documents import KPI
+from .tasks import CP_WATER_KJ_PER_KG_K, upsert_kpis
+
+FIELDS = ("city_id", "segment_id", "ts", "temps", "flow", "kw_gross", "pump_power", "fan_power", "pcm_temp")
+UPSERT_BATCH = 5000
+
+def _ms(ts):
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() * 1000)
+
+def _column(values, n):
+    return np.fromiter(values, dtype=np.float64, count=n)
+
+def kpi_columns(rows, melt_range=None):
+    """(heat_captured_kw, pcm_soc, kw_net, kw_gross, parasitic_kw) arrays for telemetry rows."""
+    n = len(rows)
+    temps = [r.get("temps") or {} for r in rows]
+    t_in = _column((float(t.get("inlet", t.get("t_in", 0.0)) or 0.0) for t in temps), n)
+    t_out = _column((float(t.get("outlet", t.get("t_out", 0.0)) or 0.0) for t in temps), n)
+    m_dot = _column((float(r.get("flow") or 0.0) for r in rows), n)
+    kw_gross = _column((float(r.get("kw_gross") or 0.0) for r in rows), n)
+    parasitic = (_column((float(r.get("pump_power") or 0.0) for r in rows), n)
+                 + _column((float(r.get("fan_power") or 0.0) for r in rows), n))
+
+    heat_kw = np.maximum(m_dot * CP_WATER_KJ_PER_KG_K * (t_out - t_in), 0.0)
+    pcm_soc = np.clip(0.5 + 0.05 * np.tanh(heat_kw / 10.0), 0.0, 1.0)
+    if melt_range:
+        tmin, tmax = melt_range
+        pcm_temp = _column((np.nan if r.get("pcm_temp") is None else float(r["pcm_temp"]) for r in rows), n)
+        has_pcm = ~np.isnan(pcm_temp)
+        pcm_soc[has_pcm] = np.clip((pcm_temp[has_pcm] - tmin) / (tmax - tmin + 1e-6), 0.0, 1.0)
+    return heat_kw, pcm_soc, kw_gross - parasitic, kw_gross, parasitic
+
+def interval_ends(ts_ms, every_ms):
+    """Mask of the last sample in each every_ms interval of ascending ts_ms."""
+    if not every_ms:
+        return np.ones(len(ts_ms), dtype=bool)
+    bucket = ts_ms // every_ms
+    return np.append(bucket[1:] != bucket[:-1], True)
+
+def _kpis(rows, melt_range):
+    heat_kw, pcm_soc, kw_net, kw_gross, parasitic = kpi_columns(rows, melt_range)
+    return [{
+        "scope": "segment",
+        "city_id": r["city_id"],
+        "segment_id": r["segment_id"],
+        "ts": r["ts"],
+        "heat_captured_kw": float(heat_kw[i]),
+        "pcm_soc": float(pcm_soc[i]),
+        "kw_net": float(kw_net[i]),
+        "kw_gross": float(kw_gross[i]),
+        "parasitic_kw": float(parasitic[i]),
+        "temps": r.get("temps") or {},
+    } for i, r in enumerate(rows)]
+
+def segment_ids(city_id=None, ts_from=None, ts_to=None):
+    q = storage.query(scope="segment", city_id=city_id, ts_from=ts_from, ts_to=ts_to)
+    return sorted(s for s in storage.collection().distinct(storage.field("segment_id"), q) if s)
+
+def backfill_segment(segment_id, ts_from, ts_to, every=60, melt_range=None, chunk_rows=50000, replace=False):
+    """Recompute one segment's KPIs in [ts_from, ts_to]; returns (samples read, KPIs written)."""
+    if replace:
+        KPI._get_collection().delete_many({"scope": "segment", "segment_id": segment_id, "ts": {"$gte": ts_from, "$lte": ts_to}})
+    cursor = storage.collection().find(
+        storage.query(scope="segment", segment_id=segment_id, ts_from=ts_from, ts_to=ts_to),
+        storage.projection(FIELDS),
+        sort=[("ts", 1)],
+        batch_size=min(chunk_rows, 10000),
+    )
+    every_ms = int(every * 1000)
+    read = written = 0
+    carry = []
+    exhausted = False
+    while not exhausted:
+        rows, carried = carry, len(carry)
+        for doc in cursor:
+            rows.append(storage.from_storage(doc))
+            if len(rows) - carried >= chunk_rows:
+                break
+        else:
+            exhausted = True
+        read += len(rows) - carried
+        if not rows:
+            break
+        keep = interval_ends(np.fromiter((_ms(r["ts"]) for r in rows), dtype=np.int64, count=len(rows)), every_ms)
+        carry = []
+        if not exhausted:
+            # the last interval may continue in the next chunk
+            cut = len(rows) - 1
+            while cut > 0 and not keep[cut - 1]:
+                cut -= 1
+            rows, carry, keep = rows[:cut], rows[cut:], keep[:cut]
+        kpis = _kpis([r for r, k in zip(rows, keep) if k], melt_range)
+        for i in range(0, len(kpis), UPSERT_BATCH):
+            upsert_kpis(kpis[i:i + UPSERT_BATCH])
+        written += len(kpis)
+    return read, written
@@ -1,9 +1,10 @@
-from mongoengine import Document, StringField, DateTimeField, FloatField, DictField
+from mongoengine import Document, StringField, DateTimeField, FloatField, DictField, IntField
 from datetime import datetime, timezone
 
 class KPI(Document):
-    scope = StringField(required=True, choices=["segment", "asset"])
+    scope = StringField(required=True, choices=["segment", "asset", "zone", "city"])
     city_id = StringField(required=True)
+    zone_id = StringField()
     segment_id = StringField()
     asset_id = StringField()
 
@@ -15,10 +16,26 @@ class KPI(Document):
     parasitic_kw = FloatField()
     temps = DictField()
 
+    # zone / city aggregates (aggregates.py)
+    segments = IntField()
+    temps_min = DictField()
+    temps_max = DictField()
+
     meta = {
         "collection": "kpi",
-        "indexes": ["city_id", "segment_id", "asset_id", "scope", "-ts"],
+        "indexes": ["city_id", "segment_id", "asset_id", "scope", "-ts", ("segment_id", "ts"), ("scope", "city_id", "ts")],
     }
 
+FIELDS = ("scope", "city_id", "zone_id", "segment_id", "asset_id", "ts",
+          "heat_captured_kw", "pcm_soc", "kw_net", "kw_gross", "parasitic_kw", "temps",
+          "segments", "temps_min", "temps_max")
+# what identifies a KPI of each scope
+KEY_FIELDS = {
+    "segment": ("scope", "segment_id", "ts"),
+    "asset": ("scope", "asset_id", "ts"),
+    "zone": ("scope", "city_id", "zone_id", "ts"),
+    "city": ("scope", "city_id", "ts"),
+}
+
 def now_utc():
     return datetime.now(timezone.utc)
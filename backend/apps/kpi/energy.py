@@ -0,0 +1,227 @@
+"""
+Energy ledger: per-segment hourly and daily energy integrated from KPIs.
+
+Every run reads the segment KPIs that arrived since the watermark in ts order and
+integrates kw_gross, kw_net and heat_captured_kw with the trapezoidal rule between
+consecutive samples of a segment, splitting intervals at hour boundaries. The last
+sample of each segment is kept in ENERGY_POINTS so the next run continues the
+curve. Samples further apart than ENERGY_MAX_GAP_SECONDS are not bridged, and
+repeated timestamps add nothing. Deltas are applied with $inc upserts to
+energy_hourly and energy_daily (hours and days in TIME_ZONE).
+
+Each write is guarded by the window it books: a bucket records the end of the
+last window applied to it and only takes a window that ends later. A window
+booked again after a crash, or by an overlapping run, matches no bucket; the
+upsert then hits the unique index and that error is ignored. Runs also hold the
+job's Redis lock (sharding.run_locked), and a run stops after max_seconds so a
+long catch-up is spread over several beats.
+
+A bucket document:
+    {segment_id, city_id, bucket, kwh_gross, kwh_net, kwh_th, co2_kg, inr, seconds, window}
+
+co2_kg and inr are valued from kwh_net with CO2_KG_PER_KWH / INR_PER_KWH at the
+time the energy is booked.
+"""
+import time
+from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
+from django.conf import settings
+from mongoengine.connection import get_db
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from apps.telemetry.dedup import DUPLICATE_KEY_ERROR
+from .documents import KPI
+
+STATE_COLLECTION = "energy_ledger_state"
+POINTS_COLLECTION = "energy_ledger_points"
+POWER_FIELDS = (("kw_gross", "kwh_gross"), ("kw_net", "kwh_net"), ("heat_captured_kw", "kwh_th"))
+TOTAL_FIELDS = ("kwh_gross", "kwh_net", "kwh_th", "co2_kg", "inr", "seconds")
+RESOLUTIONS = ("hour", "day")
+HOUR = timedelta(hours=1)
+
+TZ = ZoneInfo(settings.TIME_ZONE)
+
+_ready = set()
+
+def ledger_collection(resolution):
+    coll = get_db()[f"energy_{'hourly' if resolution == 'hour' else 'daily'}"]
+    if resolution not in _ready:
+        coll.create_index([("segment_id", ASCENDING), ("bucket", ASCENDING)], unique=True)
+        coll.create_index([("city_id", ASCENDING), ("bucket", ASCENDING)])
+        _ready.add(resolution)
+    return coll
+
+def _utc(ts):
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+def hour_start(ts):
+    return ts.astimezone(TZ).replace(minute=0, second=0, microsecond=0).astimezone(timezone.utc)
+
+def day_start(ts):
+    return ts.astimezone(TZ).replace(hour=0, minute=0, second=0, microsecond=0).astimezone(timezone.utc)
+
+def _power(kpi):
+    return [float(kpi.get(f) or 0.0) for f, _ in POWER_FIELDS]
+
+def integrate(prev, cur, into, max_gap):
+    """Add the trapezoid between two points (ts, [kW...]) to into[hour] = [kWh..., seconds]."""
+    (t0, p0), (t1, p1) = prev, cur
+    span = (t1 - t0).total_seconds()
+    if span <= 0 or span > max_gap:
+        return
+    a, pa = t0, p0
+    while a < t1:
+        b = min(hour_start(a) + HOUR, t1)
+        frac = (b - t0).total_seconds() / span
+        pb = [x0 + (x1 - x0) * frac for x0, x1 in zip(p0, p1)]
+        dt = (b - a).total_seconds()
+        acc = into.setdefault(hour_start(a), [0.0] * (len(POWER_FIELDS) + 1))
+        for i, (x, y) in enumerate(zip(pa, pb)):
+            acc[i] += (x + y) / 2.0 * dt / 3600.0
+        acc[-1] += dt
+        a, pa = b, pb
+
+def _updates(deltas, bucket_of, window):
+    # {(segment_id, hour): (city_id, [kWh..., seconds])} -> $inc upserts per (segment, bucket) not yet given this window
+    merged = {}
+    for (seg_id, hour), (city_id, acc) in deltas.items():
+        key = (seg_id, bucket_of(hour))
+        cur = merged.setdefault(key, (city_id, [0.0] * len(acc)))[1]
+        for i, v in enumerate(acc):
+            cur[i] += v
+    ops = []
+    for (seg_id, bucket), (city_id, acc) in merged.items():
+        inc = {name: acc[i] for i, (_, name) in enumerate(POWER_FIELDS)}
+        inc["seconds"] = acc[-1]
+        inc["co2_kg"] = inc["kwh_net"] * settings.CO2_KG_PER_KWH
+        inc["inr"] = inc["kwh_net"] * settings.INR_PER_KWH
+        ops.append(UpdateOne(
+            {"segment_id": seg_id, "bucket": bucket, "window": {"$not": {"$gte": window}}},
+            {"$inc": inc, "$set": {"city_id": city_id, "window": window}},
+            upsert=True,
+        ))
+    return ops
+
+def book(kpis, points, max_gap):
+    """Integrate ts-ordered segment KPIs onto the last known points; returns {(segment_id, hour): (city_id, acc)}."""
+    deltas = {}
+    for k in kpis:
+        seg_id = k.get("segment_id")
+        if not seg_id:
+            continue
+        cur = (_utc(k["ts"]), _power(k))
+        prev = points.get(seg_id)
+        if prev is not None and cur[0] <= prev[0]:
+            continue
+        if prev is not None:
+            into = {}
+            integrate(prev, cur, into, max_gap)
+            for hour, acc in into.items():
+                d = deltas.setdefault((seg_id, hour), (k.get("city_id"), [0.0] * len(acc)))[1]
+                for i, v in enumerate(acc):
+                    d[i] += v
+        points[seg_id] = cur
+    return deltas
+
+def _write(deltas, window):
+    for resolution, bucket_of in (("hour", lambda h: h), ("day", day_start)):
+        ops = _updates(deltas, bucket_of, window)
+        if not ops:
+            continue
+        try:
+            ledger_collection(resolution).bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # the bucket already has this window
+            if any(err.get("code") != DUPLICATE_KEY_ERROR for err in e.details.get("writeErrors", [])):
+                raise
+
+def reset():
+    """Drop the ledger; the next update_ledger books every stored KPI again (e.g. after backfill_kpis)."""
+    db = get_db()
+    for name in ("energy_hourly", "energy_daily", POINTS_COLLECTION, STATE_COLLECTION):
+        db.drop_collection(name)
+    _ready.clear()
+
+def update_ledger(max_window=timedelta(hours=1), max_seconds=None):
+    """
+    Book segment KPIs up to now - ENERGY_LAG_SECONDS into the ledger, advancing the
+    watermark; with max_seconds, stop after the window that exceeds it.
+    """
+    started = time.monotonic()
+    db = get_db()
+    state = db[STATE_COLLECTION]
+    doc = state.find_one({"_id": "energy"})
+    upto = datetime.now(timezone.utc) - timedelta(seconds=settings.ENERGY_LAG_SECONDS)
+    if doc:
+        wm = _utc(doc["watermark"])
+    else:
+        first = KPI._get_collection().find_one({"scope": "segment"}, {"ts": 1}, sort=[("ts", 1)])
+        if not first:
+            return {"windows": 0, "kpis": 0}
+        wm = _utc(first["ts"]) - timedelta(milliseconds=1)
+
+    points = {p["_id"]: (_utc(p["ts"]), p["p"]) for p in db[POINTS_COLLECTION].find()}
+    windows = n = 0
+    while wm < upto and (max_seconds is None or time.monotonic() - started < max_seconds):
+        end = min(upto, wm + max_window)
+        kpis = list(KPI._get_collection().find(
+            {"scope": "segment", "ts": {"$gt": wm, "$lte": end}},
+            {"segment_id": 1, "city_id": 1, "ts": 1, **{f: 1 for f, _ in POWER_FIELDS}},
+        ).sort("ts", 1))
+        moved = {k.get("segment_id") for k in kpis}
+        _write(book(kpis, points, settings.ENERGY_MAX_GAP_SECONDS), end)
+        ops = [UpdateOne({"_id": s}, {"$set": {"ts": points[s][0], "p": points[s][1]}}, upsert=True)
+               for s in moved if s in points]
+        if ops:
+            db[POINTS_COLLECTION].bulk_write(ops, ordered=False)
+        state.update_one({"_id": "energy"}, {"$set": {"watermark": end}}, upsert=True)
+        wm = end
+        windows += 1
+        n += len(kpis)
+    return {"windows": windows, "kpis": n, "watermark": wm.isoformat()}
+
+def _sum(resolution, q):
+    group = {"_id": None, **{f: {"$sum": f"${f}"} for f in TOTAL_FIELDS}}
+    rows = list(ledger_collection(resolution).aggregate([{"$match": q}, {"$group": group}]))
+    return rows[0] if rows else {}
+
+def energy_totals(ts_from, ts_to, city_id=None, segment_id=None):
+    """
+    Ledger totals over the hour buckets starting from ts_from's hour up to (not
+    including) ts_to: whole days come from energy_daily and only the partial days
+    at the edges from energy_hourly.
+    """
+    q = {}
+    if city_id:
+        q["city_id"] = city_id
+    if segment_id:
+        q["segment_id"] = segment_id
+    ts_from, ts_to = hour_start(_utc(ts_from)), _utc(ts_to)
+    first_day = day_start(ts_from)
+    if first_day < ts_from:
+        first_day = day_start(first_day + timedelta(hours=36))
+    last_day = day_start(ts_to)
+    parts = []
+    if first_day < last_day:
+        parts.append(("day", {"$gte": first_day, "$lt": last_day}))
+        parts.append(("hour", {"$gte": ts_from, "$lt": first_day}))
+        parts.append(("hour", {"$gte": last_day, "$lt": ts_to}))
+    else:
+        parts.append(("hour", {"$gte": ts_from, "$lt": ts_to}))
+    totals = dict.fromkeys(TOTAL_FIELDS, 0.0)
+    for resolution, bucket in parts:
+        for f, v in _sum(resolution, {**q, "bucket": bucket}).items():
+            if f in totals:
+                totals[f] += v
+    return totals
+
+def ledger_rows(resolution, ts_from, ts_to, city_id=None, segment_id=None, limit=5000):
+    """Per-segment buckets overlapping [ts_from, ts_to), ascending."""
+    start = (hour_start if resolution == "hour" else day_start)(_utc(ts_from))
+    q = {"bucket": {"$gte": start, "$lt": ts_to}}
+    if city_id:
+        q["city_id"] = city_id
+    if segment_id:
+        q["segment_id"] = segment_id
+    cur = ledger_collection(resolution).find(q, {"_id": 0, "window": 0}).sort([("bucket", 1), ("segment_id", 1)]).limit(limit)
+    return list(cur)
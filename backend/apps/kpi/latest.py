@@ -0,0 +1,116 @@
+"""
+kpi_latest: the newest KPI of every segment, asset, zone and city.
+
+upsert_kpis() calls update() after each write. A document is only replaced by a
+KPI with a later or equal ts: the filter carries ts <= new ts, so an older KPI
+(backfill, late reconciliation) finds no match, its upsert collides with the
+existing _id and that duplicate-key error is ignored.
+
+A document is the KPI as stored in `kpi` plus kpi_id (its _id there), entity (the
+segment / asset / zone / city id) and area_zone_id (the zone of a segment, from the
+asset cache), so a city or zone is one indexed read. get_many() and for_area()
+return KPI documents shaped like those in `kpi`, _id included.
+"""
+from mongoengine.connection import get_db
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from apps.assets import cache as asset_cache
+from apps.telemetry.dedup import DUPLICATE_KEY_ERROR
+from .documents import KPI, KEY_FIELDS
+
+COLLECTION = "kpi_latest"
+SCOPES = ("segment", "asset", "zone", "city")
+INTERNAL_FIELDS = ("entity", "kpi_id", "area_zone_id")
+
+_ready = False
+
+def collection():
+    global _ready
+    coll = get_db()[COLLECTION]
+    if not _ready:
+        coll.create_index([("scope", ASCENDING), ("city_id", ASCENDING), ("area_zone_id", ASCENDING)])
+        _ready = True
+    return coll
+
+def entity_id(kpi):
+    scope = kpi["scope"]
+    if scope == "zone":
+        return kpi.get("zone_id")
+    if scope == "city":
+        return kpi.get("city_id")
+    return kpi.get(f"{scope}_id")
+
+def _key(scope, id):
+    return f"{scope}:{id}"
+
+def _resolve_ids(kpis):
+    # _id in `kpi` of KPIs whose upsert matched an existing document, one query per scope
+    found = {}
+    by_scope = {}
+    for k in kpis:
+        by_scope.setdefault(k["scope"], []).append(k)
+    for scope, group in by_scope.items():
+        fields = KEY_FIELDS[scope]
+        q = {"scope": scope, "ts": {"$in": sorted({k["ts"] for k in group})}}
+        for f in fields:
+            if f not in ("scope", "ts"):
+                q[f] = {"$in": sorted({k.get(f) for k in group}, key=str)}
+        for d in KPI._get_collection().find(q, {f: 1 for f in fields}):
+            found[tuple(d.get(f) for f in fields if f != "ts")] = d["_id"]
+    return {
+        id(k): found.get(tuple(k.get(f) for f in KEY_FIELDS[k["scope"]] if f != "ts"))
+        for k in kpis
+    }
+
+def update(kpis, ids=None):
+    """Record the newest of kpis per entity; ids maps a KPI's index in kpis to its _id in `kpi` where known."""
+    ids = ids or {}
+    newest = {}
+    for i, k in enumerate(kpis):
+        entity = entity_id(k)
+        if not entity:
+            continue
+        cur = newest.get((k["scope"], entity))
+        if cur is None or k["ts"] >= cur[1]["ts"]:
+            newest[(k["scope"], entity)] = (i, k)
+    if not newest:
+        return
+    unknown = [k for i, k in newest.values() if ids.get(i) is None and k.get("_id") is None]
+    resolved = _resolve_ids(unknown) if unknown else {}
+    assets = asset_cache.snapshot()
+    ops = []
+    for (scope, entity), (i, k) in newest.items():
+        doc = {f: v for f, v in k.items() if f != "_id"}
+        doc["kpi_id"] = ids.get(i) or k.get("_id") or resolved.get(id(k))
+        doc["entity"] = entity
+        doc["area_zone_id"] = assets.zone_id(entity) if scope == "segment" else k.get("zone_id")
+        ops.append(UpdateOne({"_id": _key(scope, entity), "ts": {"$lte": k["ts"]}}, {"$set": doc}, upsert=True))
+    try:
+        collection().bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # an existing document is newer
+        if any(err.get("code") != DUPLICATE_KEY_ERROR for err in e.details.get("writeErrors", [])):
+            raise
+
+def _rows(cur):
+    out = {}
+    for d in cur:
+        entity = d["entity"]
+        d["_id"] = d.get("kpi_id")
+        for f in INTERNAL_FIELDS:
+            d.pop(f, None)
+        out[entity] = d
+    return out
+
+def get_many(scope, ids):
+    """{id: latest KPI} for the ids that have one."""
+    return _rows(collection().find({"_id": {"$in": [_key(scope, i) for i in ids]}}))
+
+def for_area(scope, city_id, zone_id=None, since=None):
+    """{id: latest KPI} for every segment / asset / zone of a city, or segments of a zone; optionally only KPIs since a time."""
+    q = {"scope": scope, "city_id": city_id}
+    if zone_id:
+        q["area_zone_id"] = zone_id
+    if since is not None:
+        q["ts"] = {"$gte": since}
+    return _rows(collection().find(q))
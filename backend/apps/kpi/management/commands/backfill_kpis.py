@@ -0,0 +1,85 @@
+import json
+import multiprocessing
+import os
+import time
+from datetime import datetime, timezone, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from apps.telemetry.consumer import reconnect_mongo
+from apps.telemetry.documents import parse_ts
+from apps.kpi.backfill import backfill_segment, segment_ids
+from apps.kpi.tasks import pcm_melt_ranges
+
+def _run_segment(args):
+    segment_id, kwargs = args
+    return (segment_id, *backfill_segment(segment_id, **kwargs))
+
+class Command(BaseCommand):
+    help = "Recompute historical segment KPIs from telemetry (vectorised), e.g. after changing PCM melt ranges or the KPI formulas."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--city", default=None)
+        parser.add_argument("--from", dest="ts_from", default=None, help="ISO timestamp (default: --to minus 14 days).")
+        parser.add_argument("--to", dest="ts_to", default=None, help="ISO timestamp (default: now).")
+        parser.add_argument("--every", type=float, default=60.0,
+                            help="One KPI per segment per this many seconds, from the interval's last sample (0 = every sample).")
+        parser.add_argument("--replace", action="store_true",
+                            help="Delete the segments' existing KPIs in the range first, so no KPI computed the old way is left.")
+        parser.add_argument("--chunk-rows", type=int, default=50000, help="Telemetry rows per vectorised chunk.")
+        parser.add_argument("--workers", type=int, default=1, help="Processes working on different segments.")
+        parser.add_argument("--checkpoint", default="",
+                            help="JSON file recording finished segments; an interrupted run with the same options resumes from it.")
+
+    def handle(self, *args, **options):
+        try:
+            ts_to = parse_ts(options["ts_to"]) if options["ts_to"] else datetime.now(timezone.utc)
+            ts_from = parse_ts(options["ts_from"]) if options["ts_from"] else ts_to - timedelta(days=14)
+        except ValueError as e:
+            raise CommandError(str(e))
+        params = {"city": options["city"], "from": ts_from.isoformat(), "to": ts_to.isoformat(),
+                  "every": options["every"], "replace": options["replace"]}
+
+        done = set()
+        checkpoint = options["checkpoint"]
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                state = json.load(f)
+            if state.get("params") != params:
+                raise CommandError(f"{checkpoint} belongs to a run with other options ({state.get('params')}); remove it to start over")
+            done = set(state.get("done", []))
+
+        segments = [s for s in segment_ids(options["city"], ts_from, ts_to) if s not in done]
+        self.stdout.write(f"{len(segments)} segments to backfill ({len(done)} already done) from {ts_from} to {ts_to}")
+        if not segments:
+            return
+        kwargs = {"ts_from": ts_from, "ts_to": ts_to, "every": options["every"],
+                  "chunk_rows": options["chunk_rows"], "replace": options["replace"]}
+        melt = pcm_melt_ranges()
+        tasks = [(s, {**kwargs, "melt_range": melt.get(s)}) for s in segments]
+
+        pool = None
+        if options["workers"] > 1:
+            pool = multiprocessing.get_context("fork").Pool(options["workers"], initializer=reconnect_mongo)
+            results = pool.imap_unordered(_run_segment, tasks)
+        else:
+            results = map(_run_segment, tasks)
+
+        t0 = time.perf_counter()
+        read = written = 0
+        try:
+            for n, (segment_id, seg_read, seg_written) in enumerate(results, 1):
+                read += seg_read
+                written += seg_written
+                done.add(segment_id)
+                if checkpoint:
+                    tmp = f"{checkpoint}.tmp"
+                    with open(tmp, "w") as f:
+                        json.dump({"params": params, "done": sorted(done)}, f)
+                    os.replace(tmp, checkpoint)
+                dt = time.perf_counter() - t0
+                self.stdout.write(f"[{n}/{len(segments)}] {segment_id}: {seg_read} samples -> {seg_written} KPIs "
+                                  f"({read / max(dt, 1e-9):.0f} samples/s overall)")
+        finally:
+            if pool is not None:
+                pool.terminate()
+        dt = time.perf_counter() - t0
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {written} KPIs from {read} samples over {len(segments)} segments in {dt:.1f}s"))
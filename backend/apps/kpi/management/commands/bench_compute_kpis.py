@@ -0,0 +1,95 @@
+import random
+import time
+from redis import RedisError
+from datetime import datetime, timezone, timedelta
+from django.core.management.base import BaseCommand
+from apps.assets import cache as asset_cache
+from apps.assets.documents import PCMModule
+from apps.telemetry import latest, storage
+from apps.kpi.documents import KPI
+from apps.kpi.tasks import latest_segment_samples, pcm_melt_ranges, segment_kpi, upsert_kpis
+
+CITY = "BENCH"
+BEAT_SECONDS = 60
+
+def synthetic(segments, samples, now):
+    for j in range(samples):
+        ts = now - timedelta(seconds=5 * (samples - j))
+        yield [{
+            "scope": "segment", "city_id": CITY, "segment_id": f"BENCH-S{i}", "ts": ts,
+            "temps": {"surface": 30 + random.random() * 10, "subsurface": 28.0, "inlet": 25.0, "outlet": 31.0},
+            "flow": 1.1, "pressure": 128.0, "kw_gross": random.random() * 10, "kwh_total": j * 0.01,
+            "fan_power": 0.3, "pump_power": 0.7, "pcm_temp": 45 + random.random() * 15,
+        } for i in range(segments)]
+
+def legacy_run(window_start):
+    # the pre-rewrite task: distinct, then a find, a PCM lookup and a save per segment
+    telemetry = storage.collection()
+    n = 0
+    for seg_id in telemetry.distinct(storage.field("segment_id"), storage.query(scope="segment", ts_from=window_start)):
+        m = telemetry.find_one(storage.query(scope="segment", segment_id=seg_id), sort=[("ts", -1)])
+        pcm = PCMModule.objects.filter(segment_id=seg_id).first()
+        melt = (pcm.melt_temp_min, pcm.melt_temp_max) if pcm else None
+        KPI(**segment_kpi(storage.from_storage(m), melt)).save()
+        n += 1
+    return n
+
+class Command(BaseCommand):
+    help = "Benchmark compute_kpis at city scale: seeds BENCH segments, times each stage, then removes them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--segments", type=int, default=10000)
+        parser.add_argument("--samples", type=int, default=24, help="Samples per segment in the 10 minute window.")
+        parser.add_argument("--legacy", action="store_true", help="Also time the per-segment (3N+1 queries) version.")
+        parser.add_argument("--keep", action="store_true", help="Keep the BENCH telemetry, PCM modules and KPIs.")
+
+    def handle(self, *args, **options):
+        random.seed(7)
+        segments = options["segments"]
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        window_start = now - timedelta(minutes=10)
+        try:
+            t0 = time.perf_counter()
+            for batch in synthetic(segments, options["samples"], now):
+                storage.collection().insert_many([storage.to_storage(d) for d in batch], ordered=False)
+                latest.update(batch)
+            PCMModule._get_collection().insert_many([{
+                "city_id": CITY, "segment_id": f"BENCH-S{i}", "capacity_kwh_th": 50.0,
+                "melt_temp_min": 45.0, "melt_temp_max": 60.0, "location": {"type": "Point", "coordinates": [0.0, 0.0]},
+            } for i in range(0, segments, 2)])
+            asset_cache.bump()
+            self.stdout.write(f"Seeded {segments} segments x {options['samples']} samples in {time.perf_counter() - t0:.1f}s")
+
+            sources = [("mongo", False), ("redis", True)]
+            for run, (source, from_redis) in enumerate(sources + sources[:1]):
+                t0 = time.perf_counter()
+                samples = list(latest_segment_samples(window_start, from_redis=from_redis))
+                t1 = time.perf_counter()
+                melt = pcm_melt_ranges()
+                t2 = time.perf_counter()
+                kpis = [segment_kpi(m, melt.get(m["segment_id"])) for m in samples]
+                t3 = time.perf_counter()
+                written = upsert_kpis(kpis)
+                t4 = time.perf_counter()
+                self.stdout.write(
+                    f"{source:>5}{' (rerun)' if run == len(sources) else '        '}: {len(kpis)} segments in {t4 - t0:.2f}s "
+                    f"({(t4 - t0) / BEAT_SECONDS:.1%} of the beat) | latest {t1 - t0:.2f}s, pcm {t2 - t1:.3f}s, "
+                    f"compute {t3 - t2:.3f}s, upsert {t4 - t3:.2f}s ({written} new)"
+                )
+
+            if options["legacy"]:
+                t0 = time.perf_counter()
+                n = legacy_run(window_start)
+                dt = time.perf_counter() - t0
+                self.stdout.write(f"legacy: {n} segments in {dt:.2f}s ({dt / BEAT_SECONDS:.1%} of the beat)")
+        finally:
+            if not options["keep"]:
+                storage.collection().delete_many(storage.query(city_id=CITY))
+                PCMModule._get_collection().delete_many({"city_id": CITY})
+                asset_cache.bump()
+                KPI._get_collection().delete_many({"city_id": CITY})
+                ids = [f"BENCH-S{i}" for i in range(segments)]
+                try:
+                    latest.forget("segment", CITY, ids)
+                except RedisError:
+                    pass
@@ -0,0 +1,22 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from apps.common.sharding import run_locked
+from apps.kpi.energy import reset, update_ledger
+
+def rebuild():
+    reset()
+    return update_ledger(max_window=timedelta(hours=6))
+
+class Command(BaseCommand):
+    help = "Drop the energy ledger and book all stored segment KPIs again (after backfill_kpis or a factor change)."
+
+    def handle(self, *args, **options):
+        t0 = time.perf_counter()
+        # under the beat task's lock, so no update_energy_ledger run books into the rebuilt ledger
+        result = run_locked("update_energy_ledger", rebuild)
+        if result.get("skipped"):
+            raise CommandError("update_energy_ledger is running; try again once it finished")
+        self.stdout.write(self.style.SUCCESS(
+            f"Booked {result['kpis']} KPIs in {result['windows']} windows in {time.perf_counter() - t0:.1f}s"
+        ))
@@ -0,0 +1,75 @@
+"""
+Incremental segment KPIs computed in the MQTT consumer as telemetry is stored.
+
+The consumer's writer hands every stored batch to KPIStream.add(), which keeps the
+newest not-yet-emitted sample per segment; emit_due() turns those into KPI
+documents (tasks.segment_kpi, PCM ranges from the asset cache) every `cadence`
+seconds with one bulk upsert. KPIs
+are keyed on (segment_id, ts) like the compute_kpis beat task, which now only
+reconciles what the stream missed (consumer down, REST-ingested telemetry).
+"""
+import threading
+import time
+from pymongo.errors import PyMongoError
+from .tasks import pcm_melt_ranges, segment_kpi, upsert_kpis
+
+class KPIStream:
+
+    def __init__(self, cadence=10.0, log=None):
+        self.cadence = cadence
+        self.log = log or (lambda msg: None)
+        self.stats = {"emitted": 0, "failed": 0}
+
+        self._lock = threading.Lock()
+        self._pending = {}   # segment_id -> newest sample since the last emit
+        self._emitted = {}   # segment_id -> ts of the last KPI written
+        self._last_emit = time.monotonic()
+
+    def add(self, docs):
+        """Remember the newest sample per segment from a batch of stored telemetry documents."""
+        with self._lock:
+            for d in docs:
+                seg_id = d.get("segment_id")
+                if d.get("scope") != "segment" or not seg_id:
+                    continue
+                cur = self._pending.get(seg_id)
+                if cur is not None and cur["ts"] >= d["ts"]:
+                    continue
+                last = self._emitted.get(seg_id)
+                if last is None or d["ts"] > last:
+                    self._pending[seg_id] = d
+
+    def due(self):
+        return bool(self._pending) and time.monotonic() - self._last_emit >= self.cadence
+
+    def emit_in(self):
+        """Seconds until emit_due() writes KPIs, None with no new samples."""
+        if not self._pending:
+            return None
+        return max(self.cadence - (time.monotonic() - self._last_emit), 0.0)
+
+    def emit_due(self, force=False):
+        """Write KPIs for segments with new samples once the cadence elapsed; returns the number written."""
+        with self._lock:
+            if not (self._pending and (force or self.due())):
+                return 0
+            pending, self._pending = self._pending, {}
+            self._last_emit = time.monotonic()
+        try:
+            melt = pcm_melt_ranges(pending)
+            upsert_kpis([segment_kpi(d, melt.get(seg_id)) for seg_id, d in pending.items()])
+        except PyMongoError as e:
+            self.log(f"KPI upsert of {len(pending)} segments failed: {e}")
+            self.stats["failed"] += len(pending)
+            with self._lock:
+                # retried with the next emit unless a newer sample arrived meanwhile
+                for seg_id, d in pending.items():
+                    cur = self._pending.get(seg_id)
+                    if cur is None or cur["ts"] < d["ts"]:
+                        self._pending[seg_id] = d
+            return 0
+        with self._lock:
+            for seg_id, d in pending.items():
+                self._emitted[seg_id] = d["ts"]
+        self.stats["emitted"] += len(pending)
+        return len(pending)
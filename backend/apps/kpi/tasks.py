@@ -1,8 +1,16 @@
 from celery import shared_task
+from django.conf import settings
 from datetime import datetime, timezone, timedelta
-from apps.telemetry.documents import Telemetry
-from apps.assets.documents import PCMModule
-from .documents import KPI
+from pymongo import UpdateOne
+from redis import RedisError
+from apps.telemetry import latest as latest_store, storage
+from apps.telemetry.documents import parse_ts
+from apps.assets import cache as asset_cache
+from apps.common.sharding import dispatch, run_locked, shard_of
+from . import latest as kpi_latest
+from .documents import KPI, KEY_FIELDS
+from .aggregates import aggregate_kpis
+from .energy import update_ledger
 import math
 
 CP_WATER_KJ_PER_KG_K = 4.186  # approximation
@@ -10,57 +18,120 @@ CP_WATER_KJ_PER_KG_K = 4.186  # approximation
 def clamp(x, a, b):
     return max(a, min(b, x))
 
+def latest_segment_samples(window_start, from_redis=None, city_id=None):
+    """Newest sample of every segment that reported since window_start: from Redis, or Mongo if it is down."""
+    samples = None
+    if settings.TELEMETRY_LATEST_ENABLED if from_redis is None else from_redis:
+        try:
+            samples = latest_store.snapshot("segment", city_id)
+        except RedisError:
+            pass
+    if samples is not None:
+        for m in samples:
+            m["ts"] = parse_ts(m["ts"])
+            if m.get("segment_id") and m["ts"] >= window_start:
+                yield m
+        return
+
+    # one pass over the window; the sort is the unique series index walked backwards
+    # (plain layout), so the newest sample of each segment comes first in its group
+    pipeline = [
+        {"$match": storage.query(scope="segment", city_id=city_id, ts_from=window_start)},
+        {"$sort": {storage.field(k): -1 for k in ("scope", "segment_id", "asset_id", "ts")}},
+        {"$group": {"_id": f"${storage.field('segment_id')}", "doc": {"$first": "$$ROOT"}}},
+        {"$replaceRoot": {"newRoot": "$doc"}},
+    ]
+    for m in storage.collection().aggregate(pipeline, allowDiskUse=True):
+        m = storage.from_storage(m)
+        if m.get("segment_id"):
+            yield m
+
+def pcm_melt_ranges(segment_ids=None):
+    """{segment_id: (melt_temp_min, melt_temp_max)} for every (or each given) segment with a PCM module, first module wins."""
+    pcm = asset_cache.snapshot().pcm_by_segment
+    return {
+        s: (float(pcm[s]["melt_temp_min"]), float(pcm[s]["melt_temp_max"]))
+        for s in (pcm if segment_ids is None else segment_ids) if s in pcm
+    }
+
+def segment_kpi(latest, melt_range=None):
+    temps = latest.get("temps") or {}
+    t_in = float(temps.get("inlet", temps.get("t_in", 0.0)) or 0.0)
+    t_out = float(temps.get("outlet", temps.get("t_out", 0.0)) or 0.0)
+    m_dot = float(latest.get("flow") or 0.0)  # kg/s
+
+    # Q (kW_th) = m_dot * Cp(kJ/kg-K) * dT(K)  => kJ/s = kW
+    dT = (t_out - t_in)
+    heat_kw = m_dot * CP_WATER_KJ_PER_KG_K * dT if m_dot and dT else 0.0
+    if heat_kw < 0:
+        heat_kw = 0.0
+
+    kw_gross = float(latest.get("kw_gross") or 0.0)
+    parasitic = float(latest.get("pump_power") or 0.0) + float(latest.get("fan_power") or 0.0)
+    kw_net = kw_gross - parasitic
+
+    # PCM SOC MVP: map pcm_temp within melt range
+    pcm_temp = latest.get("pcm_temp")
+    if melt_range and pcm_temp is not None:
+        tmin, tmax = melt_range
+        pcm_soc = clamp((float(pcm_temp) - tmin) / (tmax - tmin + 1e-6), 0.0, 1.0)
+    else:
+        # fallback: infer SOC from heat_kw (weak heuristic)
+        pcm_soc = clamp(0.5 + 0.05 * math.tanh(heat_kw / 10.0), 0.0, 1.0)
+
+    return {
+        "scope": "segment",
+        "city_id": latest["city_id"],
+        "segment_id": latest["segment_id"],
+        "ts": latest["ts"],
+        "heat_captured_kw": heat_kw,
+        "pcm_soc": pcm_soc,
+        "kw_net": kw_net,
+        "kw_gross": kw_gross,
+        "parasitic_kw": parasitic,
+        "temps": temps,
+    }
+
+def upsert_kpis(kpis):
+    """
+    One unordered bulk upsert keyed per scope (KEY_FIELDS, e.g. segment_id + ts);
+    rewriting a KPI leaves one document. kpi_latest follows.
+    """
+    if not kpis:
+        return 0
+    ops = [
+        UpdateOne({f: k.get(f) for f in KEY_FIELDS[k["scope"]]}, {"$set": k}, upsert=True)
+        for k in kpis
+    ]
+    result = KPI._get_collection().bulk_write(ops, ordered=False)
+    kpi_latest.update(kpis, result.upserted_ids)
+    return result.upserted_count
+
+def window_start():
+    # Compute from latest telemetry per segment (last ~10 minutes)
+    return datetime.now(timezone.utc) - timedelta(minutes=10)
+
+@shared_task
+def compute_kpis_shard(since, city_id, part=0, parts=1):
+    samples = [
+        m for m in latest_segment_samples(parse_ts(since), city_id=city_id)
+        if shard_of(m["segment_id"], parts) == part
+    ]
+    melt_ranges = pcm_melt_ranges(m["segment_id"] for m in samples)
+    kpis = [segment_kpi(m, melt_ranges.get(m["segment_id"])) for m in samples]
+    return {"segments_processed": len(kpis), "kpis_written": upsert_kpis(kpis)}
+
 @shared_task
 def compute_kpis():
-    # Compute from latest telemetry per segment (last ~5 minutes)
-    window_start = datetime.now(timezone.utc) - timedelta(minutes=10)
-
-    # group by segment_id
-    segments = Telemetry.objects.filter(scope="segment", ts__gte=window_start).distinct("segment_id")
-    for seg_id in segments:
-        if not seg_id:
-            continue
-        latest = Telemetry.objects.filter(scope="segment", segment_id=seg_id).order_by("-ts").first()
-        if not latest:
-            continue
-
-        temps = latest.temps or {}
-        t_in = float(temps.get("inlet", temps.get("t_in", 0.0)) or 0.0)
-        t_out = float(temps.get("outlet", temps.get("t_out", 0.0)) or 0.0)
-        m_dot = float(latest.flow or 0.0)  # kg/s
-
-        # Q (kW_th) = m_dot * Cp(kJ/kg-K) * dT(K)  => kJ/s = kW
-        dT = (t_out - t_in)
-        heat_kw = m_dot * CP_WATER_KJ_PER_KG_K * dT if m_dot and dT else 0.0
-        if heat_kw < 0:
-            heat_kw = 0.0
-
-        kw_gross = float(latest.kw_gross or 0.0)
-        parasitic = float(latest.pump_power or 0.0) + float(latest.fan_power or 0.0)
-        kw_net = kw_gross - parasitic
-
-        # PCM SOC MVP: map pcm_temp within melt range
-        pcm_soc = None
-        pcm_temp = latest.pcm_temp
-        pcm = PCMModule.objects.filter(segment_id=seg_id).first()
-        if pcm and pcm_temp is not None:
-            tmin, tmax = float(pcm.melt_temp_min), float(pcm.melt_temp_max)
-            pcm_soc = clamp((float(pcm_temp) - tmin) / (tmax - tmin + 1e-6), 0.0, 1.0)
-        else:
-            # fallback: infer SOC from heat_kw (weak heuristic)
-            pcm_soc = clamp(0.5 + 0.05 * math.tanh(heat_kw / 10.0), 0.0, 1.0)
-
-        KPI(
-            scope="segment",
-            city_id=latest.city_id,
-            segment_id=seg_id,
-            ts=latest.ts,
-            heat_captured_kw=heat_kw,
-            pcm_soc=pcm_soc,
-            kw_net=kw_net,
-            kw_gross=kw_gross,
-            parasitic_kw=parasitic,
-            temps=temps,
-        ).save()
-
-    return {"segments_processed": len(segments)}
+    since = window_start()
+    cities = storage.collection().distinct(storage.field("city_id"), storage.query(scope="segment", ts_from=since))
+    return dispatch("compute_kpis", compute_kpis_shard, sorted(c for c in cities if c), since.isoformat())
+
+@shared_task
+def update_energy_ledger():
+    # leave the lock before it expires; a catch-up continues on the next beats
+    return run_locked("update_energy_ledger", update_ledger, max_seconds=settings.TASK_RUN_LOCK_SECONDS / 2)
+
+@shared_task
+def aggregate_zone_city_kpis():
+    return aggregate_kpis()
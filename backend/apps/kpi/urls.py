@@ -1,7 +1,10 @@
 from django.urls import path
-from .views import LatestKPIView, KPIQueryView
+from .views import LatestKPIView, KPILatestBatchView, KPIQueryView, KPIOverviewView, EnergyView
 
 urlpatterns = [
     path("latest", LatestKPIView.as_view()),
+    path("latest/batch", KPILatestBatchView.as_view()),
     path("query", KPIQueryView.as_view()),
+    path("overview", KPIOverviewView.as_view()),
+    path("energy", EnergyView.as_view()),
 ]
@@ -1,7 +1,21 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from .documents import KPI
+from rest_framework.settings import api_settings
+from . import latest as kpi_latest
+from .documents import KPI, FIELDS
+from .energy import RESOLUTIONS, energy_totals, ledger_rows
+from apps.common.pagination import page_params, pymongo_page
 from apps.authx.permissions import IsOpsOrAbove
+from apps.common.streaming import (
+    ColumnarJSONRenderer, columns, json_stream_response, newest_ascending, requested_fields, requested_format,
+)
+from apps.telemetry.documents import parse_ts
+
+def _kpi_row(m):
+    # a KPI document from `kpi` or kpi_latest as returned by the latest endpoints
+    m["id"] = str(m.pop("_id")) if m.get("_id") is not None else None
+    m["ts"] = m["ts"].isoformat()
+    return m
 
 class LatestKPIView(APIView):
     permission_classes = [IsOpsOrAbove]
@@ -10,33 +24,136 @@ class LatestKPIView(APIView):
         scope = request.query_params.get("scope", "segment")
         segment_id = request.query_params.get("segment_id")
         asset_id = request.query_params.get("asset_id")
-        qs = KPI.objects.filter(scope=scope)
+        city_id = request.query_params.get("city_id")
+        zone_id = request.query_params.get("zone_id")
+        # one entity: a point read on kpi_latest, falling back to the KPI history
+        id = {"segment": segment_id, "asset": asset_id, "zone": zone_id}.get(scope, city_id)
+        if scope in kpi_latest.SCOPES and id:
+            m = kpi_latest.get_many(scope, [id]).get(id)
+            if m:
+                return Response(_kpi_row(m))
+        q = {"scope": scope}
         if scope == "segment" and segment_id:
-            qs = qs.filter(segment_id=segment_id)
+            q["segment_id"] = segment_id
         if scope == "asset" and asset_id:
-            qs = qs.filter(asset_id=asset_id)
-        doc = qs.order_by("-ts").first()
-        if not doc:
+            q["asset_id"] = asset_id
+        if scope in ("zone", "city") and city_id:
+            q["city_id"] = city_id
+        if scope == "zone" and zone_id:
+            q["zone_id"] = zone_id
+        m = KPI._get_collection().find_one(q, sort=[("ts", -1)])
+        if not m:
             return Response({"detail": "No KPI"}, status=404)
-        m = doc.to_mongo().to_dict()
-        m["id"] = str(m.pop("_id"))
-        m["ts"] = doc.ts.isoformat()
-        return Response(m)
+        return Response(_kpi_row(m))
+
+def _row(m):
+    m["id"] = str(m.pop("_id"))
+    return m
+
+class KPILatestBatchView(APIView):
+    """
+    Latest KPI per entity from kpi_latest, in one indexed read.
+    GET ?scope=segment&ids=a,b or POST {"scope", "ids": [...]} -> {id: kpi};
+    without ids, city_id (and zone_id) select every entity of that city or zone.
+    """
+    permission_classes = [IsOpsOrAbove]
+
+    def get(self, request):
+        p = request.query_params
+        ids = [i for i in p.get("ids", "").split(",") if i]
+        return self._read(p.get("scope", "segment"), ids, p.get("city_id"), p.get("zone_id"))
+
+    def post(self, request):
+        d = request.data
+        ids = d.get("ids") or []
+        if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+            return Response({"detail": "ids must be a list of strings"}, status=400)
+        return self._read(d.get("scope", "segment"), ids, d.get("city_id"), d.get("zone_id"))
+
+    def _read(self, scope, ids, city_id, zone_id):
+        if scope not in kpi_latest.SCOPES:
+            return Response({"detail": f"scope must be one of {', '.join(kpi_latest.SCOPES)}"}, status=400)
+        if ids:
+            rows = kpi_latest.get_many(scope, ids)
+        elif city_id:
+            rows = kpi_latest.for_area(scope, city_id, zone_id)
+        else:
+            return Response({"detail": "ids or city_id required"}, status=400)
+        return Response({entity: _kpi_row(m) for entity, m in rows.items()})
 
 class KPIQueryView(APIView):
     permission_classes = [IsOpsOrAbove]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, ColumnarJSONRenderer]
 
     def get(self, request):
         scope = request.query_params.get("scope", "segment")
         segment_id = request.query_params.get("segment_id")
-        qs = KPI.objects.filter(scope=scope)
+        try:
+            fields = requested_fields(request, FIELDS)
+            fmt = requested_format(request)
+            page = page_params(request)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+        q = {"scope": scope}
         if segment_id:
-            qs = qs.filter(segment_id=segment_id)
-        qs = qs.order_by("-ts").limit(2000)
-        rows = []
-        for d in reversed(list(qs)):
-            m = d.to_mongo().to_dict()
-            m["id"] = str(m.pop("_id"))
-            m["ts"] = d.ts.isoformat()
-            rows.append(m)
-        return Response(rows)
+            q["segment_id"] = segment_id
+        for key in ("city_id", "zone_id"):
+            if request.query_params.get(key):
+                q[key] = request.query_params[key]
+        try:
+            for param, op in (("from", "$gte"), ("to", "$lte")):
+                if request.query_params.get(param):
+                    q.setdefault("ts", {})[op] = parse_ts(request.query_params[param])
+        except ValueError:
+            return Response({"detail": "Invalid timestamp"}, status=400)
+        if fmt == "columnar":
+            fields = fields or [f for f in FIELDS if f not in ("scope", "city_id", "segment_id", "asset_id", "ts")]
+            proj = {f: 1 for f in ("ts", *fields)}
+        else:
+            proj = {f: 1 for f in (["scope", "city_id", "segment_id", "asset_id", "ts", *fields] if fields else FIELDS)}
+        if page:
+            # keyset pages over (ts, _id), oldest first
+            cur = pymongo_page(KPI._get_collection(), q, proj, page)
+            if fmt == "columnar":
+                data = columns(cur, fields)
+                data["next_cursor"] = cur.next_cursor
+                return Response(data)
+            return json_stream_response((_row(m) for m in cur), page=cur)
+        cur = newest_ascending(KPI._get_collection(), q, proj, limit=2000)
+        if fmt == "columnar":
+            return Response(columns(cur, fields))
+        return json_stream_response(_row(m) for m in cur)
+
+class KPIOverviewView(APIView):
+    """A city's newest city-scope KPI and the newest KPI of each of its zones (aggregates.py)."""
+    permission_classes = [IsOpsOrAbove]
+
+    def get(self, request):
+        city_id = request.query_params.get("city_id")
+        if not city_id:
+            return Response({"detail": "city_id is required"}, status=400)
+        coll = KPI._get_collection()
+        city = coll.find_one({"scope": "city", "city_id": city_id}, sort=[("ts", -1)])
+        if not city:
+            return Response({"detail": "No KPI"}, status=404)
+        zones = coll.find({"scope": "zone", "city_id": city_id, "ts": city["ts"]}).sort("zone_id", 1)
+        return Response({"city": _row(city), "zones": [_row(z) for z in zones]})
+
+class EnergyView(APIView):
+    """Energy ledger for a range: totals (default) or per-segment hour/day buckets via ?group=hour|day."""
+    permission_classes = [IsOpsOrAbove]
+
+    def get(self, request):
+        p = request.query_params
+        group = p.get("group", "total")
+        if group not in ("total", *RESOLUTIONS):
+            return Response({"detail": "group must be total, hour or day"}, status=400)
+        try:
+            ts_from, ts_to = parse_ts(p.get("from")), parse_ts(p.get("to"))
+        except ValueError:
+            return Response({"detail": "from and to must be ISO timestamps"}, status=400)
+        city_id, segment_id = p.get("city_id"), p.get("segment_id")
+        if group == "total":
+            totals = energy_totals(ts_from, ts_to, city_id=city_id, segment_id=segment_id)
+            return Response({"from": ts_from.isoformat(), "to": ts_to.isoformat(), **totals})
+        return json_stream_response(ledger_rows(group, ts_from, ts_to, city_id=city_id, segment_id=segment_id))
@@ -7,6 +7,7 @@ from dateutil.parser import isoparse
 from .documents import WorkOrder, now_utc
 from .serializers import WorkOrderIn
 from apps.authx.permissions import IsOpsOrAbove
+from apps.common.pagination import page_params, queryset_page
 
 def to_dict(doc: WorkOrder):
     d = doc.to_mongo().to_dict()
@@ -24,6 +25,14 @@ class WorkOrderListCreate(APIView):
         qs = WorkOrder.objects
         if asset_id:
             qs = qs.filter(asset_id=asset_id)
+        try:
+            page = page_params(request)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+        if page:
+            rows = queryset_page(qs, page, "created_at")
+            results = [to_dict(x) for x in rows]
+            return Response({"results": results, "next_cursor": rows.next_cursor})
         qs = qs.order_by("-created_at").limit(500)
         return Response([to_dict(x) for x in qs])
 
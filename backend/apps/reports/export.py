@@ -0,0 +1,123 @@
+"""
+Columnar history export: telemetry or KPI rows for a city and time range as Arrow
+IPC (stream format) or Parquet.
+
+Rows are read in chunks from a projected pymongo cursor and turned into one
+record batch per chunk, so memory is bounded by the batch size however long the
+range is. temps is flattened into one float64 column per key (temp_surface, ...).
+"""
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from apps.telemetry import storage
+from apps.telemetry.documents import PAYLOAD_FIELDS, TEMP_KEYS
+from apps.kpi.documents import KPI
+
+FORMATS = {"arrow": "application/vnd.apache.arrow.stream", "parquet": "application/vnd.apache.parquet"}
+ID_FIELDS = ["scope", "city_id", "segment_id", "asset_id"]
+VALUE_FIELDS = {
+    "telemetry": PAYLOAD_FIELDS,
+    "kpi": ["heat_captured_kw", "pcm_soc", "kw_net", "kw_gross", "parasitic_kw"],
+}
+DATASETS = tuple(VALUE_FIELDS)
+
+def schema(dataset, temps=TEMP_KEYS):
+    return pa.schema(
+        [(k, pa.string()) for k in ID_FIELDS]
+        + [("ts", pa.timestamp("ms", tz="UTC"))]
+        + [(k, pa.float64()) for k in VALUE_FIELDS[dataset]]
+        + [(f"temp_{k}", pa.float64()) for k in temps]
+    )
+
+def _num(v):
+    return float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else None
+
+def _cursor(dataset, city_id, ts_from, ts_to, batch_rows):
+    fields = [*ID_FIELDS, "ts", "temps", *VALUE_FIELDS[dataset]]
+    if dataset == "telemetry":
+        q = storage.query(city_id=city_id, ts_from=ts_from, ts_to=ts_to)
+        cur = storage.collection().find(q, {**storage.projection(fields), "_id": 0})
+        return (storage.from_storage(m) for m in cur.sort("ts", 1).batch_size(batch_rows))
+    # segment KPIs only; zone and city rows are aggregates of them
+    q = {"scope": "segment", "city_id": city_id, "ts": {"$gte": ts_from, "$lte": ts_to}}
+    return KPI._get_collection().find(q, {**{k: 1 for k in fields}, "_id": 0}).sort("ts", 1).batch_size(batch_rows)
+
+def record_batches(dataset, city_id, ts_from, ts_to, temps=TEMP_KEYS, batch_rows=None):
+    batch_rows = batch_rows or settings.REPORTS_EXPORT_BATCH_ROWS
+    sch = schema(dataset, temps)
+    values = VALUE_FIELDS[dataset]
+    cols = {name: [] for name in sch.names}
+
+    def flush():
+        batch = pa.RecordBatch.from_arrays([pa.array(cols[f.name], type=f.type) for f in sch], schema=sch)
+        for c in cols.values():
+            c.clear()
+        return batch
+
+    n = 0
+    for m in _cursor(dataset, city_id, ts_from, ts_to, batch_rows):
+        for k in ID_FIELDS:
+            cols[k].append(m.get(k))
+        cols["ts"].append(m["ts"])
+        for k in values:
+            cols[k].append(_num(m.get(k)))
+        t = m.get("temps") or {}
+        for k in temps:
+            cols[f"temp_{k}"].append(_num(t.get(k)))
+        n += 1
+        if n == batch_rows:
+            yield flush()
+            n = 0
+    if n:
+        yield flush()
+
+def open_writer(sink, fmt, sch):
+    if fmt == "parquet":
+        return pq.ParquetWriter(sink, sch, compression="zstd")
+    return pa.ipc.new_stream(sink, sch)
+
+def write(sink, dataset, city_id, ts_from, ts_to, fmt="parquet", temps=TEMP_KEYS, batch_rows=None):
+    """Write the export to a path or file object; returns the number of rows written."""
+    rows = 0
+    with open_writer(sink, fmt, schema(dataset, temps)) as w:
+        for batch in record_batches(dataset, city_id, ts_from, ts_to, temps, batch_rows):
+            w.write_batch(batch)
+            rows += batch.num_rows
+    return rows
+
+class _Chunks:
+    # write-only file object the writers append to; the response drains it after every batch
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.pos = 0
+
+    def write(self, b):
+        self.parts.append(bytes(b))
+        self.pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        out = b"".join(self.parts)
+        self.parts = []
+        return out
+
+def iter_export(dataset, city_id, ts_from, ts_to, fmt="parquet", temps=TEMP_KEYS, batch_rows=None):
+    """The export as a stream of byte chunks, one per record batch."""
+    sink = _Chunks()
+    w = open_writer(sink, fmt, schema(dataset, temps))
+    for batch in record_batches(dataset, city_id, ts_from, ts_to, temps, batch_rows):
+        w.write_batch(batch)
+        yield sink.drain()
+    w.close()
+    yield sink.drain()
@@ -4,13 +4,35 @@ from django.conf import settings
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from openpyxl import Workbook
-from apps.telemetry.documents import Telemetry, parse_ts
+from apps.telemetry.documents import parse_ts
+from apps.telemetry import storage
+from apps.telemetry.rollups import pick_tier, query_rollups
 from apps.kpi.documents import KPI
+from apps.kpi.energy import energy_totals, ledger_rows
 from apps.alerts.documents import AlertEvent
+from apps.assets import cache as asset_cache
 
 def _safe_name(s: str) -> str:
     return "".join(ch for ch in s if ch.isalnum() or ch in ("-", "_")).strip("_")[:60] or "report"
 
+def _kpi_summary(city_id, dt_from, dt_to):
+    # averages of the materialised city KPIs (one per minute); for ranges without them
+    # (before aggregation ran, backfilled history) the same from segment KPIs per minute
+    coll = KPI._get_collection()
+    ts = {"$gte": dt_from, "$lte": dt_to}
+    overall = {"$group": {"_id": None, "kw_net": {"$avg": "$kw_net"}, "pcm_soc": {"$avg": "$pcm_soc"}}}
+    rows = list(coll.aggregate([{"$match": {"scope": "city", "city_id": city_id, "ts": ts}}, overall]))
+    if rows:
+        return rows[0]
+    minute = {"$dateTrunc": {"date": "$ts", "unit": "minute"}}
+    rows = list(coll.aggregate([
+        {"$match": {"scope": "segment", "city_id": city_id, "ts": ts}},
+        {"$group": {"_id": {"s": "$segment_id", "m": minute}, "kw_net": {"$avg": "$kw_net"}, "pcm_soc": {"$avg": "$pcm_soc"}}},
+        {"$group": {"_id": "$_id.m", "kw_net": {"$sum": "$kw_net"}, "pcm_soc": {"$avg": "$pcm_soc"}}},
+        overall,
+    ], allowDiskUse=True))
+    return rows[0] if rows else {}
+
 def generate_pdf(city_id: str, dt_from, dt_to) -> str:
     ts = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
     fn = f"city_{_safe_name(city_id)}_{ts}.pdf"
@@ -22,22 +44,13 @@ def generate_pdf(city_id: str, dt_from, dt_to) -> str:
     c.setFont("Helvetica-Bold", 14)
     c.drawString(40, h - 50, "Thermal Infrastructure Monitoring Platform")
     c.setFont("Helvetica", 11)
-    c.drawString(40, h - 70, f"City ID: {city_id}")
+    assets = asset_cache.snapshot()
+    city = assets.get("cities", city_id)
+    c.drawString(40, h - 70, f"City: {city['name']} ({city_id})" if city else f"City ID: {city_id}")
     c.drawString(40, h - 85, f"Range: {dt_from.isoformat()} to {dt_to.isoformat()}")
 
-    # KPIs summary
-    kpis = KPI.objects.filter(scope="segment", city_id=city_id, ts__gte=dt_from, ts__lte=dt_to).limit(5000)
-    total_kwh_est = 0.0
-    avg_kw_net = []
-    avg_soc = []
-    for k in kpis:
-        if k.kw_net is not None:
-            avg_kw_net.append(float(k.kw_net))
-        if k.pcm_soc is not None:
-            avg_soc.append(float(k.pcm_soc))
-        # approximate energy over samples: treat each sample as 1 minute
-        if k.kw_net is not None:
-            total_kwh_est += float(k.kw_net) / 60.0
+    summary = _kpi_summary(city_id, dt_from, dt_to)
+    energy = energy_totals(dt_from, dt_to, city_id=city_id)
 
     alarms = AlertEvent.objects.filter(city_id=city_id, opened_at__gte=dt_from, opened_at__lte=dt_to).order_by("-opened_at").limit(100)
 
@@ -46,11 +59,13 @@ def generate_pdf(city_id: str, dt_from, dt_to) -> str:
     c.drawString(40, y, "Summary")
     y -= 18
     c.setFont("Helvetica", 10)
-    c.drawString(40, y, f"Estimated kWh generated (from KPI samples): {total_kwh_est:.2f}")
+    c.drawString(40, y, f"Energy: {energy['kwh_net']:.2f} kWh net, {energy['kwh_gross']:.2f} kWh gross, {energy['kwh_th']:.2f} kWh thermal")
+    y -= 14
+    c.drawString(40, y, f"CO2 avoided: {energy['co2_kg']:.1f} kg | Value: INR {energy['inr']:.2f}")
     y -= 14
-    c.drawString(40, y, f"Avg kW net: {(sum(avg_kw_net)/len(avg_kw_net)) if avg_kw_net else 0.0:.2f}")
+    c.drawString(40, y, f"Avg city kW net: {summary.get('kw_net') or 0.0:.2f}")
     y -= 14
-    c.drawString(40, y, f"Avg PCM SOC: {(sum(avg_soc)/len(avg_soc)) if avg_soc else 0.0:.2f}")
+    c.drawString(40, y, f"Avg PCM SOC: {summary.get('pcm_soc') or 0.0:.2f}")
     y -= 20
 
     c.setFont("Helvetica-Bold", 12)
@@ -58,7 +73,9 @@ def generate_pdf(city_id: str, dt_from, dt_to) -> str:
     y -= 16
     c.setFont("Helvetica", 9)
     for ev in alarms:
-        line = f"{ev.opened_at.isoformat()} | {ev.severity.upper()} | {ev.metric}={ev.value} | segment={ev.segment_id} | status={ev.status}"
+        seg = assets.segment(ev.segment_id)
+        segment = f"{seg['name']} ({ev.segment_id})" if seg else ev.segment_id
+        line = f"{ev.opened_at.isoformat()} | {ev.severity.upper()} | {ev.metric}={ev.value} | segment={segment} | status={ev.status}"
         c.drawString(40, y, line[:110])
         y -= 12
         if y < 60:
@@ -80,26 +97,33 @@ def generate_xlsx(city_id: str, dt_from, dt_to) -> str:
     ws1.title = "Telemetry"
     ws1.append(["ts", "scope", "segment_id", "asset_id", "temps", "flow", "pressure", "kw_gross", "kwh_total", "pump_power", "fan_power", "pcm_temp"])
 
-    telem = Telemetry.objects.filter(city_id=city_id, ts__gte=dt_from, ts__lte=dt_to).order_by("ts").limit(50000)
+    # long or old ranges come from the rollups (hourly/15-min/1-min averages) instead of raw samples
+    tier = pick_tier(dt_from, dt_to, max_points=50000)
+    if tier == "raw":
+        telem = storage.collection().find(storage.query(city_id=city_id, ts_from=dt_from, ts_to=dt_to)).sort("ts", 1).limit(50000)
+        telem = (storage.from_storage(t) for t in telem)
+    else:
+        ws1.title = f"Telemetry ({tier} avg)"
+        telem = query_rollups(tier, city_id=city_id, ts_from=dt_from, ts_to=dt_to, limit=50000)
     for t in telem:
         ws1.append([
-            t.ts.isoformat(),
-            t.scope,
-            t.segment_id,
-            t.asset_id,
-            str(t.temps or {}),
-            t.flow,
-            t.pressure,
-            t.kw_gross,
-            t.kwh_total,
-            t.pump_power,
-            t.fan_power,
-            t.pcm_temp,
+            t["ts"].isoformat(),
+            t.get("scope"),
+            t.get("segment_id"),
+            t.get("asset_id"),
+            str(t.get("temps") or {}),
+            t.get("flow"),
+            t.get("pressure"),
+            t.get("kw_gross"),
+            t.get("kwh_total"),
+            t.get("pump_power"),
+            t.get("fan_power"),
+            t.get("pcm_temp"),
         ])
 
     ws2 = wb.create_sheet("KPI")
     ws2.append(["ts", "segment_id", "heat_captured_kw", "kw_gross", "parasitic_kw", "kw_net", "pcm_soc", "temps"])
-    kpis = KPI.objects.filter(city_id=city_id, ts__gte=dt_from, ts__lte=dt_to).order_by("ts").limit(50000)
+    kpis = KPI.objects.filter(scope="segment", city_id=city_id, ts__gte=dt_from, ts__lte=dt_to).order_by("ts").limit(50000)
     for k in kpis:
         ws2.append([
             k.ts.isoformat(),
@@ -112,5 +136,19 @@ def generate_xlsx(city_id: str, dt_from, dt_to) -> str:
             str(k.temps or {}),
         ])
 
+    ws3 = wb.create_sheet("Energy (daily)")
+    ws3.append(["day", "segment_id", "kwh_gross", "kwh_net", "kwh_th", "co2_kg", "inr", "hours_covered"])
+    for e in ledger_rows("day", dt_from, dt_to, city_id=city_id, limit=50000):
+        ws3.append([
+            e["bucket"].isoformat(),
+            e["segment_id"],
+            e.get("kwh_gross"),
+            e.get("kwh_net"),
+            e.get("kwh_th"),
+            e.get("co2_kg"),
+            e.get("inr"),
+            round(e.get("seconds", 0) / 3600.0, 2),
+        ])
+
     wb.save(path)
     return fn
@@ -1,8 +1,9 @@
 from django.urls import path
-from .views import PdfReportView, XlsxReportView, DownloadReportView
+from .views import PdfReportView, XlsxReportView, ExportView, DownloadReportView
 
 urlpatterns = [
     path("pdf", PdfReportView.as_view()),
     path("xlsx", XlsxReportView.as_view()),
+    path("export", ExportView.as_view()),
     path("download/<str:filename>", DownloadReportView.as_view()),
 ]
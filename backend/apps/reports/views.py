@@ -2,9 +2,11 @@ import os
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from django.conf import settings
+from django.http import StreamingHttpResponse
 from apps.authx.permissions import IsOpsOrAbove
 from apps.telemetry.documents import parse_ts
-from .services import generate_pdf, generate_xlsx
+from .services import _safe_name, generate_pdf, generate_xlsx
+from .export import DATASETS, FORMATS, TEMP_KEYS, iter_export
 
 class PdfReportView(APIView):
     permission_classes = [IsOpsOrAbove]
@@ -34,6 +36,36 @@ class XlsxReportView(APIView):
         fn = generate_xlsx(city_id, f, t)
         return Response({"file": fn, "url": f"/api/reports/download/{fn}"})
 
+class ExportView(APIView):
+    """
+    Streams telemetry or KPI history for a city as Arrow IPC or Parquet:
+    {"dataset": "telemetry"|"kpi", "city_id", "from", "to", "format": "parquet"|"arrow", "temps": [...]}
+    """
+    permission_classes = [IsOpsOrAbove]
+
+    def post(self, request):
+        dataset = request.data.get("dataset", "telemetry")
+        fmt = request.data.get("format", "parquet")
+        city_id = request.data.get("city_id")
+        dt_from = request.data.get("from")
+        dt_to = request.data.get("to")
+        if not city_id or not dt_from or not dt_to:
+            return Response({"detail": "city_id, from, to required"}, status=400)
+        if dataset not in DATASETS or fmt not in FORMATS:
+            return Response({"detail": f"dataset must be one of {', '.join(DATASETS)}, format one of {', '.join(FORMATS)}"}, status=400)
+        temps = request.data.get("temps") or TEMP_KEYS
+        if not isinstance(temps, list) or not all(isinstance(k, str) for k in temps):
+            return Response({"detail": "temps must be a list of keys"}, status=400)
+        try:
+            f = parse_ts(dt_from)
+            t = parse_ts(dt_to)
+        except ValueError:
+            return Response({"detail": "Invalid timestamp"}, status=400)
+        resp = StreamingHttpResponse(iter_export(dataset, city_id, f, t, fmt, temps), content_type=FORMATS[fmt])
+        ext = "parquet" if fmt == "parquet" else "arrows"
+        resp["Content-Disposition"] = f'attachment; filename="{dataset}_{_safe_name(city_id)}_{f:%Y%m%d%H%M}_{t:%Y%m%d%H%M}.{ext}"'
+        return resp
+
 class DownloadReportView(APIView):
     permission_classes = [IsOpsOrAbove]
 
@@ -0,0 +1,93 @@
+"""
+MQTT telemetry payload codecs.
+
+Besides JSON, devices can publish compact binary payloads (MessagePack or CBOR)
+with short keys and the timestamp as epoch milliseconds:
+
+    {"t": 1718000000000, "T": {"s": 41.2, "ss": 33.0, "i": 24.1, "o": 29.8},
+     "f": 1.12, "p": 131.5, "kw": 4.21, "kwh": 812.3, "fp": 0.31, "pp": 0.74, "pcm": 52.6}
+
+Long keys are accepted too. The codec is picked by a topic suffix
+(city/C1/segment/S1/telemetry/msgpack) or, on MQTT v5 connections, by the
+message's content-type property; anything else is JSON.
+"""
+import json
+from datetime import datetime, timezone
+import cbor2
+import msgpack
+
+KEYS = {
+    "t": "timestamp",
+    "T": "temps",
+    "f": "flow",
+    "p": "pressure",
+    "kw": "kw_gross",
+    "kwh": "kwh_total",
+    "fp": "fan_power",
+    "pp": "pump_power",
+    "pcm": "pcm_temp",
+}
+TEMP_KEYS = {"s": "surface", "ss": "subsurface", "i": "inlet", "o": "outlet"}
+SHORT_KEYS = {v: k for k, v in KEYS.items()}
+SHORT_TEMP_KEYS = {v: k for k, v in TEMP_KEYS.items()}
+
+CODECS = ("json", "msgpack", "cbor")
+CONTENT_TYPES = {
+    "application/json": "json",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+    "application/cbor": "cbor",
+}
+
+_UTC = timezone.utc
+
+def codec_for(suffix=None, content_type=None):
+    if suffix in CODECS:
+        return suffix
+    if content_type:
+        return CONTENT_TYPES.get(content_type.split(";")[0].strip().lower(), "json")
+    return "json"
+
+def _expand(payload):
+    out = {KEYS.get(k, k): v for k, v in payload.items()}
+    temps = out.get("temps")
+    if isinstance(temps, dict):
+        out["temps"] = {TEMP_KEYS.get(k, k): v for k, v in temps.items()}
+    ts = out.get("timestamp")
+    if ts.__class__ is int:
+        # epoch ms; straight to datetime, no ISO round trip
+        try:
+            out["timestamp"] = datetime.fromtimestamp(ts / 1000.0, tz=_UTC)
+        except (OverflowError, OSError, ValueError):
+            out["timestamp"] = None
+    return out
+
+def decode_payload(raw, codec="json"):
+    """Payload bytes -> dict with long keys (binary timestamps as datetimes), or None if undecodable."""
+    try:
+        if codec == "msgpack":
+            payload = msgpack.unpackb(raw, raw=False, strict_map_key=False)
+        elif codec == "cbor":
+            payload = cbor2.loads(raw)
+        else:
+            return json.loads(raw.decode("utf-8"))
+    except Exception:
+        return None
+    return _expand(payload) if isinstance(payload, dict) else None
+
+def encode_payload(payload, codec="json"):
+    """Inverse of decode_payload for a long-key payload with an ISO or datetime timestamp."""
+    if codec == "json":
+        return json.dumps(payload).encode()
+    ts = payload.get("timestamp")
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    out = {SHORT_KEYS.get(k, k): v for k, v in payload.items()}
+    if isinstance(ts, datetime):
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=_UTC)
+        out["t"] = int(ts.timestamp() * 1000)
+    if isinstance(payload.get("temps"), dict):
+        out["T"] = {SHORT_TEMP_KEYS.get(k, k): v for k, v in payload["temps"].items()}
+    return msgpack.packb(out) if codec == "msgpack" else cbor2.dumps(out)
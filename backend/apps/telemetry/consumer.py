@@ -0,0 +1,128 @@
+import queue
+import threading
+import time
+import zlib
+import mongoengine
+from django.conf import settings
+from . import metrics, storage
+from .codec import codec_for, decode_payload
+from .validation import validate_telemetry
+
+# .../telemetry carries JSON (or whatever the v5 content-type says), .../telemetry/<codec> binary payloads
+TOPICS = [
+    "city/+/segment/+/telemetry",
+    "city/+/asset/+/telemetry",
+    "city/+/segment/+/telemetry/+",
+    "city/+/asset/+/telemetry/+",
+]
+
+def topic_filters(share_group=""):
+    # MQTT v5 shared subscriptions: the broker delivers each message to one member of the group,
+    # whatever its topic, so a series' samples are only ordered within one consumer
+    if share_group:
+        return [f"$share/{share_group}/{t}" for t in TOPICS]
+    return list(TOPICS)
+
+def series_key(topic):
+    # city/{city_id}/{segment|asset}/{id}: the same series whichever codec suffix it is published under
+    return "/".join(topic.split("/", 4)[:4])
+
+def partition_of(topic, parts):
+    return zlib.crc32(series_key(topic).encode()) % parts if parts > 1 else 0
+
+def reconnect_mongo():
+    # MongoClient is not fork-safe; forked consumer processes open their own connection
+    mongoengine.disconnect_all()
+    mongoengine.connect(host=settings.MONGO_URI)
+    storage.reset()
+
+def content_type(msg):
+    # MQTT v5 content-type property, None on v3.1.1 connections
+    props = getattr(msg, "properties", None)
+    return getattr(props, "ContentType", None) if props is not None else None
+
+def decode_message(topic, raw, content_type=None):
+    """MQTT topic + payload bytes -> raw telemetry document, or None if it should be dropped."""
+    metrics.RECEIVED.labels("mqtt").inc()
+    parts = topic.split("/")
+    # city/{city_id}/segment/{segment_id}/telemetry[/{codec}]
+    if len(parts) not in (5, 6) or parts[4] != "telemetry":
+        metrics.REJECTED.labels("mqtt", "topic").inc()
+        return None
+    _, city_id, scope_word, scope_id = parts[:4]
+    t0 = time.perf_counter()
+    payload = decode_payload(raw, codec_for(parts[5] if len(parts) == 6 else None, content_type))
+    t1 = time.perf_counter()
+    metrics.STAGE_SECONDS.labels("decode").observe(t1 - t0)
+    if not isinstance(payload, dict):
+        metrics.REJECTED.labels("mqtt", "decode").inc()
+        return None
+
+    data = {
+        "city_id": city_id,
+        "timestamp": payload.get("timestamp"),
+        "temps": payload.get("temps", {}),
+        "flow": payload.get("flow"),
+        "pressure": payload.get("pressure"),
+        "kw_gross": payload.get("kw_gross"),
+        "kwh_total": payload.get("kwh_total"),
+        "fan_power": payload.get("fan_power"),
+        "pump_power": payload.get("pump_power"),
+        "pcm_temp": payload.get("pcm_temp"),
+    }
+    if scope_word == "segment":
+        data["segment_id"] = scope_id
+    else:
+        data["asset_id"] = scope_id
+
+    doc, errors = validate_telemetry(data)
+    metrics.STAGE_SECONDS.labels("validate").observe(time.perf_counter() - t1)
+    if errors:
+        metrics.REJECTED.labels("mqtt", "invalid").inc()
+    return doc
+
+class ConsumerWorkers:
+    """
+    Decode/validate worker threads feeding a BufferedTelemetryWriter. Messages are
+    routed by a stable hash of their series (partition_of), so each segment/asset is
+    always handled by the same worker and its samples reach the writer in arrival
+    order. submit()
+    blocks when that worker's queue is full, which pushes back on the MQTT client.
+    """
+
+    def __init__(self, writer, workers=4, queue_size=10000):
+        self.writer = writer
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.threads = [
+            threading.Thread(target=self._run, args=(q,), name=f"telemetry-worker-{i}", daemon=True)
+            for i, q in enumerate(self.queues)
+        ]
+
+    def start(self):
+        for t in self.threads:
+            t.start()
+        return self
+
+    def submit(self, topic, payload, content_type=None, ack=None):
+        self.queues[partition_of(topic, len(self.queues))].put((topic, payload, content_type, ack))
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def close(self):
+        for q in self.queues:
+            q.put(None)
+        for t in self.threads:
+            t.join()
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            topic, payload, content_type, ack = item
+            doc = decode_message(topic, payload, content_type)
+            if doc is not None:
+                self.writer.add(doc, ack)
+            elif ack is not None:
+                ack()
@@ -0,0 +1,46 @@
+"""
+Duplicate suppression for telemetry ingest.
+
+A sample is identified by (scope, segment/asset id, ts). The plain `telemetry`
+collection enforces that with a unique index (see storage.collection); the
+consumer additionally keeps the most recent keys in an LRU so QoS1 redeliveries
+and gateway retries are dropped before they cost a database round trip.
+Time-series collections cannot carry unique indexes, so there the LRU is the
+only guard.
+"""
+from collections import OrderedDict
+from datetime import timezone
+
+DUPLICATE_KEY_ERROR = 11000
+INDEX_NAME = "series_ts_unique"
+INDEX_KEYS = [("scope", 1), ("segment_id", 1), ("asset_id", 1), ("ts", 1)]
+
+def sample_key(doc):
+    ts = doc["ts"]
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    # Mongo stores ms precision, so samples that differ below that collide in the index too
+    return doc.get("scope"), doc.get("segment_id"), doc.get("asset_id"), int(ts.timestamp() * 1000)
+
+class RecentKeys:
+    """Bounded LRU of recently seen sample keys. Not thread-safe; callers hold their own lock."""
+
+    def __init__(self, maxsize=200000):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+
+    def seen(self, key):
+        """True if key was seen recently; otherwise remembers it and returns False."""
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return True
+        self._keys[key] = None
+        if len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)
+        return False
+
+    def forget(self, key):
+        self._keys.pop(key, None)
+
+    def __len__(self):
+        return len(self._keys)
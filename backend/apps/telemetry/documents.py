@@ -1,6 +1,10 @@
 from mongoengine import Document, StringField, DateTimeField, FloatField, DictField, IntField
 from datetime import datetime, timezone
 
+RETENTION_SECONDS = 60 * 60 * 24 * 14  # 14 days retention
+PAYLOAD_FIELDS = ["flow", "pressure", "kw_gross", "kwh_total", "fan_power", "pump_power", "pcm_temp"]
+TEMP_KEYS = ["surface", "subsurface", "inlet", "outlet"]
+
 class Telemetry(Document):
     scope = StringField(required=True, choices=["segment", "asset"])
     city_id = StringField(required=True)
@@ -21,7 +25,7 @@ class Telemetry(Document):
     meta = {
         "collection": "telemetry",
         "indexes": [
-            {"fields": ["ts"], "expireAfterSeconds": 60 * 60 * 24 * 14},  # 14 days retention
+            {"fields": ["ts"], "expireAfterSeconds": RETENTION_SECONDS},
             "city_id",
             "segment_id",
             "asset_id",
@@ -0,0 +1,117 @@
+"""
+Shape-preserving downsampling of time-ordered rows.
+
+Both functions take an iterator of rows plus its length and stream through it
+once, holding at most two buckets of rows, so memory is bounded by n / points
+rather than by the size of the window. n is the length the rows were counted at;
+an iterator that turns out shorter (rows expired or deleted in between) just ends
+the output early. Rows are expected to have a y value (see y_getter); callers
+leave out the others.
+"""
+from datetime import timezone
+
+def y_getter(field):
+    """row -> float value of field (temps.<key> for temperatures), None when the row has none."""
+    if field.startswith("temps."):
+        key = field[len("temps."):]
+        def get(row):
+            v = (row.get("temps") or {}).get(key)
+            return float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else None
+    else:
+        def get(row):
+            v = row.get(field)
+            return float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else None
+    return get
+
+def _x(row):
+    return row["ts"].replace(tzinfo=timezone.utc).timestamp()
+
+def lttb(rows, n, threshold, y):
+    """Largest-Triangle-Three-Buckets: yields `threshold` of the n rows, keeping first and last."""
+    if threshold < 3 or n <= threshold:
+        yield from rows
+        return
+
+    it = iter(rows)
+    every = (n - 2) / (threshold - 2)
+    pos = 1  # index of the next row the iterator will produce
+
+    def take(i):
+        nonlocal pos
+        end = min(int((i + 1) * every) + 1, n - 1)
+        out = []
+        while pos < end:
+            row = next(it, None)
+            if row is None:
+                break
+            out.append((_x(row), y(row), row))
+            pos += 1
+        return out
+
+    first = next(it, None)
+    if first is None:
+        return
+    ax, ay = _x(first), y(first)
+    yield first
+    cur = take(0)
+    for i in range(threshold - 2):
+        nxt = take(i + 1) if i + 1 < threshold - 2 else []
+        if not nxt:
+            # the bucket after the last one is the final row itself
+            last = next(it, None)
+            if last is None:
+                # fewer rows than counted: end on the last one there is
+                if cur:
+                    yield cur[-1][2]
+                return
+            pos += 1
+            nxt = [(_x(last), y(last), last)]
+        cx = sum(p[0] for p in nxt) / len(nxt)
+        cy = sum(p[1] for p in nxt) / len(nxt)
+
+        best, best_area = None, -1.0
+        for px, py, row in cur:
+            area = abs((ax - cx) * (py - ay) - (ax - px) * (cy - ay))
+            if area > best_area:
+                best, best_area = (px, py, row), area
+        if best is not None:
+            yield best[2]
+            ax, ay = best[0], best[1]
+        cur = nxt
+    # cur now holds the final row
+    yield cur[-1][2]
+
+def minmax(rows, n, threshold, y):
+    """Min/max per bucket: splits the n rows into threshold/2 buckets and yields each bucket's extremes in time order."""
+    buckets = max(1, threshold // 2)
+    if n <= threshold:
+        yield from rows
+        return
+    size = n / buckets
+    b, lo, hi = 0, None, None
+    for i, row in enumerate(rows):
+        if i >= int((b + 1) * size):
+            yield from _extremes(lo, hi)
+            b, lo, hi = b + 1, None, None
+        v = y(row)
+        if v is None:
+            continue
+        if lo is None or v < lo[1]:
+            lo = (i, v, row)
+        if hi is None or v > hi[1]:
+            hi = (i, v, row)
+    yield from _extremes(lo, hi)
+
+def _extremes(lo, hi):
+    if lo is None:
+        return
+    if lo[0] == hi[0]:
+        yield lo[2]
+    elif lo[0] < hi[0]:
+        yield lo[2]
+        yield hi[2]
+    else:
+        yield hi[2]
+        yield lo[2]
+
+ALGORITHMS = {"lttb": lttb, "minmax": minmax}
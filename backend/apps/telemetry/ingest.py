@@ -0,0 +1,362 @@
+import threading
+import time
+from datetime import datetime, timezone
+from pymongo.errors import BulkWriteError, PyMongoError
+from . import latest, metrics, storage
+from .dedup import DUPLICATE_KEY_ERROR, RecentKeys, sample_key
+from .documents import PAYLOAD_FIELDS
+from .spool import SpoolFull
+
+def to_raw(v, ts):
+    # validated ingest data -> document as Telemetry.to_mongo() would store it
+    doc = {
+        "scope": "segment" if v.get("segment_id") else "asset",
+        "city_id": v["city_id"],
+        "ts": ts,
+        "temps": v.get("temps", {}),
+    }
+    if v.get("segment_id"):
+        doc["segment_id"] = v["segment_id"]
+    if v.get("asset_id"):
+        doc["asset_id"] = v["asset_id"]
+    for k in PAYLOAD_FIELDS:
+        if v.get(k) is not None:
+            doc[k] = v[k]
+    return doc
+
+def bulk_insert(docs, on_stored=None):
+    """
+    Unordered insert_many into telemetry storage, then the latest-sample store.
+    Returns (rejected, duplicates): {index: reason} for documents that failed and
+    the indexes of documents whose sample was already stored. on_stored, if given,
+    is called with the documents that were written.
+    """
+    rejected, duplicates = {}, []
+    t0 = time.perf_counter()
+    try:
+        # copies: insert_many sets _id on what it is given, and the batch may still be spooled
+        storage.collection().insert_many([dict(storage.to_storage(d)) for d in docs], ordered=False)
+    except BulkWriteError as e:
+        for err in e.details.get("writeErrors", []):
+            if err.get("code") == DUPLICATE_KEY_ERROR:
+                duplicates.append(err["index"])
+            else:
+                rejected[err["index"]] = err.get("errmsg", "write error")
+    metrics.STAGE_SECONDS.labels("write").observe(time.perf_counter() - t0)
+    skip = set(rejected).union(duplicates)
+    stored = [d for i, d in enumerate(docs) if i not in skip] if skip else docs
+    observe_stored(stored)
+    metrics.DUPLICATES.labels("db").inc(len(duplicates))
+    latest.update(stored)
+    if on_stored is not None:
+        on_stored(stored)
+    return rejected, duplicates
+
+def observe_stored(docs):
+    metrics.STORED.inc(len(docs))
+    now = datetime.now(timezone.utc)
+    for d in docs:
+        ts = d["ts"]
+        metrics.STORE_LAG.observe((now - (ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc))).total_seconds())
+
+class BufferedTelemetryWriter:
+    """
+    Collects raw telemetry documents and writes them with unordered insert_many
+    from a background thread, once max_batch documents are pending or the oldest
+    pending one is max_age seconds old. add() only blocks when max_pending
+    documents are already waiting on the database.
+
+    With dedup_size > 0, add() drops samples whose key is among the last dedup_size
+    seen (stats["cached_duplicates"]); duplicates the database rejects are counted
+    in stats["duplicates"].
+
+    With a spool (spool.Spool), a batch whose insert fails is appended to it and,
+    until a SpoolReplayer gets a batch back into Mongo, later batches go straight
+    to the spool too; a full buffer is spilled there instead of blocking add().
+    add(doc, ack) calls ack once the sample is stored or durably spooled.
+
+    With a kpi stream (apps.kpi.stream.KPIStream), stored documents are fed to it and
+    its KPIs are emitted from the writer thread between flushes.
+    """
+
+    def __init__(self, max_batch=1000, max_age=1.0, max_pending=50000, report_every=10.0, log=None, dedup_size=0,
+                 spool=None, kpi=None):
+        self.max_batch = max_batch
+        self.max_age = max_age
+        self.max_pending = max_pending
+        self.report_every = report_every
+        self.log = log or (lambda msg: None)
+        self.recent = RecentKeys(dedup_size) if dedup_size > 0 else None
+        self.spool = spool
+        self.kpi = kpi
+        self.degraded = False
+
+        self._buf = []
+        self._acks = []
+        self._unsynced_acks = []
+        self._oldest = None
+        self._closing = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+
+        self.stats = {"flushes": 0, "written": 0, "failed": 0, "duplicates": 0, "cached_duplicates": 0,
+                      "spooled": 0, "max_flush_ms": 0.0}
+        self._window = {"flushes": 0, "docs": 0, "ms": 0.0, "max_ms": 0.0}
+        self._last_report = time.monotonic()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def add(self, doc, ack=None):
+        acks = []
+        with self._cond:
+            if self.recent is not None and self.recent.seen(sample_key(doc)):
+                self.stats["cached_duplicates"] += 1
+                metrics.DUPLICATES.labels("cache").inc()
+                acks = [ack]
+            else:
+                while len(self._buf) >= self.max_pending and not self._closing:
+                    if self.spool is not None:
+                        spilled = self._spill()
+                        if spilled is not None:
+                            acks.extend(spilled)
+                            continue
+                    self._cond.wait(0.5)
+                if not self._buf:
+                    self._oldest = time.monotonic()
+                self._buf.append(doc)
+                self._acks.append(ack)
+                if len(self._buf) >= self.max_batch:
+                    self._cond.notify_all()
+        self._ack(acks)
+
+    def _spill(self):
+        # buffer full while Mongo is slow: move it to disk instead of blocking the consumer.
+        # Called with _cond held; it is released for the disk write so other add() calls and
+        # the writer thread do not wait on the fsync. Returns the acks to deliver, None if the spool is full.
+        buf, acks, oldest = self._buf, self._acks, self._oldest
+        self._buf, self._acks, self._oldest = [], [], None
+        self._cond.release()
+        try:
+            self.spool.append(buf)
+            spooled = True
+        except SpoolFull:
+            spooled = False
+        finally:
+            self._cond.acquire()
+        if not spooled:
+            # back in front of whatever was added meanwhile
+            self._buf[:0] = buf
+            self._acks[:0] = acks
+            self._oldest = oldest
+            return None
+        self.stats["spooled"] += len(buf)
+        metrics.SPOOLED.inc(len(buf))
+        return self._spooled(acks)
+
+    def _spooled(self, acks):
+        # acks for spooled samples wait for the next fsync under the interval policy
+        if self.spool.fsync == "interval":
+            self._unsynced_acks.extend(acks)
+            return []
+        return acks
+
+    @staticmethod
+    def _ack(acks):
+        for ack in acks:
+            if ack is not None:
+                ack()
+
+    def recovered(self):
+        """Called by the SpoolReplayer once Mongo takes writes again."""
+        self.degraded = False
+
+    def pending(self):
+        with self._cond:
+            return len(self._buf)
+
+    def close(self, timeout=30.0):
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._report(force=True)
+
+    def _due(self):
+        if not self._buf:
+            return False
+        return len(self._buf) >= self.max_batch or time.monotonic() - self._oldest >= self.max_age
+
+    def _chores_in(self):
+        # seconds until spooled acks can be fsynced or KPIs emitted, None when there are neither
+        waits = []
+        if self._unsynced_acks:
+            waits.append(self.spool.sync_in() or 0.0)
+        emit = self.kpi.emit_in() if self.kpi is not None else None
+        if emit is not None:
+            waits.append(emit)
+        return min(waits) if waits else None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closing and not self._due():
+                    chores = self._chores_in()
+                    if chores is not None and chores <= 0:
+                        break
+                    wait = self.max_age if not self._buf else self.max_age - (time.monotonic() - self._oldest)
+                    if chores is not None:
+                        wait = min(wait, chores)
+                    self._cond.wait(max(wait, 0.01))
+                batch, acks = [], []
+                if self._closing or self._due():
+                    # otherwise only the fsync / KPI emit part of _step runs, the buffer keeps filling
+                    batch, acks = self._buf[:self.max_batch], self._acks[:self.max_batch]
+                    del self._buf[:self.max_batch]
+                    del self._acks[:self.max_batch]
+                    self._oldest = time.monotonic() if self._buf else None
+                done = self._closing and not self._buf
+                self._cond.notify_all()
+            try:
+                self._step(batch, acks, done)
+            except Exception as e:
+                # the thread must outlive one bad batch; its unacked QoS 1 samples are redelivered,
+                # so the dedup cache must let them through (those already stored hit the unique index)
+                self.log(f"Telemetry writer error ({len(batch)} documents in the batch): {e!r}")
+                if batch and self.recent is not None:
+                    with self._cond:
+                        for d in batch:
+                            self.recent.forget(sample_key(d))
+            if done:
+                return
+
+    def _step(self, batch, acks, done):
+        if batch:
+            self._flush(batch, acks)
+        if self._unsynced_acks:
+            # taken before the fsync, so every one of them belongs to an append it covers
+            with self._cond:
+                waiting, self._unsynced_acks = self._unsynced_acks, []
+            if self.spool.sync(force=done):
+                self._ack(waiting)
+            else:
+                with self._cond:
+                    self._unsynced_acks[:0] = waiting
+        if self.kpi is not None:
+            self.kpi.emit_due(force=done)
+        self._report()
+
+    def _flush(self, batch, acks):
+        t0 = time.perf_counter()
+        rejected, duplicates, spooled = {}, [], 0
+        if self.degraded and self._spool_batch(batch, acks):
+            spooled = len(batch)
+        else:
+            try:
+                rejected, duplicates = bulk_insert(batch, self.kpi.add if self.kpi is not None else None)
+                if rejected:
+                    # malformed for Mongo; a redelivery would not fare better, so these are acked too
+                    self.log(f"Bulk insert: {len(rejected)} of {len(batch)} documents rejected")
+                self._ack(acks)
+            except PyMongoError as e:
+                self.log(f"Bulk insert of {len(batch)} documents failed: {e}")
+                if self.spool is not None and self._spool_batch(batch, acks):
+                    self.degraded = True
+                    spooled = len(batch)
+                else:
+                    rejected = dict.fromkeys(range(len(batch)))
+        ms = (time.perf_counter() - t0) * 1000.0
+        if rejected and self.recent is not None:
+            # not stored, so a redelivery must get through
+            with self._cond:
+                for i in rejected:
+                    self.recent.forget(sample_key(batch[i]))
+
+        self.stats["flushes"] += 1
+        self.stats["written"] += len(batch) - len(rejected) - len(duplicates) - spooled
+        self.stats["failed"] += len(rejected)
+        self.stats["duplicates"] += len(duplicates)
+        self.stats["spooled"] += spooled
+        metrics.SPOOLED.inc(spooled)
+        if rejected:
+            metrics.REJECTED.labels("mqtt", "db").inc(len(rejected))
+        self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], ms)
+        w = self._window
+        w["flushes"] += 1
+        w["docs"] += len(batch)
+        w["ms"] += ms
+        w["max_ms"] = max(w["max_ms"], ms)
+
+    def _spool_batch(self, batch, acks):
+        if self.spool is None:
+            return False
+        try:
+            self.spool.append(batch)
+        except SpoolFull as e:
+            self.log(f"Spool full, {len(batch)} documents not spooled: {e}")
+            return False
+        with self._cond:
+            acks = self._spooled(acks)
+        self._ack(acks)
+        return True
+
+    def _report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_report < self.report_every:
+            return
+        w = self._window
+        if w["flushes"]:
+            self.log(
+                f"Flushed {w['docs']} docs in {w['flushes']} batches over {now - self._last_report:.1f}s "
+                f"(avg batch {w['docs'] / w['flushes']:.0f}, avg {w['ms'] / w['flushes']:.1f}ms, max {w['max_ms']:.1f}ms, "
+                f"pending {len(self._buf)}, spooled {self.spool.size() if self.spool is not None else 0} bytes, duplicates so far {self.stats['duplicates']} db / {self.stats['cached_duplicates']} cache)"
+            )
+        self._window = {"flushes": 0, "docs": 0, "ms": 0.0, "max_ms": 0.0}
+        self._last_report = now
+
+class SpoolReplayer:
+    """
+    Background thread draining a Spool back into telemetry storage, one spooled
+    batch per bulk_insert, oldest first; on a database error it retries after
+    `retry` seconds. Each batch that gets in tells the writer Mongo is back.
+    """
+
+    def __init__(self, spool, writer=None, retry=5.0, log=None):
+        self.spool = spool
+        self.writer = writer
+        self.retry = retry
+        self.log = log or (lambda msg: None)
+        self.stats = {"replayed": 0, "duplicates": 0, "failed": 0}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="telemetry-spool-replayer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self, timeout=10.0):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            item = self.spool.next_batch()
+            if item is None:
+                self._stop.wait(1.0)
+                continue
+            position, docs = item
+            kpi = self.writer.kpi if self.writer is not None else None
+            try:
+                rejected, duplicates = bulk_insert(docs, kpi.add if kpi is not None else None)
+            except PyMongoError as e:
+                self.log(f"Spool replay failed, retrying in {self.retry:.0f}s: {e}")
+                self._stop.wait(self.retry)
+                continue
+            self.spool.commit(position)
+            self.stats["replayed"] += len(docs) - len(rejected) - len(duplicates)
+            self.stats["duplicates"] += len(duplicates)
+            self.stats["failed"] += len(rejected)
+            if self.writer is not None and self.writer.degraded:
+                self.writer.recovered()
+                self.log(f"Mongo writes recovered; {self.spool.size()} spooled bytes left to replay")
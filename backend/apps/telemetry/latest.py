@@ -0,0 +1,114 @@
+"""
+Last known telemetry sample per segment / asset, kept in Redis.
+
+Per scope there are two hashes: telemetry:latest:<scope> maps the series id to the
+sample as JSON, telemetry:latest_ts:<scope> maps it to the sample's epoch ms; the set
+telemetry:latest_ids:<scope>:<city_id> holds the series ids of one city, so a city's
+snapshot is one HMGET of its own ids. Both ingest paths call update() after the
+samples are stored; the Lua script only replaces a sample with a newer one, so late
+batches and concurrent consumers never move a series backwards.
+
+Redis being down does not fail ingest: update() logs and drops the write, readers
+get redis.RedisError and fall back to Mongo where they need to.
+"""
+import json
+import logging
+from datetime import timezone
+import redis
+from django.conf import settings
+from apps.common.streaming import encode
+
+log = logging.getLogger(__name__)
+
+SCOPES = ("segment", "asset")
+KEY = "telemetry:latest:{}"
+TS_KEY = "telemetry:latest_ts:{}"
+IDS_KEY = "telemetry:latest_ids:{}:{}"
+
+# KEYS: values hash, ts hash, city ids set; ARGV: id, ts_ms, json, id, ts_ms, json, ...
+SET_NEWER = """
+local n = 0
+for i = 1, #ARGV, 3 do
+  redis.call('SADD', KEYS[3], ARGV[i])
+  local cur = redis.call('HGET', KEYS[2], ARGV[i])
+  if not cur or tonumber(cur) <= tonumber(ARGV[i + 1]) then
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 2])
+    n = n + 1
+  end
+end
+return n
+"""
+
+_client = None
+_set_newer = None
+
+def client():
+    global _client, _set_newer
+    if _client is None:
+        _client = redis.Redis.from_url(settings.TELEMETRY_LATEST_REDIS_URL, socket_connect_timeout=1, socket_timeout=2)
+        _set_newer = _client.register_script(SET_NEWER)
+    return _client
+
+def series_id(doc):
+    return doc.get("segment_id") if doc.get("scope") == "segment" else doc.get("asset_id")
+
+def _ms(ts):
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() * 1000)
+
+def update(docs):
+    """Record the newest sample per series from stored (flat) telemetry documents; returns series written."""
+    if not settings.TELEMETRY_LATEST_ENABLED:
+        return 0
+    newest = {}
+    for d in docs:
+        sid = series_id(d)
+        if not sid or d.get("scope") not in SCOPES:
+            continue
+        ms = _ms(d["ts"])
+        cur = newest.get((d["scope"], sid))
+        if cur is None or ms >= cur[0]:
+            newest[(d["scope"], sid)] = (ms, d)
+    if not newest:
+        return 0
+
+    args = {}
+    for (scope, sid), (ms, d) in newest.items():
+        sample = {k: v for k, v in d.items() if k != "_id"}
+        args.setdefault((scope, d.get("city_id")), []).extend((sid, ms, encode(sample)))
+    try:
+        r = client()
+        pipe = r.pipeline(transaction=False)
+        for (scope, city_id), a in args.items():
+            _set_newer(keys=[KEY.format(scope), TS_KEY.format(scope), IDS_KEY.format(scope, city_id)], args=a, client=pipe)
+        return sum(pipe.execute())
+    except redis.RedisError as e:
+        log.warning("latest telemetry not updated in Redis: %s", e)
+        return 0
+
+def get_many(scope, ids):
+    """{id: sample} for the ids that have one; samples are the stored document with ts as an ISO string."""
+    ids = list(ids)
+    if not ids:
+        return {}
+    values = client().hmget(KEY.format(scope), ids)
+    return {i: json.loads(v) for i, v in zip(ids, values) if v is not None}
+
+def snapshot(scope, city_id=None):
+    """Every series' latest sample for a scope, optionally only one city's."""
+    if city_id:
+        return list(get_many(scope, client().smembers(IDS_KEY.format(scope, city_id))).values())
+    return [json.loads(v) for v in client().hgetall(KEY.format(scope)).values()]
+
+def forget(scope, city_id, ids):
+    """Drop the latest samples of the given series of a city."""
+    ids = list(ids)
+    if not ids:
+        return
+    pipe = client().pipeline(transaction=False)
+    pipe.hdel(KEY.format(scope), *ids)
+    pipe.hdel(TS_KEY.format(scope), *ids)
+    pipe.srem(IDS_KEY.format(scope, city_id), *ids)
+    pipe.execute()
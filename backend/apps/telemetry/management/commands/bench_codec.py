@@ -0,0 +1,56 @@
+import random
+import time
+from datetime import datetime, timezone, timedelta
+from django.core.management.base import BaseCommand
+from apps.telemetry.codec import CODECS, decode_payload, encode_payload
+from apps.telemetry.consumer import decode_message
+
+def payloads(n):
+    # simulator-shaped messages (simulator/publisher.py)
+    start = datetime.now(timezone.utc)
+    for i in range(n):
+        yield {
+            "timestamp": (start + timedelta(seconds=5 * i)).isoformat(),
+            "temps": {
+                "surface": round(30 + random.random() * 10, 2),
+                "subsurface": round(28 + random.random() * 4, 2),
+                "inlet": round(24 + random.random(), 2),
+                "outlet": round(29 + random.random() * 2, 2),
+            },
+            "flow": round(0.8 + random.random() * 0.6, 3),
+            "pressure": round(120 + random.random() * 20, 2),
+            "kw_gross": round(random.random() * 18, 3),
+            "kwh_total": round(i * 0.01, 3),
+            "pump_power": round(0.6 + random.random() * 0.3, 3),
+            "fan_power": round(0.2 + random.random() * 0.3, 3),
+            "pcm_temp": round(45 + random.random() * 15, 2),
+        }
+
+class Command(BaseCommand):
+    help = "Compare JSON, MessagePack and CBOR telemetry payloads: bytes per message and consumer decode+validate cost."
+
+    def add_arguments(self, parser):
+        parser.add_argument("-n", type=int, default=100000, help="Messages per codec.")
+
+    def handle(self, *args, **options):
+        random.seed(7)
+        msgs = list(payloads(options["n"]))
+        base = None
+        for codec in CODECS:
+            encoded = [encode_payload(m, codec) for m in msgs]
+            topic = "city/C1/segment/Z1S1/telemetry" + ("" if codec == "json" else f"/{codec}")
+            t0 = time.perf_counter()
+            for raw in encoded:
+                decode_payload(raw, codec)
+            decode_us = (time.perf_counter() - t0) / len(encoded) * 1e6
+            t0 = time.perf_counter()
+            ok = sum(1 for raw in encoded if decode_message(topic, raw) is not None)
+            dt = time.perf_counter() - t0
+            size = sum(len(raw) for raw in encoded) / len(encoded)
+            per_msg = dt / len(encoded) * 1e6
+            base = base or (size, decode_us, per_msg)
+            self.stdout.write(
+                f"{codec:>8}: {size:6.1f} bytes/msg ({size / base[0]:.0%} of json) | "
+                f"decode {decode_us:5.2f} us/msg ({decode_us / base[1]:.0%}) | "
+                f"decode+validate {per_msg:6.2f} us/msg ({per_msg / base[2]:.0%}) | {ok} valid"
+            )
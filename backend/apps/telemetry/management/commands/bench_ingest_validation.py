@@ -0,0 +1,75 @@
+import random
+import time
+from datetime import datetime, timezone, timedelta
+from django.core.management.base import BaseCommand
+from apps.telemetry.serializers import TelemetryIngestSerializer
+from apps.telemetry.documents import parse_ts, Telemetry
+from apps.telemetry.validation import validate_telemetry
+
+def sample_payloads(n, invalid_ratio=0.05):
+    t0 = datetime.now(timezone.utc)
+    rows = []
+    for i in range(n):
+        d = {
+            "city_id": "C1",
+            "segment_id": f"Z1S{i % 15 + 1}",
+            "timestamp": (t0 + timedelta(seconds=5 * i)).isoformat(),
+            "temps": {"surface": 41.2, "subsurface": 33.9, "inlet": 25.1, "outlet": 31.7},
+            "flow": 1.12, "pressure": 128.4, "kw_gross": 5.31, "kwh_total": 812.4,
+            "fan_power": 0.31, "pump_power": 0.74, "pcm_temp": 52.3,
+        }
+        if random.random() < invalid_ratio:
+            d[random.choice(["flow", "timestamp", "temps"])] = "bad"
+        rows.append(d)
+    return rows
+
+def serializer_path(d):
+    # what on_message / TelemetryIngestView did per sample before the fast path
+    ser = TelemetryIngestSerializer(data=d)
+    if not ser.is_valid():
+        return None
+    v = ser.validated_data
+    try:
+        ts = parse_ts(v["timestamp"])
+    except ValueError:
+        return None
+    return Telemetry(
+        scope="segment" if v.get("segment_id") else "asset",
+        city_id=v["city_id"],
+        segment_id=v.get("segment_id") or None,
+        asset_id=v.get("asset_id") or None,
+        ts=ts,
+        temps=v.get("temps", {}),
+        flow=v.get("flow"),
+        pressure=v.get("pressure"),
+        kw_gross=v.get("kw_gross"),
+        kwh_total=v.get("kwh_total"),
+        fan_power=v.get("fan_power"),
+        pump_power=v.get("pump_power"),
+        pcm_temp=v.get("pcm_temp"),
+    ).to_mongo()
+
+def fast_path(d):
+    doc, errors = validate_telemetry(d)
+    return doc
+
+class Command(BaseCommand):
+    help = "Benchmark per-message validation cost: DRF serializer + Telemetry document vs fast-path validator."
+
+    def add_arguments(self, parser):
+        parser.add_argument("-n", type=int, default=50000, help="Number of payloads.")
+        parser.add_argument("--invalid-ratio", type=float, default=0.05)
+
+    def handle(self, *args, **options):
+        random.seed(42)
+        rows = sample_payloads(options["n"], options["invalid_ratio"])
+        results = {}
+        for name, fn in [("serializer", serializer_path), ("fast-path", fast_path)]:
+            t0 = time.perf_counter()
+            ok = sum(1 for d in rows if fn(d) is not None)
+            elapsed = time.perf_counter() - t0
+            results[name] = elapsed
+            self.stdout.write(
+                f"{name:>10}: {elapsed * 1e6 / len(rows):8.2f} us/msg  {len(rows) / elapsed:10.0f} msg/s  ({ok} accepted)"
+            )
+        self.stdout.write(self.style.SUCCESS(f"speedup: {results['serializer'] / results['fast-path']:.1f}x"))
@@ -0,0 +1,92 @@
+import random
+import time
+from datetime import datetime, timezone, timedelta
+from django.core.management.base import BaseCommand
+from mongoengine.connection import get_db
+from apps.telemetry.documents import RETENTION_SECONDS
+from apps.telemetry.storage import META_FIELDS, ensure_timeseries_collection
+
+PLAIN = "bench_telemetry_plain"
+TIMESERIES = "bench_telemetry_ts"
+
+def plain_collection(db):
+    coll = db[PLAIN]
+    # same indexes as the Telemetry document
+    coll.create_index("ts", expireAfterSeconds=RETENTION_SECONDS)
+    for k in ("city_id", "segment_id", "asset_id", "scope"):
+        coll.create_index(k)
+    return coll
+
+def synthetic(n, segments, start):
+    for i in range(n):
+        seg = i % segments
+        yield {
+            "scope": "segment",
+            "city_id": f"C{seg % 4}",
+            "segment_id": f"S{seg}",
+            "ts": start + timedelta(seconds=5 * (i // segments)),
+            "temps": {"surface": 30 + random.random() * 10, "subsurface": 28.0, "inlet": 25.0, "outlet": 31.0},
+            "flow": 1.1, "pressure": 128.0, "kw_gross": random.random() * 10, "kwh_total": i * 0.01,
+            "fan_power": 0.3, "pump_power": 0.7, "pcm_temp": 52.0,
+        }
+
+def nest(doc):
+    doc = dict(doc)
+    doc["meta"] = {k: doc.pop(k) for k in META_FIELDS if k in doc}
+    return doc
+
+class Command(BaseCommand):
+    help = "Benchmark plain vs time-series telemetry storage: ingest rate, storage size and per-segment range scans."
+
+    def add_arguments(self, parser):
+        parser.add_argument("-n", type=int, default=500000, help="Samples to insert.")
+        parser.add_argument("--segments", type=int, default=500)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--queries", type=int, default=200, help="Per-segment range scans to time.")
+        parser.add_argument("--keep", action="store_true", help="Keep the scratch collections.")
+
+    def handle(self, *args, **options):
+        db = get_db()
+        db.drop_collection(PLAIN)
+        db.drop_collection(TIMESERIES)
+        layouts = [
+            ("plain", plain_collection(db), lambda d: d, "segment_id"),
+            ("time-series", ensure_timeseries_collection(db, TIMESERIES), nest, "meta.segment_id"),
+        ]
+        n, segments = options["n"], options["segments"]
+        start = datetime.now(timezone.utc) - timedelta(seconds=5 * (n // segments + 1))
+        span = timedelta(seconds=5 * (n // segments))
+
+        for name, coll, shape, seg_field in layouts:
+            random.seed(7)
+            t0 = time.perf_counter()
+            batch = []
+            for doc in synthetic(n, segments, start):
+                batch.append(shape(doc))
+                if len(batch) >= options["batch_size"]:
+                    coll.insert_many(batch, ordered=False)
+                    batch = []
+            if batch:
+                coll.insert_many(batch, ordered=False)
+            ingest_s = time.perf_counter() - t0
+
+            stats = db.command("collStats", coll.name)
+            storage_mb = stats.get("storageSize", 0) / 1e6
+            index_mb = stats.get("totalIndexSize", 0) / 1e6
+
+            t0 = time.perf_counter()
+            rows = 0
+            for q in range(options["queries"]):
+                lo = start + span * random.random() * 0.9
+                cur = coll.find({seg_field: f"S{random.randrange(segments)}", "ts": {"$gte": lo, "$lte": lo + span / 10}})
+                rows += sum(1 for _ in cur)
+            query_s = time.perf_counter() - t0
+
+            self.stdout.write(
+                f"{name:>12}: ingest {n / ingest_s:9.0f} docs/s | storage {storage_mb:8.1f} MB | indexes {index_mb:7.1f} MB | "
+                f"range scans {options['queries'] / query_s:7.1f} q/s ({rows / max(options['queries'], 1):.0f} rows/q)"
+            )
+
+        if not options["keep"]:
+            db.drop_collection(PLAIN)
+            db.drop_collection(TIMESERIES)
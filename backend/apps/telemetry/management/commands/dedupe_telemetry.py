@@ -0,0 +1,43 @@
+import time
+from django.core.management.base import BaseCommand
+from apps.telemetry.dedup import INDEX_KEYS, INDEX_NAME
+from apps.telemetry.documents import Telemetry
+from apps.telemetry.storage import ensure_unique_index
+
+class Command(BaseCommand):
+    help = "Delete duplicate telemetry samples (same series and ts, oldest copy kept) and build the unique index."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000, help="Duplicate _ids deleted per delete_many.")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        coll = Telemetry._get_collection()
+        key = {k: f"${k}" for k, _ in INDEX_KEYS}
+        pipeline = [
+            {"$group": {"_id": key, "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+            {"$match": {"n": {"$gt": 1}}},
+        ]
+        t0 = time.perf_counter()
+        groups = deleted = 0
+        batch = []
+        for g in coll.aggregate(pipeline, allowDiskUse=True):
+            groups += 1
+            batch.extend(sorted(g["ids"])[1:])
+            if len(batch) >= options["batch_size"]:
+                deleted += self._delete(coll, batch, options["dry_run"])
+                batch = []
+        if batch:
+            deleted += self._delete(coll, batch, options["dry_run"])
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(f"{verb} {deleted} duplicates across {groups} samples in {time.perf_counter() - t0:.1f}s")
+        if not options["dry_run"]:
+            if INDEX_NAME in ensure_unique_index(coll).index_information():
+                self.stdout.write(self.style.SUCCESS("Unique index in place"))
+            else:
+                self.stderr.write("Unique index could not be built; new duplicates arrived meanwhile? Run again.")
+
+    def _delete(self, coll, ids, dry_run):
+        if dry_run:
+            return len(ids)
+        return coll.delete_many({"_id": {"$in": ids}}).deleted_count
@@ -0,0 +1,55 @@
+import time
+from bson import ObjectId
+from django.core.management.base import BaseCommand
+from pymongo.errors import BulkWriteError
+from apps.telemetry.documents import Telemetry, parse_ts
+from apps.telemetry.storage import META_FIELDS, TS_COLLECTION, ensure_timeseries_collection
+
+class Command(BaseCommand):
+    help = "Copy telemetry from the plain `telemetry` collection into the time-series collection in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument("--since", help="Only copy samples with ts >= this ISO timestamp.")
+        parser.add_argument("--after-id", help="Resume after this source _id (printed with each batch); "
+                                               "time-series collections do not reject re-copied samples.")
+        parser.add_argument("--target", default=TS_COLLECTION, help="Target time-series collection.")
+
+    def handle(self, *args, **options):
+        source = Telemetry._get_collection()
+        target = ensure_timeseries_collection(source.database, options["target"])
+
+        q = {}
+        if options["since"]:
+            q["ts"] = {"$gte": parse_ts(options["since"])}
+        last_id = ObjectId(options["after_id"]) if options["after_id"] else None
+
+        copied = 0
+        t0 = time.perf_counter()
+        while True:
+            bq = dict(q)
+            if last_id is not None:
+                bq["_id"] = {"$gt": last_id}
+            batch = list(source.find(bq).sort("_id", 1).limit(options["batch_size"]))
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+
+            docs = []
+            for d in batch:
+                meta = {k: d.pop(k) for k in META_FIELDS if k in d}
+                d["meta"] = meta
+                docs.append(d)
+            try:
+                target.insert_many(docs, ordered=False)
+                n = len(docs)
+            except BulkWriteError as e:
+                n = e.details.get("nInserted", 0)
+            copied += n
+            rate = copied / max(time.perf_counter() - t0, 1e-9)
+            self.stdout.write(f"copied {copied} ({rate:.0f} docs/s), last _id {last_id}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Copied {copied} samples into {options['target']} in {time.perf_counter() - t0:.1f}s. "
+            f"Set TELEMETRY_TIMESERIES=1 to read and write the time-series collection."
+        ))
@@ -1,80 +1,179 @@
-import json
+import multiprocessing
+import os
+import signal
+import socket
 import time
 from django.core.management.base import BaseCommand
 from django.conf import settings
 import paho.mqtt.client as mqtt
-from apps.telemetry.serializers import TelemetryIngestSerializer
-from apps.telemetry.documents import parse_ts, Telemetry
+import prometheus_client
+from apps.kpi.stream import KPIStream
+from apps.telemetry import metrics
+from apps.telemetry.ingest import BufferedTelemetryWriter, SpoolReplayer
+from apps.telemetry.spool import FSYNC_POLICIES, Spool
+from apps.telemetry.consumer import (
+    ConsumerWorkers, content_type, decode_message, partition_of, reconnect_mongo, topic_filters,
+)
 
 class Command(BaseCommand):
     help = "MQTT consumer that subscribes to telemetry topics and stores data in MongoDB."
 
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.TELEMETRY_BATCH_SIZE,
+                            help="Flush once this many samples are buffered.")
+        parser.add_argument("--flush-interval", type=float, default=settings.TELEMETRY_FLUSH_INTERVAL,
+                            help="Flush buffered samples at least this often (seconds).")
+        parser.add_argument("--processes", type=int, default=settings.MQTT_CONSUMER_PROCESSES,
+                            help="Consumer processes to run; each one keeps a fixed partition of the series.")
+        parser.add_argument("--workers", type=int, default=settings.MQTT_CONSUMER_WORKERS,
+                            help="Decode/validate worker threads per process (0 = handle on the MQTT thread).")
+        parser.add_argument("--dedup-cache", type=int, default=settings.TELEMETRY_DEDUP_CACHE_SIZE,
+                            help="Recent sample keys kept to drop redelivered duplicates (0 = off).")
+        parser.add_argument("--spool-dir", default=settings.TELEMETRY_SPOOL_DIR,
+                            help="Spool batches here while Mongo is slow or down (empty = off).")
+        parser.add_argument("--spool-fsync", choices=FSYNC_POLICIES, default=settings.TELEMETRY_SPOOL_FSYNC)
+        parser.add_argument("--qos", type=int, choices=[0, 1, 2], default=settings.MQTT_SUBSCRIBE_QOS,
+                            help="Subscription QoS.")
+        parser.add_argument("--ack-after-store", action="store_true", default=settings.MQTT_ACK_AFTER_STORE,
+                            help="Ack QoS>0 messages only once stored in Mongo or the spool.")
+        parser.add_argument("--share-group", default=settings.MQTT_SHARE_GROUP,
+                            help="Subscribe via $share/<group>/... so consumers (e.g. on several hosts) split the stream "
+                                 "(MQTT v5); per-series ordering then only holds within each consumer.")
+        parser.add_argument("--kpi-cadence", type=float,
+                            default=settings.KPI_STREAM_CADENCE if settings.KPI_STREAM_ENABLED else 0.0,
+                            help="Compute segment KPIs from ingested samples this often (seconds; 0 = leave it to compute_kpis).")
+        parser.add_argument("--metrics-port", type=int, default=settings.MQTT_CONSUMER_METRICS_PORT,
+                            help="Serve Prometheus metrics on this port, +i for process i (0 = off).")
+
     def handle(self, *args, **options):
-        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        processes = max(1, options["processes"])
+        if processes == 1:
+            self.consume(options)
+            return
+
+        ctx = multiprocessing.get_context("fork")
+        children = [ctx.Process(target=self.consume, args=(options, i), daemon=False) for i in range(processes)]
+        for p in children:
+            p.start()
+        self.stdout.write(self.style.SUCCESS(
+            f"Started {processes} consumer processes in share group '{options['share_group']}'" if options["share_group"]
+            else f"Started {processes} consumer processes, one series partition each"
+        ))
+
+        def on_signal(signum, frame):
+            for p in children:
+                if p.is_alive():
+                    os.kill(p.pid, signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, on_signal)
+        signal.signal(signal.SIGINT, on_signal)
+        for p in children:
+            p.join()
+
+    def consume(self, options, index=None):
+        tag = "" if index is None else f"[consumer {index}] "
+        if index is not None:
+            reconnect_mongo()
+
+        log = lambda msg: self.stdout.write(f"{tag}{msg}")
+        share_group = options["share_group"]
+        # without a share group every process receives every message and keeps its own partition
+        # of the series (partition_of), so a segment's samples are stored in order by one process
+        parts = options["processes"] if index is not None and not share_group else 1
+        client_id = f"thermocity-consumer-{socket.gethostname()}-{os.getpid()}"
+        manual_ack = options["ack_after_store"]
+        if share_group or settings.MQTT_V5:
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, protocol=mqtt.MQTTv5,
+                                 manual_ack=manual_ack)
+        else:
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, manual_ack=manual_ack)
+        spool = None
+        if options["spool_dir"]:
+            # one spool per process
+            spool_dir = options["spool_dir"] if index is None else os.path.join(options["spool_dir"], f"p{index}")
+            spool = Spool(
+                spool_dir,
+                segment_bytes=settings.TELEMETRY_SPOOL_SEGMENT_MB << 20,
+                max_bytes=settings.TELEMETRY_SPOOL_MAX_MB << 20,
+                fsync=options["spool_fsync"],
+                fsync_interval=settings.TELEMETRY_SPOOL_FSYNC_INTERVAL,
+            )
+            if spool:
+                log(f"Spool {spool_dir} holds {spool.size()} bytes from a previous run, replaying")
+        kpi = KPIStream(cadence=options["kpi_cadence"], log=log) if options["kpi_cadence"] > 0 else None
+        writer = BufferedTelemetryWriter(
+            max_batch=options["batch_size"],
+            max_age=options["flush_interval"],
+            log=log,
+            dedup_size=options["dedup_cache"],
+            spool=spool,
+            kpi=kpi,
+        ).start()
+        replayer = SpoolReplayer(spool, writer, log=log).start() if spool is not None else None
+        workers = ConsumerWorkers(writer, options["workers"]).start() if options["workers"] > 0 else None
+        if options["metrics_port"]:
+            port = options["metrics_port"] + (index or 0)
+            metrics.BUFFER_DEPTH.labels("writer").set_function(writer.pending)
+            if workers:
+                metrics.BUFFER_DEPTH.labels("workers").set_function(workers.depth)
+            if spool is not None:
+                metrics.SPOOL_BYTES.set_function(spool.size)
+            prometheus_client.start_http_server(port)
+            log(f"Metrics on :{port}/metrics")
+        stopping = False
 
         def on_connect(cl, userdata, flags, rc, properties=None):
-            self.stdout.write(self.style.SUCCESS(f"Connected to MQTT broker with rc={rc}"))
-            cl.subscribe("city/+/segment/+/telemetry")
-            cl.subscribe("city/+/asset/+/telemetry")
+            log(self.style.SUCCESS(f"Connected to MQTT broker with rc={rc}"))
+            for t in topic_filters(share_group):
+                cl.subscribe(t, qos=options["qos"])
 
         def on_message(cl, userdata, msg):
-            try:
-                payload = json.loads(msg.payload.decode("utf-8"))
-            except Exception:
-                return
-
-            parts = msg.topic.split("/")
-            # city/{city_id}/segment/{segment_id}/telemetry
-            if len(parts) != 5:
+            ack = (lambda mid=msg.mid, qos=msg.qos: cl.ack(mid, qos)) if manual_ack else None
+            if parts > 1 and partition_of(msg.topic, parts) != index:
+                if ack:
+                    ack()
                 return
-            _, city_id, scope_word, scope_id, _ = parts
-            data = {
-                "city_id": city_id,
-                "timestamp": payload.get("timestamp"),
-                "temps": payload.get("temps", {}),
-                "flow": payload.get("flow"),
-                "pressure": payload.get("pressure"),
-                "kw_gross": payload.get("kw_gross"),
-                "kwh_total": payload.get("kwh_total"),
-                "fan_power": payload.get("fan_power"),
-                "pump_power": payload.get("pump_power"),
-                "pcm_temp": payload.get("pcm_temp"),
-            }
-            if scope_word == "segment":
-                data["segment_id"] = scope_id
-            else:
-                data["asset_id"] = scope_id
-
-            ser = TelemetryIngestSerializer(data=data)
-            if not ser.is_valid():
+            if workers:
+                workers.submit(msg.topic, msg.payload, content_type(msg), ack)
                 return
+            doc = decode_message(msg.topic, msg.payload, content_type(msg))
+            if doc is not None:
+                writer.add(doc, ack)
+            elif ack:
+                ack()
 
-            v = ser.validated_data
-            ts = parse_ts(v["timestamp"])
-            scope = "segment" if v.get("segment_id") else "asset"
-            Telemetry(
-                scope=scope,
-                city_id=v["city_id"],
-                segment_id=v.get("segment_id") or None,
-                asset_id=v.get("asset_id") or None,
-                ts=ts,
-                temps=v.get("temps", {}),
-                flow=v.get("flow"),
-                pressure=v.get("pressure"),
-                kw_gross=v.get("kw_gross"),
-                kwh_total=v.get("kwh_total"),
-                fan_power=v.get("fan_power"),
-                pump_power=v.get("pump_power"),
-                pcm_temp=v.get("pcm_temp"),
-            ).save()
+        def on_signal(signum, frame):
+            nonlocal stopping
+            stopping = True
+            client.disconnect()
 
         client.on_connect = on_connect
         client.on_message = on_message
+        signal.signal(signal.SIGTERM, on_signal)
+        signal.signal(signal.SIGINT, on_signal)
 
-        while True:
-            try:
-                client.connect(settings.MQTT_BROKER, settings.MQTT_PORT, keepalive=60)
-                client.loop_forever()
-            except Exception as e:
-                self.stderr.write(f"MQTT error: {e}. Reconnecting in 5s...")
-                time.sleep(5)
+        try:
+            while not stopping:
+                try:
+                    client.connect(settings.MQTT_BROKER, settings.MQTT_PORT, keepalive=60)
+                    client.loop_forever()
+                except Exception as e:
+                    if stopping:
+                        break
+                    self.stderr.write(f"{tag}MQTT error: {e}. Reconnecting in 5s...")
+                    time.sleep(5)
+        finally:
+            if workers:
+                workers.close()
+            log(f"Shutting down, flushing {writer.pending()} buffered samples...")
+            writer.close()
+            if replayer:
+                replayer.close()
+                spool.close()
+            st = writer.stats
+            log(self.style.SUCCESS(
+                f"Stored {st['written']} samples in {st['flushes']} flushes ({st['failed']} failed, "
+                f"{st['duplicates'] + st['cached_duplicates']} duplicates dropped, {st['spooled']} spooled, max flush {st['max_flush_ms']:.1f}ms)"
+            ))
+            if kpi is not None:
+                log(f"Emitted {kpi.stats['emitted']} segment KPIs ({kpi.stats['failed']} failed)")
@@ -0,0 +1,26 @@
+"""
+Prometheus metrics for the telemetry ingest pipeline.
+
+Shared by the REST ingest views (scraped through /metrics) and mqtt_consumer
+(its own exporter, --metrics-port). Process RSS/CPU come from prometheus_client's
+default process collector.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+_FAST = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01, 0.05)
+
+RECEIVED = Counter("telemetry_messages_received_total", "Telemetry messages received.", ["source"])
+REJECTED = Counter("telemetry_messages_rejected_total", "Telemetry messages dropped before storage.", ["source", "reason"])
+STORED = Counter("telemetry_samples_stored_total", "Telemetry samples written to Mongo.")
+DUPLICATES = Counter("telemetry_duplicates_total", "Duplicate samples dropped.", ["where"])
+SPOOLED = Counter("telemetry_samples_spooled_total", "Samples written to the on-disk spool.")
+STAGE_SECONDS = Histogram(
+    "telemetry_stage_seconds", "Time per message (decode, validate) or per batch (write).", ["stage"],
+    buckets=_FAST + (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+STORE_LAG = Histogram(
+    "telemetry_store_lag_seconds", "Device timestamp to stored in Mongo.",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0),
+)
+BUFFER_DEPTH = Gauge("telemetry_buffer_depth", "Samples waiting in consumer buffers.", ["buffer"])
+SPOOL_BYTES = Gauge("telemetry_spool_bytes", "Bytes in the on-disk spool.")
@@ -0,0 +1,292 @@
+"""
+Continuous telemetry rollups.
+
+Every run looks at the raw samples inserted since the watermark, an _id (ObjectIds
+grow with insertion time), so late data is picked up however old its ts is: REST
+backfills, spool replays, broker redeliveries. The (series, minute) buckets those
+samples fall in are recomputed from every raw sample of that minute, the 15m
+buckets they fall in from the 1m tier and the 1h buckets from the 15m tier, and
+written with $set. A rerun after a crash, or of an overlapping window, therefore
+rewrites the same values. Runs hold the job's Redis lock (sharding.run_locked).
+Each tier has its own TTL retention. In the time-series layout _id is not indexed,
+so finding the new samples scans the collection's bucket bounds.
+
+A rollup document:
+    {scope, city_id, segment_id, asset_id, bucket, n, last_ts,
+     stats: {flow: {min, max, sum, count, last}, ..., temps: {surface: {...}, ...}}}
+"""
+from datetime import datetime, timezone, timedelta
+from bson import ObjectId
+from django.conf import settings
+from mongoengine.connection import get_db
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import OperationFailure
+from . import storage
+from .documents import RETENTION_SECONDS, PAYLOAD_FIELDS
+
+TIERS = [("1m", 60), ("15m", 15 * 60), ("1h", 60 * 60)]
+TIER_SECONDS = dict(TIERS)
+STATE_COLLECTION = "telemetry_rollup_state"
+STATS = ("min", "max", "avg", "last")
+# slack when moving a ts watermark (before rollups followed _id) over to an _id one
+LEGACY_WATERMARK_SLACK = timedelta(hours=1)
+
+_ready = set()
+
+def tier_collection(tier):
+    coll = get_db()[f"telemetry_rollup_{tier}"]
+    if tier not in _ready:
+        coll.create_index(
+            [("scope", ASCENDING), ("segment_id", ASCENDING), ("asset_id", ASCENDING), ("bucket", ASCENDING)],
+            unique=True,
+        )
+        coll.create_index([("city_id", ASCENDING), ("bucket", ASCENDING)])
+        expire = settings.TELEMETRY_ROLLUP_RETENTION_DAYS[tier] * 86400
+        try:
+            coll.create_index("bucket", name="bucket_ttl", expireAfterSeconds=expire)
+        except OperationFailure:
+            # retention changed since the index was built
+            coll.database.command("collMod", coll.name, index={"name": "bucket_ttl", "expireAfterSeconds": expire})
+        _ready.add(tier)
+    return coll
+
+def floor_ts(ts, seconds):
+    epoch = int(ts.replace(tzinfo=timezone.utc).timestamp())
+    return datetime.fromtimestamp(epoch - epoch % seconds, tz=timezone.utc)
+
+def _series_match(keys, field=lambda name: name):
+    # every document of the series among keys
+    segs = sorted({k[1] for k in keys if k[1]})
+    assets = sorted({k[2] for k in keys if k[2]})
+    clauses = []
+    if segs:
+        clauses.append({field("segment_id"): {"$in": segs}})
+    if assets:
+        clauses.append({field("asset_id"): {"$in": assets}})
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+def _touched_minutes(after_id, upto_id):
+    # (scope, segment_id, asset_id, minute) of every sample inserted in [after_id, upto_id)
+    f = storage.field
+    pipeline = [
+        {"$match": {"_id": {"$gte": after_id, "$lt": upto_id}}},
+        {"$group": {"_id": {
+            "scope": f"${f('scope')}",
+            "segment_id": f"${f('segment_id')}",
+            "asset_id": f"${f('asset_id')}",
+            "bucket": {"$dateTrunc": {"date": "$ts", "unit": "minute"}},
+        }}},
+    ]
+    return {_series(r["_id"]) for r in storage.collection().aggregate(pipeline, allowDiskUse=True)}
+
+def _minute_stats(ts_from, ts_to, keys):
+    # complete stats of every minute in [ts_from, ts_to) of the series among keys:
+    # one $group per minute and series for payload fields, one for the temps map
+    coll = storage.collection()
+    f = storage.field
+    key = {
+        "scope": f"${f('scope')}",
+        "segment_id": f"${f('segment_id')}",
+        "asset_id": f"${f('asset_id')}",
+        "bucket": {"$dateTrunc": {"date": "$ts", "unit": "minute"}},
+    }
+    match = {"$match": {"ts": {"$gte": ts_from, "$lt": ts_to}, **_series_match(keys, f)}}
+
+    group = {"_id": key, "city_id": {"$last": f"${f('city_id')}"}, "n": {"$sum": 1}, "last_ts": {"$max": "$ts"}}
+    for k in PAYLOAD_FIELDS:
+        group[f"{k}__min"] = {"$min": f"${k}"}
+        group[f"{k}__max"] = {"$max": f"${k}"}
+        group[f"{k}__sum"] = {"$sum": f"${k}"}
+        group[f"{k}__count"] = {"$sum": {"$cond": [{"$isNumber": f"${k}"}, 1, 0]}}
+        group[f"{k}__last"] = {"$last": f"${k}"}
+    rows = {}
+    for r in coll.aggregate([match, {"$sort": {"ts": 1}}, {"$group": group}], allowDiskUse=True):
+        stats = {}
+        for k in PAYLOAD_FIELDS:
+            if r[f"{k}__count"]:
+                stats[k] = {s: r[f"{k}__{s}"] for s in ("min", "max", "sum", "count", "last")}
+        rows[_series(r["_id"])] = {"city_id": r["city_id"], "n": r["n"], "last_ts": r["last_ts"], "stats": stats}
+
+    temps = [
+        match,
+        {"$sort": {"ts": 1}},
+        {"$project": {**key, "t": {"$objectToArray": {"$ifNull": ["$temps", {}]}}}},
+        {"$unwind": "$t"},
+        {"$match": {"t.v": {"$type": "number"}}},
+        {"$group": {
+            "_id": {"scope": "$scope", "segment_id": "$segment_id", "asset_id": "$asset_id", "bucket": "$bucket", "k": "$t.k"},
+            "min": {"$min": "$t.v"}, "max": {"$max": "$t.v"}, "sum": {"$sum": "$t.v"},
+            "count": {"$sum": 1}, "last": {"$last": "$t.v"},
+        }},
+    ]
+    for r in coll.aggregate(temps, allowDiskUse=True):
+        row = rows.get(_series(r["_id"]))
+        if row is not None:
+            row["stats"].setdefault("temps", {})[r["_id"]["k"]] = {s: r[s] for s in ("min", "max", "sum", "count", "last")}
+    return rows
+
+def _tier_rows(tier, ts_from, ts_to, keys):
+    # stored buckets of a tier in [ts_from, ts_to) for the series among keys, shaped like _minute_stats rows
+    q = {"bucket": {"$gte": ts_from, "$lt": ts_to}, **_series_match(keys)}
+    return {
+        _series(d): {"city_id": d.get("city_id"), "n": d.get("n", 0), "last_ts": d["last_ts"], "stats": d.get("stats") or {}}
+        for d in tier_collection(tier).find(q, {"_id": 0})
+    }
+
+def _series(k):
+    return (k.get("scope"), k.get("segment_id"), k.get("asset_id"), k["bucket"])
+
+def _merge_stats(into, s):
+    if not into:
+        into.update(s)
+        return
+    into["min"] = min(into["min"], s["min"])
+    into["max"] = max(into["max"], s["max"])
+    into["sum"] += s["sum"]
+    into["count"] += s["count"]
+    into["last"] = s["last"]
+
+def _fold(rows, seconds):
+    # finer buckets -> buckets of a coarser tier; merged in time order so `last` stays right
+    out = {}
+    for (scope, seg, asset, bucket), d in sorted(rows.items(), key=lambda x: x[0][3]):
+        key = (scope, seg, asset, floor_ts(bucket, seconds))
+        acc = out.setdefault(key, {"city_id": d["city_id"], "n": 0, "last_ts": d["last_ts"], "stats": {}})
+        acc["n"] += d["n"]
+        acc["last_ts"] = max(acc["last_ts"], d["last_ts"])
+        for field, s in d["stats"].items():
+            if field == "temps":
+                for k, ts in s.items():
+                    _merge_stats(acc["stats"].setdefault("temps", {}).setdefault(k, {}), dict(ts))
+            else:
+                _merge_stats(acc["stats"].setdefault(field, {}), dict(s))
+    return out
+
+def _spans(keys, seconds, max_span):
+    # keys grouped into runs of buckets at most max_span long: (start, end, keys)
+    span = []
+    for k in sorted(keys, key=lambda k: k[3]):
+        if span and k[3] - span[0][3] >= max_span:
+            yield span[0][3], span[-1][3] + timedelta(seconds=seconds), span
+            span = []
+        span.append(k)
+    if span:
+        yield span[0][3], span[-1][3] + timedelta(seconds=seconds), span
+
+def _set(key, d):
+    scope, seg, asset, bucket = key
+    stats = dict(d["stats"])
+    if "temps" in stats:
+        stats["temps"] = {k: s for k, s in stats["temps"].items() if "." not in k and not k.startswith("$")}
+    doc = {"city_id": d["city_id"], "n": d["n"], "last_ts": d["last_ts"], "stats": stats}
+    return UpdateOne({"scope": scope, "segment_id": seg, "asset_id": asset, "bucket": bucket}, {"$set": doc}, upsert=True)
+
+def rollup_window(after_id, upto_id, max_span=timedelta(hours=1)):
+    """Recompute every bucket of every tier touched by samples inserted in [after_id, upto_id); returns buckets written."""
+    touched = _touched_minutes(after_id, upto_id)
+    written = 0
+    prev_tier = None
+    for tier, seconds in TIERS:
+        if seconds == 60:
+            keys = touched
+        else:
+            keys = {(scope, seg, asset, floor_ts(minute, seconds)) for scope, seg, asset, minute in touched}
+        rows = {}
+        for ts_from, ts_to, span in _spans(keys, seconds, max(max_span, timedelta(seconds=seconds))):
+            if prev_tier is None:
+                found = _minute_stats(ts_from, ts_to, span)
+            else:
+                found = _fold(_tier_rows(prev_tier, ts_from, ts_to, span), seconds)
+            wanted = set(span)
+            rows.update((k, d) for k, d in found.items() if k in wanted)
+        if rows:
+            tier_collection(tier).bulk_write([_set(k, d) for k, d in rows.items()], ordered=False)
+            written += len(rows)
+        prev_tier = tier
+    return written
+
+def update_rollups(max_window=timedelta(hours=1)):
+    """Roll up samples inserted up to now - TELEMETRY_ROLLUP_LAG_SECONDS into every tier, advancing the watermark."""
+    state = get_db()[STATE_COLLECTION]
+    doc = state.find_one({"_id": "telemetry"})
+    # whole seconds, as ObjectId.from_datetime keeps them
+    upto = (datetime.now(timezone.utc) - timedelta(seconds=settings.TELEMETRY_ROLLUP_LAG_SECONDS)).replace(microsecond=0)
+    if doc and doc.get("after_id"):
+        after = doc["after_id"]
+    elif doc:
+        after = ObjectId.from_datetime(doc["watermark"].replace(tzinfo=timezone.utc) - LEGACY_WATERMARK_SLACK)
+    else:
+        first = storage.collection().find_one({}, {"_id": 1}, sort=[("_id", 1)])
+        if not first:
+            return {"windows": 0, "buckets": 0}
+        after = first["_id"]
+
+    windows = buckets = 0
+    while after.generation_time < upto:
+        end = min(upto, after.generation_time + max_window)
+        end_id = ObjectId.from_datetime(end)
+        buckets += rollup_window(after, end_id)
+        state.update_one({"_id": "telemetry"}, {"$set": {"after_id": end_id, "watermark": end}}, upsert=True)
+        after = end_id
+        windows += 1
+    return {"windows": windows, "buckets": buckets, "watermark": after.generation_time.isoformat()}
+
+def pick_tier(ts_from, ts_to=None, max_points=2000, now=None):
+    """
+    "raw" when the window is recent and short enough to serve from raw samples,
+    otherwise the finest rollup tier that covers ts_from and stays within max_points
+    buckets per series, falling back to the coarsest tier.
+    """
+    if ts_from is None:
+        return "raw"
+    now = now or datetime.now(timezone.utc)
+    ts_to = min(ts_to or now, now)
+    span = (ts_to - ts_from).total_seconds()
+    raw_covers = ts_from >= now - timedelta(seconds=RETENTION_SECONDS)
+    if raw_covers and span <= settings.TELEMETRY_RAW_MAX_SPAN_SECONDS:
+        return "raw"
+    for tier, seconds in TIERS:
+        covers = ts_from >= now - timedelta(days=settings.TELEMETRY_ROLLUP_RETENTION_DAYS[tier])
+        if covers and span / seconds <= max_points:
+            return tier
+    return TIERS[-1][0]
+
+def _flatten(doc, agg):
+    out = {
+        "scope": doc.get("scope"),
+        "city_id": doc.get("city_id"),
+        "ts": doc["bucket"],
+        "n": doc.get("n", 0),
+    }
+    if doc.get("segment_id"):
+        out["segment_id"] = doc["segment_id"]
+    if doc.get("asset_id"):
+        out["asset_id"] = doc["asset_id"]
+
+    def value(s):
+        if agg == "avg":
+            return s["sum"] / s["count"] if s.get("count") else None
+        return s.get(agg)
+
+    stats = doc.get("stats") or {}
+    out["temps"] = {k: value(s) for k, s in (stats.get("temps") or {}).items()}
+    for k in PAYLOAD_FIELDS:
+        if k in stats:
+            out[k] = value(stats[k])
+    return out
+
+def query_rollups(tier, scope=None, city_id=None, segment_id=None, asset_id=None, ts_from=None, ts_to=None,
+                  agg="avg", limit=2000):
+    """Rollup buckets as telemetry-shaped rows (ascending by bucket), each field set to the chosen statistic."""
+    q = {}
+    for k, v in (("scope", scope), ("city_id", city_id), ("segment_id", segment_id), ("asset_id", asset_id)):
+        if v:
+            q[k] = v
+    if ts_from or ts_to:
+        q["bucket"] = {}
+        if ts_from:
+            q["bucket"]["$gte"] = floor_ts(ts_from, TIER_SECONDS[tier])
+        if ts_to:
+            q["bucket"]["$lte"] = ts_to
+    cur = tier_collection(tier).find(q).sort("bucket", -1).limit(limit)
+    return [_flatten(d, agg) for d in reversed(list(cur))]
@@ -0,0 +1,152 @@
+"""
+Append-only on-disk spool for telemetry the database cannot take right now.
+
+The consumer's writer appends a batch here when an insert fails or when its
+in-memory buffer is full because Mongo is slow; a SpoolReplayer (ingest.py)
+drains it back in bulk once the database answers again. Records are
+length-prefixed msgpack batches in numbered segment files (spool-000000000001.log,
+...); a segment is deleted once it has been replayed. Total size is capped at
+max_bytes: append() raises SpoolFull and the writer goes back to blocking, so
+nothing is dropped.
+
+fsync policy: "always" syncs every append, "interval" leaves it to sync() calls
+(the writer makes them every fsync_interval seconds), "never" leaves it to the OS.
+The replay position is kept in memory only, so after a crash the oldest segment is
+replayed from its start; the unique telemetry index turns the repeats into
+counted duplicates.
+"""
+import os
+import struct
+import threading
+import time
+import msgpack
+
+FSYNC_POLICIES = ("always", "interval", "never")
+_LEN = struct.Struct(">I")
+
+class SpoolFull(Exception):
+    pass
+
+class Spool:
+
+    def __init__(self, directory, segment_bytes=64 << 20, max_bytes=1 << 30, fsync="always", fsync_interval=1.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {', '.join(FSYNC_POLICIES)}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+
+        self._lock = threading.Lock()
+        self._segments = sorted(
+            int(name[len("spool-"):-len(".log")]) for name in os.listdir(directory)
+            if name.startswith("spool-") and name.endswith(".log")
+        )
+        self._bytes = sum(os.path.getsize(self._path(s)) for s in self._segments)
+        self._active = None
+        self._active_seq = None
+        self._read = (self._segments[0], 0) if self._segments else None
+        self._dirty = False
+        self._last_sync = time.monotonic()
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f"spool-{seq:012d}.log")
+
+    def size(self):
+        with self._lock:
+            return self._bytes
+
+    def __bool__(self):
+        with self._lock:
+            return bool(self._segments)
+
+    def append(self, docs):
+        """Spool a batch of raw telemetry documents (tz-aware ts); durable per the fsync policy on return."""
+        data = msgpack.packb(docs, datetime=True)
+        rec = _LEN.pack(len(data)) + data
+        with self._lock:
+            if self._bytes + len(rec) > self.max_bytes:
+                raise SpoolFull(f"spool at {self._bytes} of {self.max_bytes} bytes")
+            if self._active is None or self._active.tell() + len(rec) > self.segment_bytes:
+                self._rotate()
+            self._active.write(rec)
+            self._active.flush()
+            self._bytes += len(rec)
+            if self.fsync == "always":
+                os.fsync(self._active.fileno())
+            else:
+                self._dirty = True
+
+    def _rotate(self):
+        if self._active is not None:
+            if self._dirty and self.fsync != "never":
+                os.fsync(self._active.fileno())
+            self._dirty = False
+            self._active.close()
+        seq = self._segments[-1] + 1 if self._segments else 1
+        self._active = open(self._path(seq), "ab")
+        self._active_seq = seq
+        self._segments.append(seq)
+        if self._read is None:
+            self._read = (seq, 0)
+
+    def sync_in(self):
+        """Seconds until sync() fsyncs pending appends, None with nothing to sync; read without the lock, a hint only."""
+        if not self._dirty or self._active is None:
+            return None
+        return max(self.fsync_interval - (time.monotonic() - self._last_sync), 0.0)
+
+    def sync(self, force=False):
+        """fsync pending appends once the interval elapsed; True when everything appended so far is on disk."""
+        with self._lock:
+            if not self._dirty or self._active is None:
+                return True
+            if not force and time.monotonic() - self._last_sync < self.fsync_interval:
+                return False
+            os.fsync(self._active.fileno())
+            self._dirty = False
+            self._last_sync = time.monotonic()
+            return True
+
+    def next_batch(self):
+        """(position, docs) for the oldest unreplayed batch, or None if there is none. Pass position to commit()."""
+        with self._lock:
+            while self._segments:
+                seq, offset = self._read
+                with open(self._path(seq), "rb") as f:
+                    f.seek(offset)
+                    head = f.read(_LEN.size)
+                    data = f.read(_LEN.unpack(head)[0]) if len(head) == _LEN.size else b""
+                if data and len(data) == _LEN.unpack(head)[0]:
+                    break
+                # end of the segment, or a record torn by a crash
+                self._drop(seq)
+            else:
+                return None
+        return (seq, offset + _LEN.size + len(data)), msgpack.unpackb(data, timestamp=3)
+
+    def commit(self, position):
+        with self._lock:
+            if self._read and self._read[0] == position[0]:
+                self._read = position
+
+    def _drop(self, seq):
+        if seq == self._active_seq:
+            self._active.close()
+            self._active = self._active_seq = None
+            self._dirty = False
+        path = self._path(seq)
+        self._bytes -= os.path.getsize(path)
+        os.remove(path)
+        self._segments.remove(seq)
+        self._read = (self._segments[0], 0) if self._segments else None
+
+    def close(self):
+        with self._lock:
+            if self._active is not None:
+                if self._dirty and self.fsync != "never":
+                    os.fsync(self._active.fileno())
+                self._active.close()
+                self._active = self._active_seq = None
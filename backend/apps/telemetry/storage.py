@@ -0,0 +1,94 @@
+"""
+Raw pymongo access to telemetry storage.
+
+Two layouts are supported:
+  - plain (default): the `telemetry` collection backing the Telemetry document,
+    one flat document per sample;
+  - time-series (TELEMETRY_TIMESERIES=1): a native MongoDB time-series collection
+    `telemetry_ts` with ts as timeField and {scope, city_id, segment_id, asset_id}
+    nested under the `meta` metaField.
+
+Ingest and query code works with flat documents and goes through to_storage /
+from_storage / query so it does not care which layout is active.
+"""
+import logging
+from django.conf import settings
+from mongoengine.connection import get_db
+from pymongo.errors import OperationFailure
+from .dedup import INDEX_KEYS, INDEX_NAME
+from .documents import Telemetry, RETENTION_SECONDS, PAYLOAD_FIELDS
+
+log = logging.getLogger(__name__)
+
+TS_COLLECTION = "telemetry_ts"
+META_FIELDS = ("scope", "city_id", "segment_id", "asset_id")
+FIELDS = (*META_FIELDS, "ts", "temps", *PAYLOAD_FIELDS)
+TIMESERIES = settings.TELEMETRY_TIMESERIES
+
+_collection = None
+
+def ensure_timeseries_collection(db=None, name=TS_COLLECTION, expire_after=RETENTION_SECONDS):
+    db = db if db is not None else get_db()
+    if not db.list_collection_names(filter={"name": name}):
+        db.create_collection(
+            name,
+            timeseries={"timeField": "ts", "metaField": "meta", "granularity": "seconds"},
+            expireAfterSeconds=expire_after,
+        )
+    coll = db[name]
+    coll.create_index([("meta.segment_id", 1), ("ts", 1)])
+    coll.create_index([("meta.asset_id", 1), ("ts", 1)])
+    coll.create_index([("meta.city_id", 1), ("ts", 1)])
+    return coll
+
+def ensure_unique_index(coll):
+    # one sample per series and timestamp; fails while older duplicates are still stored
+    try:
+        coll.create_index(INDEX_KEYS, name=INDEX_NAME, unique=True)
+    except OperationFailure as e:
+        log.warning("telemetry unique index not built (%s); run `manage.py dedupe_telemetry`", e)
+    return coll
+
+def collection():
+    global _collection
+    if _collection is None:
+        _collection = ensure_timeseries_collection() if TIMESERIES else ensure_unique_index(Telemetry._get_collection())
+    return _collection
+
+def reset():
+    # after a fork: the cached collection belongs to the parent's client
+    global _collection
+    _collection = None
+
+def field(name):
+    return f"meta.{name}" if TIMESERIES and name in META_FIELDS else name
+
+def projection(fields=FIELDS):
+    # temps and temps.<key> together is a path collision in Mongo; the parent wins
+    return {field(f): 1 for f in fields if f.split(".")[0] == f or f.split(".")[0] not in fields}
+
+def to_storage(doc):
+    if not TIMESERIES:
+        return doc
+    out = {k: v for k, v in doc.items() if k not in META_FIELDS}
+    out["meta"] = {k: doc[k] for k in META_FIELDS if k in doc}
+    return out
+
+def from_storage(doc):
+    meta = doc.pop("meta", None)
+    if meta:
+        doc.update(meta)
+    return doc
+
+def query(scope=None, city_id=None, segment_id=None, asset_id=None, ts_from=None, ts_to=None):
+    q = {}
+    for k, v in (("scope", scope), ("city_id", city_id), ("segment_id", segment_id), ("asset_id", asset_id)):
+        if v:
+            q[field(k)] = v
+    if ts_from or ts_to:
+        q["ts"] = {}
+        if ts_from:
+            q["ts"]["$gte"] = ts_from
+        if ts_to:
+            q["ts"]["$lte"] = ts_to
+    return q
@@ -0,0 +1,7 @@
+from celery import shared_task
+from apps.common.sharding import run_locked
+from .rollups import update_rollups
+
+@shared_task
+def update_telemetry_rollups():
+    return run_locked("update_telemetry_rollups", update_rollups)
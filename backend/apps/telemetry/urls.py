@@ -1,7 +1,10 @@
 from django.urls import path
-from .views import TelemetryIngestView, TelemetryQueryView
+from .views import TelemetryIngestView, TelemetryBulkIngestView, TelemetryQueryView, TelemetryLatestView, TelemetrySnapshotView
 
 urlpatterns = [
     path("ingest", TelemetryIngestView.as_view()),
+    path("ingest/bulk", TelemetryBulkIngestView.as_view()),
     path("query", TelemetryQueryView.as_view()),
+    path("latest", TelemetryLatestView.as_view()),
+    path("latest/snapshot", TelemetrySnapshotView.as_view()),
 ]
@@ -0,0 +1,129 @@
+"""
+Fast-path validator for telemetry ingest payloads.
+
+Accepts and rejects exactly what TelemetryIngestSerializer (plus parse_ts) does,
+with the same error messages, but without DRF field machinery, and returns the
+raw document ready for insert_many instead of validated_data.
+"""
+import re
+from datetime import datetime, timezone
+from .documents import PAYLOAD_FIELDS
+
+_BAD_CHARS = re.compile("[\x00\ud800-\udfff]")
+_MAX_FLOAT_STRING = 1000
+
+REQUIRED = "This field is required."
+NULL = "This field may not be null."
+BLANK = "This field may not be blank."
+NOT_A_STRING = "Not a valid string."
+NOT_A_NUMBER = "A valid number is required."
+NUMBER_TOO_LONG = "String value too large."
+NUMBER_OVERFLOW = "Integer value too large to convert to float"
+BAD_TIMESTAMP = "Invalid timestamp"
+NO_SCOPE = "Either segment_id or asset_id required"
+
+_UTC = timezone.utc
+
+def _char(data, key, errors, required, allow_blank):
+    # mirrors serializers.CharField(trim_whitespace=True)
+    v = data.get(key)
+    if v is None:
+        if key not in data:
+            if required:
+                errors[key] = [REQUIRED]
+        else:
+            errors[key] = [NULL]
+        return None
+    if v.__class__ is not str:
+        if isinstance(v, bool) or not isinstance(v, (str, int, float)):
+            errors[key] = [NOT_A_STRING]
+            return None
+        v = str(v)
+    v = v.strip()
+    if not v:
+        if not allow_blank:
+            errors[key] = [BLANK]
+        return ""
+    m = _BAD_CHARS.search(v)
+    if m:
+        ch = m.group()
+        errors[key] = ["Null characters are not allowed." if ch == "\x00"
+                       else f"Surrogate characters are not allowed: U+{ord(ch):X}."]
+        return None
+    return v
+
+def _float(v):
+    # mirrors serializers.FloatField; returns (value, error)
+    if v.__class__ is float:
+        return v, None
+    if isinstance(v, str) and len(v) > _MAX_FLOAT_STRING:
+        return None, NUMBER_TOO_LONG
+    try:
+        return float(v), None
+    except (TypeError, ValueError):
+        return None, NOT_A_NUMBER
+    except OverflowError:
+        return None, NUMBER_OVERFLOW
+
+def parse_timestamp(v):
+    # parse_ts for the string timestamps the serializer lets through; None if invalid
+    if v.__class__ is datetime:
+        dt = v
+    else:
+        try:
+            dt = datetime.fromisoformat(v.replace("Z", "+00:00") if "Z" in v else v)
+        except ValueError:
+            return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=_UTC)
+    if dt.tzinfo is not _UTC:
+        return dt.astimezone(_UTC)
+    return dt
+
+def validate_telemetry(data):
+    """Return (raw_doc, None) for a valid payload, or (None, errors) in DRF error format."""
+    if not isinstance(data, dict):
+        return None, {"non_field_errors": [f"Invalid data. Expected a dictionary, but got {type(data).__name__}."]}
+
+    errors = {}
+    city_id = _char(data, "city_id", errors, True, False)
+    segment_id = _char(data, "segment_id", errors, False, True)
+    asset_id = _char(data, "asset_id", errors, False, True)
+    timestamp = data.get("timestamp")
+    if timestamp.__class__ is not datetime:
+        # binary MQTT payloads (codec.py) arrive with the timestamp already decoded
+        timestamp = _char(data, "timestamp", errors, True, False)
+
+    temps = data.get("temps")
+    if temps is None:
+        errors["temps"] = [REQUIRED if "temps" not in data else NULL]
+    elif not isinstance(temps, dict):
+        errors["temps"] = [f'Expected a dictionary of items but got type "{type(temps).__name__}".']
+
+    doc = {"scope": "segment" if segment_id else "asset", "city_id": city_id, "ts": None, "temps": temps}
+    if segment_id:
+        doc["segment_id"] = segment_id
+    if asset_id:
+        doc["asset_id"] = asset_id
+    for k in PAYLOAD_FIELDS:
+        v = data.get(k)
+        if v is None:
+            continue
+        v, err = _float(v)
+        if err:
+            errors[k] = [err]
+        else:
+            doc[k] = v
+
+    if errors:
+        return None, errors
+    if not segment_id and not asset_id:
+        return None, {"non_field_errors": [NO_SCOPE]}
+    if temps.__class__ is not dict or any(k.__class__ is not str for k in temps):
+        doc["temps"] = {str(k): v for k, v in temps.items()}
+
+    ts = parse_timestamp(timestamp)
+    if ts is None:
+        return None, {"timestamp": [BAD_TIMESTAMP]}
+    doc["ts"] = ts
+    return doc, None
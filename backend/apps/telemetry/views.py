@@ -1,42 +1,171 @@
+import gzip
+import json
+import zlib
+from django.conf import settings
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.settings import api_settings
 from datetime import datetime, timezone
-from .documents import Telemetry, parse_ts
-from .serializers import TelemetryIngestSerializer
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from redis import RedisError
+from .documents import parse_ts, PAYLOAD_FIELDS
+from . import latest, metrics, storage
+from .rollups import STATS, TIER_SECONDS, pick_tier, query_rollups
+from .downsample import ALGORITHMS, y_getter
+from .ingest import bulk_insert, observe_stored
+from .validation import validate_telemetry
 from apps.authx.permissions import IsOpsOrAbove
+from apps.common.pagination import page_params, pymongo_page
+from apps.common.streaming import (
+    ColumnarJSONRenderer, columns, json_stream_response, newest_ascending, requested_fields, requested_format,
+)
+
+MAX_REPORTED_ERRORS = 100
+MAX_POINTS = 10000
 
 class TelemetryIngestView(APIView):
     permission_classes = [IsOpsOrAbove]
 
     def post(self, request):
-        ser = TelemetryIngestSerializer(data=request.data)
-        ser.is_valid(raise_exception=True)
-        data = ser.validated_data
-        ts = parse_ts(data["timestamp"])
-
-        scope = "segment" if data.get("segment_id") else "asset"
-        doc = Telemetry(
-            scope=scope,
-            city_id=data["city_id"],
-            segment_id=data.get("segment_id") or None,
-            asset_id=data.get("asset_id") or None,
-            ts=ts,
-            temps=data.get("temps", {}),
-            flow=data.get("flow"),
-            pressure=data.get("pressure"),
-            kw_gross=data.get("kw_gross"),
-            kwh_total=data.get("kwh_total"),
-            fan_power=data.get("fan_power"),
-            pump_power=data.get("pump_power"),
-            pcm_temp=data.get("pcm_temp"),
-        ).save()
-
-        out = doc.to_mongo().to_dict()
-        out["id"] = str(out.pop("_id"))
-        return Response(out, status=201)
+        metrics.RECEIVED.labels("rest").inc()
+        doc, errors = validate_telemetry(request.data)
+        if errors:
+            metrics.REJECTED.labels("rest", "invalid").inc()
+            return Response(errors, status=400)
+        stored = storage.to_storage(doc)
+        try:
+            with metrics.STAGE_SECONDS.labels("write").time():
+                storage.collection().insert_one(stored)
+        except DuplicateKeyError:
+            # retried sample: already stored, answer with the original
+            q = storage.query(scope=doc["scope"], segment_id=doc.get("segment_id"), asset_id=doc.get("asset_id"))
+            existing = storage.collection().find_one({**q, "ts": doc["ts"]}, {"_id": 1})
+            doc.pop("_id", None)
+            doc["id"] = str(existing["_id"]) if existing else None
+            doc["duplicate"] = True
+            metrics.DUPLICATES.labels("db").inc()
+            return Response(doc, status=200)
+        observe_stored([doc])
+        latest.update([doc])
+        doc["id"] = str(stored["_id"])
+        doc.pop("_id", None)
+        return Response(doc, status=201)
+
+def _iter_bulk_rows(request):
+    # yields (row_number, row) from a JSON array or NDJSON body, optionally gzip'd
+    stream = request.stream
+    if stream is None:
+        return
+    if request.headers.get("Content-Encoding", "").lower() == "gzip":
+        stream = gzip.GzipFile(fileobj=stream)
+    content_type = request.content_type.split(";")[0].strip().lower()
+    if content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        for i, line in enumerate(stream):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield i, json.loads(line)
+            except ValueError as e:
+                yield i, e
+    else:
+        rows = json.load(stream)
+        if not isinstance(rows, list):
+            raise ValueError("Expected a JSON array of telemetry rows")
+        yield from enumerate(rows)
+
+class TelemetryBulkIngestView(APIView):
+    """
+    Bulk ingest: JSON array (application/json) or NDJSON (application/x-ndjson),
+    optionally with Content-Encoding: gzip. Rows go through the fast-path validator and
+    are stored with one unordered insert per chunk; the response carries counts and
+    per-row errors. Rows whose (series, ts) is already stored count as duplicates,
+    not errors, so retried uploads are safe.
+    """
+    permission_classes = [IsOpsOrAbove]
+
+    def post(self, request):
+        chunk_size = settings.TELEMETRY_BULK_CHUNK
+        received = stored = duplicates = 0
+        errors = []
+
+        def reject(row, detail):
+            errors.append({"row": row, "errors": detail})
+
+        def flush(docs, rows):
+            nonlocal stored, duplicates
+            try:
+                rejected, dups = bulk_insert(docs)
+            except PyMongoError as e:
+                rejected, dups = {i: str(e) for i in range(len(docs))}, []
+            stored += len(docs) - len(rejected) - len(dups)
+            duplicates += len(dups)
+            metrics.REJECTED.labels("rest", "db").inc(len(rejected))
+            for i, reason in sorted(rejected.items()):
+                reject(rows[i], {"non_field_errors": [reason]})
+
+        docs, rows = [], []
+        try:
+            for row, data in _iter_bulk_rows(request):
+                received += 1
+                metrics.RECEIVED.labels("rest").inc()
+                if isinstance(data, ValueError):
+                    metrics.REJECTED.labels("rest", "decode").inc()
+                    reject(row, {"non_field_errors": [f"Invalid JSON: {data}"]})
+                    continue
+                doc, row_errors = validate_telemetry(data)
+                if row_errors:
+                    metrics.REJECTED.labels("rest", "invalid").inc()
+                    reject(row, row_errors)
+                    continue
+                docs.append(doc)
+                rows.append(row)
+                if len(docs) >= chunk_size:
+                    flush(docs, rows)
+                    docs, rows = [], []
+        except (ValueError, OSError, EOFError, zlib.error) as e:
+            # malformed JSON array or gzip stream; whatever was already flushed stays stored
+            if docs:
+                flush(docs, rows)
+            return Response({"detail": f"Unreadable body: {e}", "received": received, "stored": stored,
+                             "duplicates": duplicates}, status=400)
+        if docs:
+            flush(docs, rows)
+
+        return Response({
+            "received": received,
+            "stored": stored,
+            "duplicates": duplicates,
+            "rejected": len(errors),
+            "errors": sorted(errors, key=lambda x: x["row"])[:MAX_REPORTED_ERRORS],
+        })
+
+def _raw_row(m):
+    m = storage.from_storage(m)
+    m["id"] = str(m.pop("_id"))
+    return m
 
 class TelemetryQueryView(APIView):
+    """
+    Raw samples for short recent windows; for longer or older windows the coarsest
+    matching rollup tier (see rollups.pick_tier), or the one forced with tier=.
+    Rollup rows carry the agg= statistic (avg by default) per field and the sample count n.
+
+    points=N (or resolution=<seconds> with from/to) returns at most N rows for the whole
+    window, chosen with algo=lttb (default) or algo=minmax on the field= series
+    (kw_gross by default, temps.<key> for temperatures), in one streaming pass.
+
+    fields= limits the payload fields returned (scope/ids/ts are always included); raw
+    rows are read with a projection and streamed to the client as they come off the cursor.
+    format=columnar returns {"ts": [epoch ms...], "columns": {field: [...]}} instead of
+    rows, temps expanded to one temps.<key> column per sensor.
+
+    page_size= / cursor= switch to keyset pages of raw samples over (ts, _id), oldest first,
+    wrapped as {"results": ..., "next_cursor": ...}; without tier= any range is paged raw.
+    """
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, ColumnarJSONRenderer]
+
     def get(self, request):
         scope = request.query_params.get("scope", "segment")
         city_id = request.query_params.get("city_id")
@@ -44,25 +173,129 @@ class TelemetryQueryView(APIView):
         asset_id = request.query_params.get("asset_id")
         dt_from = request.query_params.get("from")
         dt_to = request.query_params.get("to")
+        tier = request.query_params.get("tier")
+        agg = request.query_params.get("agg", "avg")
 
-        qs = Telemetry.objects.filter(scope=scope)
-        if city_id:
-            qs = qs.filter(city_id=city_id)
-        if scope == "segment" and segment_id:
-            qs = qs.filter(segment_id=segment_id)
-        if scope == "asset" and asset_id:
-            qs = qs.filter(asset_id=asset_id)
-
-        if dt_from:
-            qs = qs.filter(ts__gte=parse_ts(dt_from))
-        if dt_to:
-            qs = qs.filter(ts__lte=parse_ts(dt_to))
-
-        qs = qs.order_by("-ts").limit(2000)
-        rows = []
-        for d in reversed(list(qs)):
-            m = d.to_mongo().to_dict()
-            m["id"] = str(m.pop("_id"))
-            m["ts"] = d.ts.isoformat()
-            rows.append(m)
-        return Response(rows)
+        ts_from = parse_ts(dt_from) if dt_from else None
+        ts_to = parse_ts(dt_to) if dt_to else None
+        if tier and tier != "raw" and tier not in TIER_SECONDS:
+            return Response({"detail": f"tier must be raw or one of {', '.join(TIER_SECONDS)}"}, status=400)
+        if agg not in STATS:
+            return Response({"detail": f"agg must be one of {', '.join(STATS)}"}, status=400)
+
+        points = None
+        try:
+            if request.query_params.get("points"):
+                points = int(request.query_params["points"])
+            elif request.query_params.get("resolution") and ts_from:
+                span = ((ts_to or datetime.now(timezone.utc)) - ts_from).total_seconds()
+                points = int(span // max(float(request.query_params["resolution"]), 1.0)) + 1
+        except ValueError:
+            return Response({"detail": "points and resolution must be numbers"}, status=400)
+        try:
+            fields = requested_fields(request, storage.FIELDS)
+            fmt = requested_format(request)
+            page = page_params(request)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+        # pages walk raw samples, however long the range
+        tier = tier or ("raw" if page else pick_tier(ts_from, ts_to))
+        if page and (points is not None or tier != "raw"):
+            return Response({"detail": "page_size/cursor only apply to raw, non-downsampled queries"}, status=400)
+        y_field = request.query_params.get("field", "kw_gross")
+        algo = request.query_params.get("algo", "lttb")
+        if algo not in ALGORITHMS:
+            return Response({"detail": f"algo must be one of {', '.join(ALGORITHMS)}"}, status=400)
+        if points is not None:
+            points = max(3, min(points, MAX_POINTS))
+            y = y_getter(y_field)
+            downsample = lambda rows, n: ALGORITHMS[algo](rows, n, points, y)
+
+        filters = {
+            "scope": scope,
+            "city_id": city_id,
+            "segment_id": segment_id if scope == "segment" else None,
+            "asset_id": asset_id if scope == "asset" else None,
+            "ts_from": ts_from,
+            "ts_to": ts_to,
+        }
+        if tier != "raw":
+            rows = query_rollups(tier, agg=agg, **filters)
+            if points is not None:
+                # buckets without the field would read as fake dips
+                rows = [m for m in rows if y(m) is not None]
+                rows = list(downsample(rows, len(rows)))
+            if fmt == "columnar":
+                return Response(columns(rows, fields or ("temps", *PAYLOAD_FIELDS)), headers={"X-Telemetry-Tier": tier})
+            if fields:
+                keep = {*storage.META_FIELDS, "ts", "n", *(f.split(".")[0] for f in fields)}
+                rows = [{k: v for k, v in m.items() if k in keep} for m in rows]
+            return json_stream_response(rows, headers={"X-Telemetry-Tier": tier})
+
+        coll = storage.collection()
+        q = storage.query(**filters)
+        if fmt == "columnar":
+            fields = fields or ["temps", *PAYLOAD_FIELDS]
+            proj = storage.projection(["ts", *fields])
+        else:
+            proj = storage.projection([*storage.META_FIELDS, "ts", *fields] if fields else storage.FIELDS)
+        if page:
+            rows = pymongo_page(coll, q, proj, page)
+            if fmt == "columnar":
+                data = columns(rows, fields)
+                data["next_cursor"] = rows.next_cursor
+                return Response(data, headers={"X-Telemetry-Tier": "raw"})
+            return json_stream_response((_raw_row(m) for m in rows), headers={"X-Telemetry-Tier": "raw"}, page=rows)
+        if points is not None:
+            if fields:
+                proj = storage.projection([*proj, y_field])
+            # whole window, oldest first, reduced while streaming from the cursor;
+            # samples without the field are left out rather than read as fake dips
+            q = {**q, storage.field(y_field): {"$type": "number"}}
+            n = coll.count_documents(q)
+            rows = downsample((_raw_row(m) for m in coll.find(q, proj).sort("ts", 1)), n)
+        else:
+            rows = (_raw_row(m) for m in newest_ascending(coll, q, proj, limit=2000))
+        if fmt == "columnar":
+            return Response(columns(rows, fields), headers={"X-Telemetry-Tier": "raw"})
+        return json_stream_response(rows, headers={"X-Telemetry-Tier": "raw"})
+
+class TelemetryLatestView(APIView):
+    """
+    Latest sample per series from the Redis latest-value store.
+    GET ?scope=segment&ids=a,b or POST {"scope", "ids": [...]} -> {id: sample}.
+    """
+    permission_classes = [IsOpsOrAbove]
+
+    def get(self, request):
+        ids = [i for i in request.query_params.get("ids", "").split(",") if i]
+        return self._read(request.query_params.get("scope", "segment"), ids)
+
+    def post(self, request):
+        ids = request.data.get("ids") or []
+        if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+            return Response({"detail": "ids must be a list of strings"}, status=400)
+        return self._read(request.data.get("scope", "segment"), ids)
+
+    def _read(self, scope, ids):
+        if scope not in latest.SCOPES:
+            return Response({"detail": f"scope must be one of {', '.join(latest.SCOPES)}"}, status=400)
+        if not ids:
+            return Response({"detail": "ids required"}, status=400)
+        try:
+            return Response(latest.get_many(scope, ids))
+        except RedisError:
+            return Response({"detail": "Latest-value store unavailable"}, status=503)
+
+class TelemetrySnapshotView(APIView):
+    """Every series' latest sample for a scope (?scope=segment|asset, optional city_id) from Redis."""
+    permission_classes = [IsOpsOrAbove]
+
+    def get(self, request):
+        scope = request.query_params.get("scope", "segment")
+        if scope not in latest.SCOPES:
+            return Response({"detail": f"scope must be one of {', '.join(latest.SCOPES)}"}, status=400)
+        try:
+            return Response(latest.snapshot(scope, request.query_params.get("city_id")))
+        except RedisError:
+            return Response({"detail": "Latest-value store unavailable"}, status=503)
@@ -1,6 +1,7 @@
 import os
 from celery import Celery
 from celery.schedules import crontab
+from django.conf import settings
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
@@ -9,12 +10,24 @@ celery_app.config_from_object("django.conf:settings", namespace="CELERY")
 celery_app.autodiscover_tasks()
 
 celery_app.conf.beat_schedule = {
-    "compute_kpis_every_minute": {
+    "compute_kpis": {
         "task": "apps.kpi.tasks.compute_kpis",
-        "schedule": crontab(minute="*"),
+        "schedule": crontab(minute=f"*/{settings.KPI_RECONCILE_MINUTES}"),
     },
     "evaluate_alerts_every_minute": {
         "task": "apps.alerts.tasks.evaluate_alerts",
         "schedule": crontab(minute="*"),
     },
+    "aggregate_zone_city_kpis_every_minute": {
+        "task": "apps.kpi.tasks.aggregate_zone_city_kpis",
+        "schedule": crontab(minute="*"),
+    },
+    "update_energy_ledger_every_minute": {
+        "task": "apps.kpi.tasks.update_energy_ledger",
+        "schedule": crontab(minute="*"),
+    },
+    "update_telemetry_rollups_every_minute": {
+        "task": "apps.telemetry.tasks.update_telemetry_rollups",
+        "schedule": crontab(minute="*"),
+    },
 }
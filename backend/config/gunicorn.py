@@ -0,0 +1,8 @@
+# gunicorn -c config/gunicorn.py config.wsgi:application
+
+def child_exit(server, worker):
+    # drop the exited worker's live gauges from the shared prometheus directory
+    import os
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -38,6 +38,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "apps.common.metrics.MetricsMiddleware",
 ]
 
 ROOT_URLCONF = "config.urls"
@@ -118,15 +119,74 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = TIME_ZONE
+# compute_kpis / evaluate_alerts run one shard task per city and part (apps.common.sharding);
+# a run holds a Redis lock for at most TASK_RUN_LOCK_SECONDS
+TASK_SHARDS_PER_CITY = int(os.getenv("TASK_SHARDS_PER_CITY", "1"))
+TASK_RUN_LOCK_SECONDS = int(os.getenv("TASK_RUN_LOCK_SECONDS", "300"))
+# Process-local asset metadata cache (apps.assets.cache): Redis version check interval,
+# and how long a snapshot is trusted while Redis is unreachable
+ASSET_CACHE_CHECK_SECONDS = float(os.getenv("ASSET_CACHE_CHECK_SECONDS", "5"))
+ASSET_CACHE_MAX_AGE = float(os.getenv("ASSET_CACHE_MAX_AGE", "300"))
 
 # Business factors
 CO2_KG_PER_KWH = float(os.getenv("CO2_KG_PER_KWH", "0.82"))
 INR_PER_KWH = float(os.getenv("INR_PER_KWH", "8.0"))
+# Energy ledger (apps.kpi.energy): KPIs are booked once this old, so late ones are still
+# in order; samples further apart than ENERGY_MAX_GAP_SECONDS are not integrated across
+ENERGY_LAG_SECONDS = int(os.getenv("ENERGY_LAG_SECONDS", "600"))
+ENERGY_MAX_GAP_SECONDS = int(os.getenv("ENERGY_MAX_GAP_SECONDS", "300"))
 
 # Reports
 REPORTS_DIR = os.getenv("REPORTS_DIR", "/data/reports")
 os.makedirs(REPORTS_DIR, exist_ok=True)
+REPORTS_EXPORT_BATCH_ROWS = int(os.getenv("REPORTS_EXPORT_BATCH_ROWS", "50000"))
 
 # MQTT
 MQTT_BROKER = os.getenv("MQTT_BROKER", "localhost")
 MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+# mqtt_consumer scale-out: N processes x M worker threads. Processes keep fixed series partitions
+# (each receives the whole stream); a $share/<group>/... subscription splits it across hosts instead,
+# with per-series ordering only within a consumer
+MQTT_CONSUMER_PROCESSES = int(os.getenv("MQTT_CONSUMER_PROCESSES", "1"))
+MQTT_CONSUMER_WORKERS = int(os.getenv("MQTT_CONSUMER_WORKERS", "4"))
+MQTT_SHARE_GROUP = os.getenv("MQTT_SHARE_GROUP", "")
+# Subscription QoS; with MQTT_ACK_AFTER_STORE=1 QoS1 messages are acked only once stored or spooled
+MQTT_SUBSCRIBE_QOS = int(os.getenv("MQTT_SUBSCRIBE_QOS", "0"))
+MQTT_ACK_AFTER_STORE = os.getenv("MQTT_ACK_AFTER_STORE", "0") == "1"
+# Connect with MQTT v5 even without a share group (needed for content-type codec selection)
+MQTT_V5 = os.getenv("MQTT_V5", "0") == "1"
+# Prometheus exporter port of mqtt_consumer (worker process i listens on port + i; 0 = off)
+MQTT_CONSUMER_METRICS_PORT = int(os.getenv("MQTT_CONSUMER_METRICS_PORT", "9108"))
+
+# Telemetry ingest (mqtt_consumer buffered writes)
+TELEMETRY_BATCH_SIZE = int(os.getenv("TELEMETRY_BATCH_SIZE", "1000"))
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv("TELEMETRY_FLUSH_INTERVAL", "1.0"))
+# Store telemetry in a native time-series collection (telemetry_ts) instead of `telemetry`
+TELEMETRY_TIMESERIES = os.getenv("TELEMETRY_TIMESERIES", "0") == "1"
+# Telemetry rollups (1m/15m/1h) and which tier TelemetryQueryView reads
+TELEMETRY_ROLLUP_RETENTION_DAYS = {
+    "1m": int(os.getenv("TELEMETRY_ROLLUP_1M_RETENTION_DAYS", "30")),
+    "15m": int(os.getenv("TELEMETRY_ROLLUP_15M_RETENTION_DAYS", "365")),
+    "1h": int(os.getenv("TELEMETRY_ROLLUP_1H_RETENTION_DAYS", "1825")),
+}
+TELEMETRY_ROLLUP_LAG_SECONDS = int(os.getenv("TELEMETRY_ROLLUP_LAG_SECONDS", "30"))
+TELEMETRY_RAW_MAX_SPAN_SECONDS = int(os.getenv("TELEMETRY_RAW_MAX_SPAN_SECONDS", str(6 * 3600)))
+# mqtt_consumer on-disk spool for batches Mongo cannot take (apps.telemetry.spool); empty dir = off
+TELEMETRY_SPOOL_DIR = os.getenv("TELEMETRY_SPOOL_DIR", "/data/spool/telemetry")
+TELEMETRY_SPOOL_MAX_MB = int(os.getenv("TELEMETRY_SPOOL_MAX_MB", "1024"))
+TELEMETRY_SPOOL_SEGMENT_MB = int(os.getenv("TELEMETRY_SPOOL_SEGMENT_MB", "64"))
+TELEMETRY_SPOOL_FSYNC = os.getenv("TELEMETRY_SPOOL_FSYNC", "interval")
+TELEMETRY_SPOOL_FSYNC_INTERVAL = float(os.getenv("TELEMETRY_SPOOL_FSYNC_INTERVAL", "1.0"))
+# Recent sample keys the MQTT consumer remembers to drop redelivered duplicates (0 = off)
+TELEMETRY_DEDUP_CACHE_SIZE = int(os.getenv("TELEMETRY_DEDUP_CACHE_SIZE", "200000"))
+# REST bulk ingest (rows per insert_many)
+TELEMETRY_BULK_CHUNK = int(os.getenv("TELEMETRY_BULK_CHUNK", "5000"))
+# Last sample per segment/asset kept in Redis by the ingest paths (apps.telemetry.latest)
+TELEMETRY_LATEST_ENABLED = os.getenv("TELEMETRY_LATEST_ENABLED", "1") == "1"
+TELEMETRY_LATEST_REDIS_URL = os.getenv("TELEMETRY_LATEST_REDIS_URL", REDIS_URL)
+
+# Segment KPIs computed by mqtt_consumer as telemetry is stored (apps.kpi.stream);
+# compute_kpis then only reconciles, every KPI_RECONCILE_MINUTES
+KPI_STREAM_ENABLED = os.getenv("KPI_STREAM_ENABLED", "1") == "1"
+KPI_STREAM_CADENCE = float(os.getenv("KPI_STREAM_CADENCE", "10"))
+KPI_RECONCILE_MINUTES = int(os.getenv("KPI_RECONCILE_MINUTES", "5" if KPI_STREAM_ENABLED else "1"))
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.urls import path, include
+from apps.common.metrics import metrics_view
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -10,4 +11,5 @@ urlpatterns = [
     path("api/alerts/", include("apps.alerts.urls")),
     path("api/maintenance/", include("apps.maintenance.urls")),
     path("api/reports/", include("apps.reports.urls")),
+    path("metrics", metrics_view),
 ]
@@ -4,10 +4,23 @@ import time
 import math
 import random
 from datetime import datetime, timezone
+import cbor2
+import msgpack
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 
 BROKER = os.getenv("MQTT_HOST", os.getenv("MQTT_BROKER", "mosquitto"))
 PORT = int(os.getenv("MQTT_PORT", "1883"))
+# json | msgpack | cbor; binary codecs go to .../telemetry/<codec> unless CODEC_VIA=content-type (MQTT v5)
+CODEC = os.getenv("TELEMETRY_CODEC", "json")
+CODEC_VIA = os.getenv("CODEC_VIA", "topic")
+CONTENT_TYPES = {"json": "application/json", "msgpack": "application/msgpack", "cbor": "application/cbor"}
+
+# short keys of the binary format (backend/apps/telemetry/codec.py)
+SHORT_KEYS = {"temps": "T", "flow": "f", "pressure": "p", "kw_gross": "kw", "kwh_total": "kwh",
+              "fan_power": "fp", "pump_power": "pp", "pcm_temp": "pcm"}
+SHORT_TEMP_KEYS = {"surface": "s", "subsurface": "ss", "inlet": "i", "outlet": "o"}
 
 def iso_now():
     return datetime.now(timezone.utc).isoformat()
@@ -78,6 +91,14 @@ def simulate_segment(seg_id: str, base_lat: float, base_lng: float, t_sec: float
 
 
 
+def encode(payload, codec):
+    if codec == "json":
+        return json.dumps(payload)
+    out = {SHORT_KEYS.get(k, k): v for k, v in payload.items() if k != "timestamp"}
+    out["T"] = {SHORT_TEMP_KEYS.get(k, k): v for k, v in payload["temps"].items()}
+    out["t"] = int(datetime.fromisoformat(payload["timestamp"]).timestamp() * 1000)
+    return msgpack.packb(out) if codec == "msgpack" else cbor2.dumps(out)
+
 def connect_with_retry(client, host, port, retries=60, delay=1.0):
     print(f"[simulator] Connecting to MQTT broker {host}:{port}")
     for i in range(retries):
@@ -92,7 +113,15 @@ def connect_with_retry(client, host, port, retries=60, delay=1.0):
 
 
 def main():
-    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    v5 = CODEC != "json" and CODEC_VIA == "content-type"
+    if v5:
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv5)
+        props = Properties(PacketTypes.PUBLISH)
+        props.ContentType = CONTENT_TYPES[CODEC]
+    else:
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        props = None
+    suffix = f"/{CODEC}" if CODEC != "json" and not v5 else ""
     connect_with_retry(client, BROKER, PORT)
     client.loop_start()
 
@@ -116,8 +145,8 @@ def main():
         t_sec = time.time()
         for (c, z, seg_id) in segs:
             payload = simulate_segment(seg_id, 28.6, 77.1, t_sec, states[seg_id])
-            topic = f"city/{c}/segment/{seg_id}/telemetry"
-            client.publish(topic, json.dumps(payload), qos=0, retain=False)
+            topic = f"city/{c}/segment/{seg_id}/telemetry{suffix}"
+            client.publish(topic, encode(payload, CODEC), qos=0, retain=False, properties=props)
         time.sleep(5)
 
 if __name__ == "__main__":